@@ -0,0 +1,176 @@
+# Funciones/calificaciones.py
+#
+# Agregados de calificación guardados en el glamping: `ratingSum` y `ratingCount`
+# se ajustan al agregar o eliminar una evaluación y `calificacion` (la que usa
+# el ordenamiento de búsqueda) se deriva de ellos en la misma escritura.
+# Los glampings anteriores a estos campos se completan con
+# `python -m Funciones.recalcular_calificaciones`; las lecturas nunca escriben.
+
+from pymongo import MongoClient, ReturnDocument
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from typing import Dict, Any, Optional, List
+import os
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+ConexionMongo = MongoClient(MONGO_URI)
+db = ConexionMongo["glamperos"]
+
+coleccion_glampings = db["glampings"]
+coleccion_evaluaciones = db["evaluaciones"]
+
+# Calificación de un glamping sin evaluaciones (la misma con la que se crea)
+CALIFICACION_INICIAL = 5
+
+PROYECCION_AGREGADOS = {"ratingSum": 1, "ratingCount": 1, "calificacion": 1}
+
+# Resúmenes recientes por glamping (las páginas de listado piden los mismos una y otra vez).
+# Se invalidan al agregar o eliminar una evaluación en esta instancia.
+_resumenes: TTLCache = TTLCache(
+    maxsize=int(os.getenv("CALIFICACIONES_CACHE_MAX", "2048")),
+    ttl=float(os.getenv("CALIFICACIONES_CACHE_SEGUNDOS", "60")),
+)
+
+
+
+def _oid(glamping_id) -> Optional[ObjectId]:
+    try:
+        return ObjectId(str(glamping_id))
+    except (InvalidId, TypeError):
+        return None
+
+
+def _derivar_calificacion() -> Dict[str, Any]:
+    """Etapa de pipeline: calificacion = ratingSum / ratingCount (o la inicial si no hay)."""
+    return {"$set": {"calificacion": {"$cond": [
+        {"$gt": ["$ratingCount", 0]},
+        {"$divide": ["$ratingSum", "$ratingCount"]},
+        CALIFICACION_INICIAL,
+    ]}}}
+
+
+def agregados_desde_evaluaciones(glamping_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    {"ratingSum", "ratingCount"} de cada glamping calculados desde sus
+    evaluaciones, en una sola agregación (usa el índice que empieza por glamping_id).
+    Solo lee; los glampings sin evaluaciones quedan en 0.
+    """
+    agregados = {str(g): {"ratingSum": 0, "ratingCount": 0} for g in glamping_ids}
+    for fila in coleccion_evaluaciones.aggregate([
+        {"$match": {"glamping_id": {"$in": list(agregados)}}},
+        {"$group": {"_id": "$glamping_id", "suma": {"$sum": "$calificacion"}, "conteo": {"$sum": 1}}},
+    ]):
+        agregados[fila["_id"]] = {"ratingSum": fila["suma"], "ratingCount": fila["conteo"]}
+    return agregados
+
+
+def recalcular_calificacion(glamping_id: str, solo_si_faltan: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Recalcula y guarda los agregados desde las evaluaciones (glampings anteriores
+    a estos campos). Con `solo_si_faltan` la escritura se condiciona a que el
+    glamping aún no tenga `ratingCount`. Retorna los campos guardados o None si
+    el glamping no existe (o ya tenía agregados, con `solo_si_faltan`).
+    """
+    oid = _oid(glamping_id)
+    if not oid:
+        return None
+    agregados = agregados_desde_evaluaciones([str(glamping_id)])[str(glamping_id)]
+    _resumenes.pop(str(glamping_id), None)
+    filtro: Dict[str, Any] = {"_id": oid}
+    if solo_si_faltan:
+        filtro["ratingCount"] = {"$exists": False}
+    return coleccion_glampings.find_one_and_update(
+        filtro,
+        [{"$set": agregados}, _derivar_calificacion()],
+        projection=PROYECCION_AGREGADOS,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def sumar_calificacion(glamping_id: str, calificacion: float, signo: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    Suma (signo=1) o resta (signo=-1) una evaluación a los agregados del glamping
+    en una sola escritura atómica. Si el glamping aún no tenía agregados, los
+    calcula desde las evaluaciones (que ya incluyen el cambio) solo si nadie lo
+    hizo entretanto; si otro proceso se adelantó, se vuelve a la suma atómica
+    en vez de sobrescribir sus agregados.
+    """
+    oid = _oid(glamping_id)
+    if not oid:
+        return None
+    _resumenes.pop(str(glamping_id), None)
+    for _ in range(2):
+        actualizado = coleccion_glampings.find_one_and_update(
+            {"_id": oid, "ratingCount": {"$exists": True}},
+            [
+                {"$set": {
+                    "ratingSum": {"$add": ["$ratingSum", signo * float(calificacion)]},
+                    "ratingCount": {"$max": [0, {"$add": ["$ratingCount", signo]}]},
+                }},
+                _derivar_calificacion(),
+            ],
+            projection=PROYECCION_AGREGADOS,
+            return_document=ReturnDocument.AFTER,
+        )
+        if actualizado is not None:
+            return actualizado
+        inicializado = recalcular_calificacion(glamping_id, solo_si_faltan=True)
+        if inicializado is not None:
+            return inicializado
+        if not coleccion_glampings.find_one({"_id": oid}, {"_id": 1}):
+            return None
+    return None
+
+
+def _resumen(glamping: Dict[str, Any]) -> Dict[str, Any]:
+    conteo = glamping.get("ratingCount") or 0
+    return {
+        "promedio": glamping["ratingSum"] / conteo if conteo else None,
+        "conteo": conteo,
+    }
+
+
+def resumenes_calificacion(glamping_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    {"promedio", "conteo"} de varios glampings: los que no están en caché se leen
+    en una sola consulta por _id. Un id inválido o inexistente queda en None.
+    Los glampings aún sin agregados se resumen desde sus evaluaciones sin
+    guardar nada (eso lo hace el script recalcular_calificaciones).
+    """
+    resultado: Dict[str, Optional[Dict[str, Any]]] = {}
+    faltantes: Dict[ObjectId, str] = {}
+    for glamping_id in glamping_ids:
+        if glamping_id in _resumenes:
+            resultado[glamping_id] = _resumenes[glamping_id]
+            continue
+        oid = _oid(glamping_id)
+        resultado[glamping_id] = None
+        if oid:
+            faltantes[oid] = glamping_id
+
+    if faltantes:
+        encontrados: Dict[str, Dict[str, Any]] = {}
+        sin_agregados = []
+        for glamping in coleccion_glampings.find({"_id": {"$in": list(faltantes)}}, PROYECCION_AGREGADOS):
+            glamping_id = faltantes[glamping["_id"]]
+            encontrados[glamping_id] = glamping
+            if "ratingCount" not in glamping:
+                sin_agregados.append(glamping_id)
+        if sin_agregados:
+            for glamping_id, agregados in agregados_desde_evaluaciones(sin_agregados).items():
+                encontrados[glamping_id] = agregados
+        for glamping_id, glamping in encontrados.items():
+            resumen = _resumen(glamping)
+            _resumenes[glamping_id] = resumen
+            resultado[glamping_id] = resumen
+    return resultado
+
+
+def resumen_calificacion(glamping_id: str) -> Optional[Dict[str, Any]]:
+    """{"promedio", "conteo"} desde los campos del glamping; None si no existe."""
+    return resumenes_calificacion([glamping_id]).get(glamping_id)
+
+
+def tiene_evaluaciones(glamping_id: str) -> bool:
+    return coleccion_evaluaciones.find_one({"glamping_id": str(glamping_id)}, {"_id": 1}) is not None
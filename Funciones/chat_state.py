@@ -1,7 +1,12 @@
 # Funciones/chat_state.py
 
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from cachetools import LRUCache, TTLCache
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Any, Optional
+import copy
 import os
 
 # 🔗 Conexión a MongoDB (igual que tú)
@@ -12,46 +17,127 @@ db = ConexionMongo["glamperos"]
 # 📦 Colección para estados de chat
 coleccion_chat_states = db["chat_states"]
 
-# (Opcional) Expiración de estado: si alguien vuelve después de mucho tiempo, reiniciar flujo
+# (Opcional) Expiración de estado: si alguien vuelve después de mucho tiempo, reiniciar flujo.
+# La hace Mongo con un índice TTL sobre updated_at; la caché usa el mismo tiempo.
 STATE_TTL_MINUTES = int(os.getenv("WHATSAPP_STATE_TTL_MINUTES", "60"))
+STATE_CACHE_MAX = int(os.getenv("WHATSAPP_STATE_CACHE_MAX", "5000"))
+
+ESTADO_INICIAL = {"state": "MENU", "context": {}}
+
+try:
+    coleccion_chat_states.create_index([("phone", ASCENDING)], unique=True)
+except Exception as e:
+    print(f"⚠️ No se pudo crear el índice de phone en chat_states: {e}")
+
+try:
+    if STATE_TTL_MINUTES > 0:
+        coleccion_chat_states.create_index(
+            [("updated_at", ASCENDING)],
+            expireAfterSeconds=STATE_TTL_MINUTES * 60,
+        )
+except Exception as e:
+    # Si ya existía con otro tiempo, ajustarlo: collMod -> index.expireAfterSeconds
+    print(f"⚠️ No se pudo crear el índice TTL de chat_states: {e}")
+
+# Caché write-through por teléfono: (version, estado). Cada escritura en Mongo
+# incrementa `version`; con varios procesos (workers de uvicorn o instancias)
+# los mensajes de un número pueden caer en procesos distintos, así que antes de
+# usar la copia en memoria se compara su versión con la de Mongo (una lectura
+# pequeña por el índice de phone, sin traer el contexto). Solo con un único proceso
+# (WHATSAPP_STATE_UN_PROCESO=1) se confía en la caché sin leer Mongo.
+STATE_UN_PROCESO = os.getenv("WHATSAPP_STATE_UN_PROCESO", "0") == "1"
+
+if STATE_TTL_MINUTES > 0:
+    _cache: Any = TTLCache(maxsize=STATE_CACHE_MAX, ttl=STATE_TTL_MINUTES * 60)
+else:
+    _cache = LRUCache(maxsize=STATE_CACHE_MAX)
+
+# Escrituras pendientes mientras se procesa un mensaje (ver escritura_agrupada)
+_pendientes: ContextVar[Optional[Dict[str, Dict[str, Any]]]] = ContextVar("chat_state_pendientes", default=None)
+
+
+def _leer(phone: str) -> Dict[str, Any]:
+    doc = coleccion_chat_states.find_one({"phone": phone}, {"state": 1, "context": 1, "version": 1})
+    if doc:
+        estado = {
+            "state": doc.get("state", "MENU"),
+            "context": doc.get("context", {}) or {},
+        }
+        _cache[phone] = (doc.get("version"), estado)
+    else:
+        estado = copy.deepcopy(ESTADO_INICIAL)
+        _cache.pop(phone, None)
+    return estado
+
 
 def get_state(phone: str):
     """
     Retorna dict: {"state": "...", "context": {...}}
     Si no existe o expiró, retorna MENU.
     """
-    doc = coleccion_chat_states.find_one({"phone": phone})
-    if not doc:
-        return {"state": "MENU", "context": {}}
-
-    updated_at = doc.get("updated_at")
-    if updated_at and STATE_TTL_MINUTES > 0:
-        if datetime.utcnow() - updated_at > timedelta(minutes=STATE_TTL_MINUTES):
-            # expiró: reiniciar
-            reset_state(phone)
-            return {"state": "MENU", "context": {}}
-
-    return {
-        "state": doc.get("state", "MENU"),
-        "context": doc.get("context", {}) or {}
-    }
+    pendientes = _pendientes.get()
+    if pendientes is not None and phone in pendientes:
+        return copy.deepcopy(pendientes[phone])
 
-def set_state(phone: str, state: str, context: dict = None):
-    """
-    Guarda estado y contexto.
-    """
-    coleccion_chat_states.update_one(
+    en_cache = _cache.get(phone)
+    if en_cache is None:
+        return copy.deepcopy(_leer(phone))
+    version, estado = en_cache
+    if not STATE_UN_PROCESO:
+        actual = coleccion_chat_states.find_one({"phone": phone}, {"version": 1})
+        if actual is None or actual.get("version") != version:
+            # Otro proceso lo avanzó (o Mongo lo expiró): la copia está vieja
+            return copy.deepcopy(_leer(phone))
+    return copy.deepcopy(estado)
+
+
+def _guardar(phone: str, estado: Dict[str, Any]):
+    doc = coleccion_chat_states.find_one_and_update(
         {"phone": phone},
         {
             "$set": {
                 "phone": phone,
-                "state": state,
-                "context": context or {},
+                "state": estado["state"],
+                "context": estado["context"],
                 "updated_at": datetime.utcnow(),
-            }
+            },
+            "$inc": {"version": 1},
         },
-        upsert=True
+        upsert=True,
+        projection={"version": 1},
+        return_document=ReturnDocument.AFTER,
     )
+    _cache[phone] = (doc.get("version"), estado)
+
+
+def set_state(phone: str, state: str, context: dict = None):
+    """
+    Guarda estado y contexto (en Mongo y en caché). Dentro de
+    escritura_agrupada() la escritura a Mongo se hace una sola vez al final.
+    """
+    estado = {"state": state, "context": copy.deepcopy(context or {})}
+    pendientes = _pendientes.get()
+    if pendientes is not None:
+        pendientes[phone] = estado
+        return
+    _guardar(phone, estado)
+
 
 def reset_state(phone: str):
     set_state(phone, "MENU", {})
+
+
+@contextmanager
+def escritura_agrupada():
+    """
+    Agrupa los set_state de un mensaje: solo se escribe a Mongo el último
+    estado de cada teléfono, al salir del bloque (aunque haya un error).
+    """
+    pendientes: Dict[str, Dict[str, Any]] = {}
+    token = _pendientes.set(pendientes)
+    try:
+        yield
+    finally:
+        _pendientes.reset(token)
+        for phone, estado in pendientes.items():
+            _guardar(phone, estado)
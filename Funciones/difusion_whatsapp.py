@@ -0,0 +1,287 @@
+# Funciones/difusion_whatsapp.py
+#
+# Difusiones (campañas) de plantillas de WhatsApp a una audiencia de
+# `whatsapp_leads`. Cada difusión recorre su audiencia por _id en lotes, envía
+# con límite de tasa y concurrencia acotada, guarda el estado de cada
+# destinatario con bulk_write y deja un punto de control (último _id) para
+# poder reanudar si se pausa o se cae la app.
+
+from pymongo import MongoClient, ASCENDING, UpdateOne, ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson.objectid import ObjectId
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Any, List, Optional, Set
+import os
+import asyncio
+
+from rutas.whatsapp_utils import _post_whatsapp
+from utils.limitador import LimitadorTasa
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+
+# Endpoints: pymongo (como el resto de rutas)
+ConexionMongo = MongoClient(MONGO_URI)
+db = ConexionMongo["glamperos"]
+coleccion_difusiones = db["whatsapp_difusiones"]
+coleccion_envios = db["whatsapp_difusion_envios"]
+
+# Envío: motor, para no bloquear el event loop entre lotes
+_cliente_async = AsyncIOMotorClient(MONGO_URI)
+_db_async = _cliente_async["glamperos"]
+_difusiones_async = _db_async["whatsapp_difusiones"]
+_envios_async = _db_async["whatsapp_difusion_envios"]
+_leads_async = _db_async["whatsapp_leads"]
+
+TAMANO_LOTE = int(os.getenv("WHATSAPP_DIFUSION_LOTE", "200"))
+CONCURRENCIA = int(os.getenv("WHATSAPP_DIFUSION_CONCURRENCIA", "10"))
+TASA_POR_SEGUNDO = float(os.getenv("WHATSAPP_DIFUSION_TASA", "20"))
+# Si la instancia que corría una difusión muere, otra la puede retomar pasado este tiempo
+BLOQUEO_SEG = int(os.getenv("WHATSAPP_DIFUSION_BLOQUEO_SEGUNDOS", "300"))
+
+# Tope de las difusiones de esta instancia. Cada envío además pasa por la
+# cubeta del número en _post_whatsapp (compartida con el bot y el outbox), así
+# que una difusión no suma throughput propio ni deja sin cupo al bot.
+_limitador = LimitadorTasa(TASA_POR_SEGUNDO)
+_tareas: Dict[str, asyncio.Task] = {}
+
+try:
+    coleccion_envios.create_index([("difusion_id", ASCENDING), ("phone", ASCENDING)], unique=True)
+    coleccion_envios.create_index([("difusion_id", ASCENDING), ("estado", ASCENDING)])
+    coleccion_difusiones.create_index([("estado", ASCENDING), ("creado", ASCENDING)])
+except Exception as e:
+    print(f"⚠️ No se pudieron crear los índices de difusiones: {e}")
+
+
+# =========================
+# CREAR / CONSULTAR
+# =========================
+def filtro_audiencia(
+    fuentes: Optional[List[str]] = None,
+    ciudades: Optional[List[str]] = None,
+    estados: Optional[List[str]] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+) -> Dict[str, Any]:
+    """
+    Filtro sobre whatsapp_leads armado aquí a partir de campos conocidos (nunca
+    se recibe un filtro Mongo crudo). Las listas vacías no filtran; `desde` y
+    `hasta` acotan `created_at` con ambos días incluidos.
+    """
+    filtro: Dict[str, Any] = {}
+    if fuentes:
+        filtro["source"] = {"$in": [str(f) for f in fuentes]}
+    if ciudades:
+        filtro["city"] = {"$in": [str(c) for c in ciudades]}
+    if estados:
+        filtro["status"] = {"$in": [str(e) for e in estados]}
+    # created_at se guarda como datetime UTC sin zona (datetime.utcnow)
+    rango: Dict[str, datetime] = {}
+    if desde:
+        rango["$gte"] = datetime.combine(desde, time.min)
+    if hasta:
+        rango["$lt"] = datetime.combine(hasta + timedelta(days=1), time.min)
+    if rango:
+        filtro["created_at"] = rango
+    return filtro
+
+
+def crear_difusion(
+    nombre: str,
+    plantilla: str,
+    idioma: str,
+    parametros: List[str],
+    audiencia: Dict[str, Any],
+) -> str:
+    """
+    Registra una difusión pendiente. `audiencia` es el filtro sobre whatsapp_leads
+    (armado con filtro_audiencia); en `parametros`, los que empiezan por "$" se toman del lead (p. ej. "$city").
+    """
+    ahora = datetime.now(timezone.utc)
+    resultado = coleccion_difusiones.insert_one({
+        "nombre": nombre,
+        "plantilla": plantilla,
+        "idioma": idioma,
+        "parametros": parametros,
+        "audiencia": audiencia,
+        "estado": "pendiente",
+        "ultimo_id": None,
+        "enviados": 0,
+        "fallidos": 0,
+        "omitidos": 0,
+        "creado": ahora,
+        "actualizado": ahora,
+    })
+    return str(resultado.inserted_id)
+
+
+def obtener_difusion(difusion_id: str) -> Optional[Dict[str, Any]]:
+    difusion = coleccion_difusiones.find_one({"_id": ObjectId(difusion_id)})
+    if not difusion:
+        return None
+    difusion["_id"] = str(difusion["_id"])
+    if difusion.get("ultimo_id"):
+        difusion["ultimo_id"] = str(difusion["ultimo_id"])
+    return difusion
+
+
+def pausar_difusion(difusion_id: str) -> bool:
+    """La difusión se detiene al terminar el lote en curso."""
+    res = coleccion_difusiones.update_one(
+        {"_id": ObjectId(difusion_id), "estado": {"$in": ["pendiente", "en_curso"]}},
+        {"$set": {"estado": "pausada", "actualizado": datetime.now(timezone.utc)}},
+    )
+    return res.modified_count == 1
+
+
+# =========================
+# ENVÍO
+# =========================
+def _cuerpo_plantilla(difusion: Dict[str, Any], lead: Dict[str, Any]) -> Dict[str, Any]:
+    parametros = []
+    for valor in difusion.get("parametros") or []:
+        if isinstance(valor, str) and valor.startswith("$"):
+            valor = lead.get(valor[1:]) or (lead.get("context") or {}).get(valor[1:]) or ""
+        parametros.append({"type": "text", "text": str(valor)})
+    plantilla = {"name": difusion["plantilla"], "language": {"code": difusion.get("idioma") or "es"}}
+    if parametros:
+        plantilla["components"] = [{"type": "body", "parameters": parametros}]
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": lead["phone"],
+        "type": "template",
+        "template": plantilla,
+    }
+
+
+async def _tomar_difusion(oid: ObjectId) -> Optional[Dict[str, Any]]:
+    """Marca la difusión como en curso si nadie más la está corriendo."""
+    ahora = datetime.now(timezone.utc)
+    return await _difusiones_async.find_one_and_update(
+        {"_id": oid, "$or": [
+            {"estado": {"$in": ["pendiente", "pausada"]}},
+            {"estado": "en_curso", "bloqueado_hasta": {"$lte": ahora}},
+        ]},
+        {"$set": {
+            "estado": "en_curso",
+            "bloqueado_hasta": ahora + timedelta(seconds=BLOQUEO_SEG),
+            "actualizado": ahora,
+        }},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _enviar_lote(difusion: Dict[str, Any], leads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    semaforo = asyncio.Semaphore(CONCURRENCIA)
+
+    async def enviar(lead):
+        async with semaforo:
+            await _limitador.adquirir()
+            ok = await _post_whatsapp(
+                _cuerpo_plantilla(difusion, lead),
+                f"Difusión {difusion['_id']} a {lead['phone']}",
+            )
+            return {"phone": lead["phone"], "lead_id": lead["_id"], "estado": "enviado" if ok else "fallido"}
+
+    return await asyncio.gather(*(enviar(lead) for lead in leads))
+
+
+async def ejecutar_difusion(difusion_id: str):
+    """Corre (o reanuda) una difusión desde su último punto de control."""
+    oid = ObjectId(difusion_id)
+    difusion = await _tomar_difusion(oid)
+    if not difusion:
+        print(f"⚠️ Difusión {difusion_id}: no existe, ya terminó o la corre otra instancia")
+        return
+
+    inicio = datetime.now(timezone.utc)
+    print(f"📣 Difusión {difusion_id} ({difusion['nombre']}) desde {difusion.get('ultimo_id') or 'el inicio'}")
+    ultimo_id = difusion.get("ultimo_id")
+
+    while True:
+        filtro = dict(difusion.get("audiencia") or {})
+        filtro["phone"] = {"$nin": [None, ""]}
+        if ultimo_id:
+            filtro["_id"] = {"$gt": ultimo_id}
+        leads = await _leads_async.find(filtro, {"phone": 1, "city": 1, "source": 1, "context": 1}) \
+            .sort("_id", ASCENDING).limit(TAMANO_LOTE).to_list(TAMANO_LOTE)
+        if not leads:
+            break
+        ultimo_id = leads[-1]["_id"]
+
+        # Un mensaje por teléfono: fuera los repetidos del lote y los ya atendidos
+        vistos: Set[str] = set()
+        unicos = []
+        for lead in leads:
+            if lead["phone"] not in vistos:
+                vistos.add(lead["phone"])
+                unicos.append(lead)
+        ya_enviados = set(await _envios_async.distinct(
+            "phone", {"difusion_id": oid, "phone": {"$in": list(vistos)}, "estado": "enviado"}
+        ))
+        pendientes = [lead for lead in unicos if lead["phone"] not in ya_enviados]
+
+        resultados = await _enviar_lote(difusion, pendientes) if pendientes else []
+
+        ahora = datetime.now(timezone.utc)
+        if resultados:
+            await _envios_async.bulk_write([
+                UpdateOne(
+                    {"difusion_id": oid, "phone": r["phone"]},
+                    {
+                        "$set": {"estado": r["estado"], "lead_id": r["lead_id"], "actualizado": ahora},
+                        "$inc": {"intentos": 1},
+                    },
+                    upsert=True,
+                )
+                for r in resultados
+            ], ordered=False)
+
+        enviados = sum(1 for r in resultados if r["estado"] == "enviado")
+        # Punto de control: si la app se cae, se retoma después de este lote
+        difusion = await _difusiones_async.find_one_and_update(
+            {"_id": oid},
+            {
+                "$set": {
+                    "ultimo_id": ultimo_id,
+                    "actualizado": ahora,
+                    "bloqueado_hasta": ahora + timedelta(seconds=BLOQUEO_SEG),
+                },
+                "$inc": {
+                    "enviados": enviados,
+                    "fallidos": len(resultados) - enviados,
+                    "omitidos": len(leads) - len(resultados),
+                },
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if difusion["estado"] != "en_curso":
+            print(f"⏸️ Difusión {difusion_id} {difusion['estado']} en {ultimo_id}")
+            return
+
+    segundos = (datetime.now(timezone.utc) - inicio).total_seconds()
+    await _difusiones_async.update_one(
+        {"_id": oid, "estado": "en_curso"},
+        {"$set": {"estado": "completada", "terminado": datetime.now(timezone.utc)}, "$unset": {"bloqueado_hasta": ""}},
+    )
+    print(f"✅ Difusión {difusion_id} completada en {segundos:.0f}s")
+
+
+def lanzar_difusion(difusion_id: str) -> bool:
+    """Corre la difusión en segundo plano; False si ya hay una tarea activa para ella."""
+    tarea = _tareas.get(difusion_id)
+    if tarea and not tarea.done():
+        return False
+
+    async def correr():
+        try:
+            await ejecutar_difusion(difusion_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"🚨 Difusión {difusion_id} falló: {e}")
+        finally:
+            _tareas.pop(difusion_id, None)
+
+    _tareas[difusion_id] = asyncio.create_task(correr())
+    return True
@@ -0,0 +1,27 @@
+from dotenv import load_dotenv
+import os
+from pymongo import MongoClient
+
+# 🔄 Cargar variables desde .env
+load_dotenv()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["glamperos"]
+
+# Ejecutar desde la raíz: python -m Funciones.migrar_conversacion_mensajes
+# Agrega a los mensajes viejos la clave `conversacion` (los dos ids ordenados,
+# unidos por "|", igual que clave_conversacion en rutas/mensajeria.py).
+# Sin ella no aparecen en /mensajes/obtener_mensajes.
+emisor = {"$toString": "$emisor"}
+receptor = {"$toString": "$receptor"}
+resultado = db["mensajes"].update_many(
+    {"conversacion": {"$exists": False}, "emisor": {"$ne": None}, "receptor": {"$ne": None}},
+    [{"$set": {"conversacion": {"$cond": [
+        {"$lte": [emisor, receptor]},
+        {"$concat": [emisor, "|", receptor]},
+        {"$concat": [receptor, "|", emisor]},
+    ]}}}],
+)
+
+print(f"✅ Mensajes con clave de conversación: {resultado.modified_count}")
@@ -0,0 +1,22 @@
+from dotenv import load_dotenv
+import os
+from pymongo import MongoClient
+
+# 🔄 Cargar variables desde .env
+load_dotenv()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["glamperos"]
+
+from Funciones.periodos_reservados import modificar_periodos, PROYECCION_PERIODOS
+
+# Ejecutar desde la raíz: python -m Funciones.migrar_periodos_reservados
+# Convierte los arreglos de fechas por noche en periodos (inicio, fin, fuente)
+# y elimina los arreglos. Los documentos ya migrados se omiten.
+migrados = 0
+for glamping in db["glampings"].find({"periodosReservados": {"$exists": False}}, PROYECCION_PERIODOS):
+    modificar_periodos(glamping["_id"], lambda periodos: periodos, documento=glamping)
+    migrados += 1
+
+print(f"✅ Glampings migrados a periodos: {migrados}")
@@ -0,0 +1,253 @@
+# Funciones/outbox.py
+#
+# Bandeja de salida de notificaciones. Los productores (webhook de pagos, bonos)
+# solo encolan un documento en Mongo; un grupo de workers asíncronos los envía
+# con reintentos y límite de tasa por proveedor.
+
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+import os
+import random
+import asyncio
+import resend
+
+from rutas.whatsapp_utils import enviar_graph, cuerpo_whatsapp_texto
+from utils.limitador import LimitadorTasa
+from utils.circuit_breaker import breaker, con_plazo
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+
+# Productores: pymongo (como el resto de rutas)
+ConexionMongo = MongoClient(MONGO_URI)
+coleccion_outbox = ConexionMongo["glamperos"]["notificaciones_outbox"]
+
+# Workers: motor, para no bloquear el event loop mientras esperan trabajos
+_cliente_async = AsyncIOMotorClient(MONGO_URI)
+_coleccion_async = _cliente_async["glamperos"]["notificaciones_outbox"]
+
+resend.api_key = resend.api_key or os.getenv("RESEND_API_KEY")
+
+# Tipos de trabajo y el proveedor que los envía
+TIPOS = {
+    "email": "resend",
+    "whatsapp_template": "whatsapp",
+    "whatsapp_texto": "whatsapp",
+}
+
+NUM_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "6"))
+BACKOFF_BASE_SEG = float(os.getenv("OUTBOX_BACKOFF_SEGUNDOS", "5"))
+BACKOFF_MAX_SEG = float(os.getenv("OUTBOX_BACKOFF_MAX_SEGUNDOS", "900"))
+# Si un worker muere con un trabajo tomado, otro lo retoma pasado este tiempo
+BLOQUEO_SEG = int(os.getenv("OUTBOX_BLOQUEO_SEGUNDOS", "120"))
+ESPERA_SIN_TRABAJO_SEG = float(os.getenv("OUTBOX_ESPERA_SEGUNDOS", "2"))
+# Los enviados se borran solos pasado este tiempo
+DIAS_RETENCION_ENVIADOS = int(os.getenv("OUTBOX_DIAS_RETENCION", "15"))
+
+# Límite de envíos por segundo de cada proveedor (compartido por todos los workers).
+# WhatsApp no está aquí: _post_whatsapp usa la cubeta del número, compartida
+# con el bot y las difusiones.
+LIMITADORES = {
+    "resend": LimitadorTasa(float(os.getenv("OUTBOX_TASA_RESEND", "2"))),
+}
+
+try:
+    coleccion_outbox.create_index([("estado", ASCENDING), ("siguiente_intento", ASCENDING)])
+    coleccion_outbox.create_index(
+        [("enviado", ASCENDING)],
+        expireAfterSeconds=DIAS_RETENCION_ENVIADOS * 24 * 3600,
+    )
+except Exception as e:
+    print(f"⚠️ No se pudieron crear los índices del outbox: {e}")
+
+# Respuestas 4xx que sí vale la pena reintentar (el resto de 4xx nunca funcionará)
+CODIGOS_4XX_REINTENTABLES = {408, 409, 429}
+
+# Despierta a los workers cuando se encola desde este mismo proceso
+_hay_trabajo: Optional[asyncio.Event] = None
+
+
+# =========================
+# PRODUCTORES
+# =========================
+def encolar(tipo: str, payload: Dict[str, Any], max_intentos: int = MAX_INTENTOS) -> str:
+    """Guarda un trabajo pendiente y retorna su id."""
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de notificación desconocido: {tipo}")
+    ahora = datetime.now(timezone.utc)
+    resultado = coleccion_outbox.insert_one({
+        "tipo": tipo,
+        "proveedor": TIPOS[tipo],
+        "payload": payload,
+        "estado": "pendiente",
+        "intentos": 0,
+        "max_intentos": max_intentos,
+        "siguiente_intento": ahora,
+        "creado": ahora,
+    })
+    if _hay_trabajo is not None:
+        _hay_trabajo.set()
+    return str(resultado.inserted_id)
+
+
+def encolar_correo(
+    destinatario: str,
+    asunto: str,
+    html: str,
+    remitente: str = "registro@glamperos.com",
+    adjuntos: Optional[List[dict]] = None,
+) -> Optional[str]:
+    if not destinatario:
+        return None
+    payload = {"from": remitente, "to": [destinatario], "subject": asunto, "html": html}
+    if adjuntos:
+        payload["attachments"] = adjuntos
+    return encolar("email", payload)
+
+
+def encolar_whatsapp_template(body: Dict[str, Any]) -> Optional[str]:
+    """`body` es el cuerpo completo para Graph (ver cuerpo_whatsapp_* en whatsapp_utils)."""
+    if not body.get("to"):
+        return None
+    return encolar("whatsapp_template", body)
+
+
+def encolar_whatsapp_texto(numero: str, texto: str) -> Optional[str]:
+    if not numero:
+        return None
+    return encolar("whatsapp_texto", {"numero": numero, "texto": texto})
+
+
+# =========================
+# ENVÍO
+# =========================
+class FalloPermanente(Exception):
+    """El proveedor rechazó el trabajo (4xx): reintentarlo no sirve."""
+
+
+def _es_permanente(codigo) -> bool:
+    try:
+        codigo = int(codigo)
+    except (TypeError, ValueError):
+        return False
+    return 400 <= codigo < 500 and codigo not in CODIGOS_4XX_REINTENTABLES
+
+
+async def _enviar(trabajo: Dict[str, Any]) -> None:
+    """
+    Envía un trabajo; lanza FalloPermanente si el proveedor lo rechazó y
+    cualquier otra excepción si hay que reintentarlo.
+    """
+    tipo, payload = trabajo["tipo"], trabajo["payload"]
+    limitador = LIMITADORES.get(trabajo["proveedor"])
+    if limitador:
+        await limitador.adquirir()
+
+    if tipo == "email":
+        # Resend no tiene timeout propio: el plazo libera al worker aunque el hilo
+        # siga. Si Resend ya lo había aceptado, la llave de idempotencia evita
+        # que el reintento lo entregue dos veces.
+        opciones = {"idempotency_key": f"outbox-{trabajo['_id']}"}
+        try:
+            async with breaker("resend").llamada():
+                await con_plazo(
+                    asyncio.to_thread(resend.Emails.send, payload, opciones),
+                    breaker("resend").timeout_seg,
+                )
+        except resend.exceptions.ResendError as e:
+            if _es_permanente(e.code):
+                raise FalloPermanente(f"Resend {e.code}: {e.message}") from e
+            raise
+        return
+    if tipo == "whatsapp_template":
+        codigo = await enviar_graph(payload, f"Outbox WhatsApp plantilla {trabajo['_id']}")
+    else:
+        codigo = await enviar_graph(
+            cuerpo_whatsapp_texto(payload["numero"], payload["texto"]),
+            f"Outbox WhatsApp texto {trabajo['_id']}",
+        )
+    if codigo == 200:
+        return
+    if _es_permanente(codigo):
+        raise FalloPermanente(f"WhatsApp rechazó el mensaje ({codigo})")
+    raise RuntimeError(f"WhatsApp no aceptó el mensaje ({codigo or 'sin respuesta'})")
+
+
+def _espera_backoff(intentos: int) -> float:
+    espera = min(BACKOFF_MAX_SEG, BACKOFF_BASE_SEG * (2 ** max(0, intentos - 1)))
+    return espera * random.uniform(0.8, 1.2)
+
+
+async def _tomar_trabajo() -> Optional[Dict[str, Any]]:
+    """Reclama atómicamente el siguiente trabajo vencido (o uno abandonado por otro worker)."""
+    ahora = datetime.now(timezone.utc)
+    return await _coleccion_async.find_one_and_update(
+        {"$or": [
+            {"estado": "pendiente", "siguiente_intento": {"$lte": ahora}},
+            {"estado": "procesando", "bloqueado_hasta": {"$lte": ahora}},
+        ]},
+        {
+            "$set": {"estado": "procesando", "bloqueado_hasta": ahora + timedelta(seconds=BLOQUEO_SEG)},
+            "$inc": {"intentos": 1},
+        },
+        sort=[("siguiente_intento", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _procesar(trabajo: Dict[str, Any]) -> None:
+    try:
+        await _enviar(trabajo)
+    except Exception as e:
+        ahora = datetime.now(timezone.utc)
+        if isinstance(e, FalloPermanente) or trabajo["intentos"] >= trabajo.get("max_intentos", MAX_INTENTOS):
+            print(f"🚨 Outbox: {trabajo['tipo']} {trabajo['_id']} falló definitivamente: {e}")
+            cambios = {"estado": "fallido", "ultimo_error": str(e), "actualizado": ahora}
+        else:
+            espera = _espera_backoff(trabajo["intentos"])
+            print(f"⚠️ Outbox: {trabajo['tipo']} {trabajo['_id']} falló (intento {trabajo['intentos']}), reintento en {espera:.0f}s: {e}")
+            cambios = {
+                "estado": "pendiente",
+                "ultimo_error": str(e),
+                "siguiente_intento": ahora + timedelta(seconds=espera),
+                "actualizado": ahora,
+            }
+        await _coleccion_async.update_one({"_id": trabajo["_id"]}, {"$set": cambios, "$unset": {"bloqueado_hasta": ""}})
+        return
+
+    ahora = datetime.now(timezone.utc)
+    await _coleccion_async.update_one(
+        {"_id": trabajo["_id"]},
+        {"$set": {"estado": "enviado", "enviado": ahora, "actualizado": ahora}, "$unset": {"bloqueado_hasta": ""}},
+    )
+
+
+async def _worker(numero: int):
+    while True:
+        try:
+            trabajo = await _tomar_trabajo()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Outbox worker {numero}: error leyendo la cola: {e}")
+            trabajo = None
+
+        if trabajo:
+            await _procesar(trabajo)
+            continue
+
+        # Sin trabajo: esperar a que se encole algo o al siguiente sondeo
+        _hay_trabajo.clear()
+        try:
+            await asyncio.wait_for(_hay_trabajo.wait(), timeout=ESPERA_SIN_TRABAJO_SEG)
+        except asyncio.TimeoutError:
+            pass
+
+
+def iniciar_workers(cantidad: int = NUM_WORKERS) -> List[asyncio.Task]:
+    """Arranca los workers del outbox (desde el lifespan de la app)."""
+    global _hay_trabajo
+    _hay_trabajo = asyncio.Event()
+    return [asyncio.create_task(_worker(i)) for i in range(cantidad)]
@@ -0,0 +1,431 @@
+# Funciones/pagos_wompi.py
+#
+# Eventos de pago de Wompi. El webhook solo guarda el evento y responde; la
+# conciliación con la reserva (marcar pagada, reservar fechas, notificar) se hace
+# aquí, apenas la reserva existe: al crearla o en un sondeo asíncrono corto.
+
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import os
+import asyncio
+
+from rutas.whatsapp_utils import cuerpo_whatsapp_cliente, cuerpo_whatsapp_propietario
+from Funciones.periodos_reservados import FechasNoDisponibles
+from Funciones.servicios import obtener_usuario, obtener_glamping, reservar_fechas
+from Funciones.outbox import encolar_correo, encolar_whatsapp_template
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+ConexionMongo = MongoClient(MONGO_URI)
+base_datos = ConexionMongo["glamperos"]
+
+coleccion_eventos_pendientes = base_datos["wompi_eventos_pendientes"]
+# Un documento por (transaction_id, status) ya recibido: los reintentos de Wompi se descartan
+coleccion_eventos_procesados = base_datos["wompi_eventos_procesados"]
+
+# Sondeo de eventos cuya reserva aún no existía
+INTERVALO_CONCILIACION_SEG = float(os.getenv("WOMPI_CONCILIACION_SEGUNDOS", "3"))
+# Pasado este tiempo sin reserva, el evento se deja de buscar
+HORAS_MAX_PENDIENTE = int(os.getenv("WOMPI_PENDIENTE_HORAS", "24"))
+# Un evento "aplicando" cuyo conciliador murió se puede retomar pasado este tiempo
+BLOQUEO_SEG = int(os.getenv("WOMPI_CONCILIACION_BLOQUEO_SEGUNDOS", "120"))
+# Fallos seguidos antes de dejar el evento en "error" para revisión manual
+MAX_INTENTOS = int(os.getenv("WOMPI_CONCILIACION_MAX_INTENTOS", "5"))
+
+# Estados de pago de la reserva a los que ya no se les aplica otro evento aprobado
+ESTADOS_PAGO_FINALES = ["Pagado", "Conflicto"]
+
+# Campos que usan las notificaciones de reserva confirmada
+PROYECCION_USUARIO_NOTIFICACION = {"nombre": 1, "email": 1, "telefono": 1}
+PROYECCION_GLAMPING_NOTIFICACION = {
+    "nombreGlamping": 1, "ubicacion": 1, "direccion": 1, "diasCancelacion": 1,
+}
+
+try:
+    coleccion_eventos_pendientes.create_index([("transaction_id", ASCENDING)], unique=True)
+    coleccion_eventos_pendientes.create_index([("estado", ASCENDING), ("referencia", ASCENDING)])
+    coleccion_eventos_procesados.create_index(
+        [("transaction_id", ASCENDING), ("status", ASCENDING)],
+        unique=True,
+    )
+except Exception as e:
+    print(f"⚠️ No se pudieron crear los índices de eventos Wompi: {e}")
+
+
+# ====================================================================
+# REGISTRO DEL EVENTO
+# ====================================================================
+def marcar_evento_recibido(transaction_id: str, status: str, referencia: str) -> bool:
+    """
+    Registra el evento con un único insert. Retorna False si ese
+    transaction_id + status ya se había recibido (reintento de Wompi).
+    """
+    try:
+        coleccion_eventos_procesados.insert_one({
+            "transaction_id": transaction_id,
+            "status": status,
+            "referencia": referencia,
+            "recibido": datetime.now(timezone.utc),
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def desmarcar_evento(transaction_id: str, status: str) -> None:
+    """Permite que un reintento de Wompi vuelva a entrar si el registro del evento falló."""
+    coleccion_eventos_procesados.delete_one({"transaction_id": transaction_id, "status": status})
+
+
+def registrar_evento(transaction_id: str, referencia: str, status: str, metodo_pago: str) -> None:
+    """Guarda el evento aprobado como pendiente (si Wompi lo reenvía, no se duplica)."""
+    coleccion_eventos_pendientes.update_one(
+        {"transaction_id": transaction_id},
+        {"$setOnInsert": {
+            "transaction_id": transaction_id,
+            "referencia": referencia,
+            "status": status,
+            "metodo_pago": metodo_pago,
+            "estado": "pendiente",
+            "creado": datetime.now(timezone.utc),
+        }},
+        upsert=True,
+    )
+
+
+# ====================================================================
+# NOTIFICACIONES DE RESERVA CONFIRMADA (correo y WhatsApp)
+# ====================================================================
+def notificar_reserva_confirmada(reserva: dict, propietario: dict, cliente: dict, glamping: dict):
+    """Encola los correos y WhatsApp de confirmación en el outbox."""
+    print("📧 Encolando correos y WhatsApp de confirmación")
+    def limpiar_numero(numero: str) -> str:
+        return numero[2:] if numero and numero.startswith("57") else numero
+    telefono_propietario_correo = limpiar_numero(propietario.get("telefono", "No disponible"))
+    telefono_cliente_correo = limpiar_numero(cliente.get("telefono", "No disponible"))
+    telefono_propietario_whatsapp = propietario.get("telefono", "No disponible")
+    telefono_cliente_whatsapp = cliente.get("telefono", "No disponible")
+    latitud = longitud = None
+    if glamping and isinstance(glamping.get("ubicacion"), dict):
+        latitud = glamping["ubicacion"].get("lat")
+        longitud = glamping["ubicacion"].get("lng")
+        print(f"📍 Latitud obtenida: {latitud}")
+        print(f"📍 Longitud obtenida: {longitud}")
+        if latitud and longitud:
+            ubicacion_link = f"https://www.google.com/maps?q={latitud},{longitud}"
+        else:
+            ubicacion_link = "Ubicación no disponible"
+    else:
+        ubicacion_link = "Ubicación no disponible"
+        print("⚠️ No se encontró la ubicación del glamping.")
+    def convertir_fecha(fecha_raw):
+        if fecha_raw:
+            try:
+                return datetime.fromisoformat(str(fecha_raw)).strftime("%d %b %Y")
+            except ValueError:
+                return "Fecha no disponible"
+        return "Fecha no disponible"
+    fecha_inicio = convertir_fecha(reserva.get("FechaIngreso"))
+    fecha_fin = convertir_fecha(reserva.get("FechaSalida"))
+    # Calcular la fecha límite para cancelar según los días permitidos antes de la reserva
+    dias_cancelacion = glamping.get("diasCancelacion", 0)  # Si no existe, asumimos 0 días
+    try:
+        fecha_cancelacion_permitida = (datetime.fromisoformat(str(reserva.get("FechaIngreso"))) - timedelta(days=int(dias_cancelacion))).strftime("%d %b %Y")
+    except (ValueError, TypeError):
+        fecha_cancelacion_permitida = "Fecha no disponible"
+
+    ocupacion = []
+    if reserva.get("adultos", 0) > 0:
+        ocupacion.append(f"{reserva.get('adultos', 0)} Adultos")
+    if reserva.get("ninos", 0) > 0:
+        ocupacion.append(f"{reserva.get('ninos', 0)} Niños")
+    if reserva.get("bebes", 0) > 0:
+        ocupacion.append(f"{reserva.get('bebes', 0)} Bebés")
+    if reserva.get("mascotas", 0) > 0:
+        ocupacion.append(f"{reserva.get('mascotas', 0)} Mascotas")
+    ocupacion_texto = ", ".join(ocupacion) if ocupacion else "Sin información"
+    mensaje_contacto = "<p>Si tienes preguntas, contacta a nuestro equipo en Glamperos al <strong>3218695196</strong>.</p>"
+    correo_propietario = {
+        "from_email": "reservaciones@glamperos.com",
+        "email": propietario.get("email", ""),
+        "name": propietario.get("nombre", "Propietario"),
+        "subject": f"🎫 Reserva Confirmada - {glamping.get('nombreGlamping', 'Tu Glamping')}",
+        "html_content": f"""
+            <h2 style="color: #2F6B3E;">🎉 ¡Tienes una nueva reserva!</h2>
+            <p>Hola {propietario.get('nombre', 'Propietario').split(' ')[0]},</p>
+            <p>¡Han reservado <strong>{glamping.get('nombreGlamping', 'Tu Glamping')}</strong> a través de Glamperos!</p>
+            <p><strong>Código de Reserva:</strong> {reserva.get('codigoReserva')}</p>
+            <p><strong>Check-In:</strong> {fecha_inicio}</p>
+            <p><strong>Check-Out:</strong> {fecha_fin}</p>
+            <p><strong>Ocupación:</strong> {ocupacion_texto}</p>
+            <p><strong>Huésped:</strong> {cliente.get('nombre', 'Cliente')}</p>
+            <p><strong>Teléfono:</strong> {telefono_cliente_correo}</p>
+            <p><strong>Correo:</strong> {cliente.get('email', 'No disponible')}</p>
+           
+            <hr>
+            {mensaje_contacto}
+        """
+    }
+    correo_cliente = {
+        "from_email": "reservas@glamperos.com",
+        "email": cliente.get("email", ""),
+        "name": cliente.get("nombre", "Cliente"),
+        "subject": f"🧳 Confirmación Reserva Glamping - {glamping.get('nombreGlamping', 'Tu Glamping')}",
+        "html_content": f"""
+            <h2 style="color: #2F6B3E;">🎉 ¡Hora de relajarse!</h2>
+            <p>Hola {cliente.get('nombre', 'Cliente').split(' ')[0]},</p>
+            <p>¡Gracias por reservar con Glamperos! 🎉 Aquí están los detalles de tu reserva:</p>
+            <p><strong>Código de Reserva:</strong> {reserva.get('codigoReserva', 'No disponible')}</p>
+            <p><strong>Check-In:</strong> {fecha_inicio}</p>
+            <p><strong>Check-Out:</strong> {fecha_fin}</p>
+            <p><strong>Ocupación:</strong> {ocupacion_texto}</p>
+            <p><strong>Teléfono de tu anfitrión:</strong> {telefono_propietario_correo}</p>
+            <p><strong>Ubicación:</strong> <a href="{ubicacion_link}" target="_blank">Ver en Google Maps</a></p>
+            <p><strong>Fecha límite para cancelar con 95% de reembolso:</strong> {fecha_cancelacion_permitida}</p>
+            <hr>
+            {mensaje_contacto}
+        """
+    }
+    for correo in (correo_propietario, correo_cliente):
+        encolar_correo(
+            destinatario=correo["email"],
+            asunto=correo["subject"],
+            html=correo["html_content"],
+            remitente=correo["from_email"],
+        )
+
+    encolar_whatsapp_template(cuerpo_whatsapp_cliente(
+        numero=telefono_cliente_whatsapp,
+        codigoReserva=reserva.get("codigoReserva", "No disponible"),
+        whatsapp=telefono_cliente_whatsapp,
+        nombreGlampingReservado=glamping.get("nombreGlamping", "Tu Glamping"),
+        direccionGlamping=glamping.get("direccion", "Dirección no disponible"),
+        latitud=latitud or 0,
+        longitud=longitud or 0,
+        nombreCliente=cliente.get("nombre", "Cliente")
+    ))
+
+    encolar_whatsapp_template(cuerpo_whatsapp_propietario(
+        numero=telefono_propietario_whatsapp,
+        nombrePropietario=propietario.get("nombre", "Propietario"),
+        nombreGlamping=glamping.get("nombreGlamping", "Tu Glamping"),
+        fechaInicio=fecha_inicio,
+        fechaFin=f"{fecha_fin} - el whatsapp de tu huésped es {telefono_cliente_correo}",
+        imagenUrl="https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg"
+    ))
+
+    encolar_whatsapp_template(cuerpo_whatsapp_propietario(
+        numero="573125443396",
+        nombrePropietario="Edwin",
+        nombreGlamping=glamping.get("nombreGlamping", "Tu Glamping"),
+        fechaInicio=fecha_inicio,
+        fechaFin=f"{fecha_fin} - el whatsapp del huésped es {telefono_cliente_correo} y el dueño es {telefono_propietario_whatsapp}",
+        imagenUrl="https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg"
+    ))
+
+
+# ====================================================================
+# APLICAR EL PAGO A LA RESERVA
+# ====================================================================
+def marcar_conflicto_pago(reserva: dict, motivo: str):
+    """
+    El pago entró pero las noches ya no estaban libres: la reserva queda en
+    "Conflicto" pendiente de reembolso (no se notifica como confirmada) y se
+    avisa a contabilidad.
+    """
+    referencia = reserva.get("codigoReserva")
+    print(f"🚨 Pago de la reserva {referencia} en conflicto: {motivo}")
+    base_datos.reservas.update_one(
+        {"codigoReserva": referencia},
+        {"$set": {
+            "EstadoPago": "Conflicto",
+            "requiereReembolso": True,
+            "conflictoPago": {"motivo": motivo, "fecha": datetime.now(timezone.utc)},
+        }},
+    )
+    try:
+        encolar_correo(
+            destinatario="contabilidad@glamperos.com",
+            asunto=f"Pago con fechas no disponibles - reserva {referencia}",
+            html=f"""
+                <p>La reserva <b>{referencia}</b> fue pagada en Wompi pero sus noches ya no estaban libres.</p>
+                <p><b>Motivo:</b> {motivo}</p>
+                <p>Glamping: {reserva.get("idGlamping")} · Ingreso: {reserva.get("FechaIngreso")} · Salida: {reserva.get("FechaSalida")}</p>
+                <p>Hay que reembolsar el pago o reubicar al huésped.</p>
+            """,
+            remitente="reservas@glamperos.com",
+        )
+    except Exception as e:
+        print(f"⚠️ No se pudo encolar el aviso del conflicto de {referencia}: {e}")
+
+
+def aplicar_pago_aprobado(reserva: dict) -> Optional[tuple]:
+    """
+    Reserva las noches de la reserva (solo si siguen libres) y la marca como
+    pagada. Retorna los argumentos de notificar_reserva_confirmada, o None si
+    falta el propietario o el cliente o si las noches ya las tomó otra reserva
+    (en ese caso la reserva queda en conflicto para reembolso).
+    """
+    referencia = reserva.get("codigoReserva")
+    id_glamping = reserva.get("idGlamping")
+    # ✅ Reservar las fechas (excluyendo la fecha de salida) antes de darla por pagada
+    if "FechaIngreso" in reserva and "FechaSalida" in reserva:
+        try:
+            resultado = reservar_fechas(
+                id_glamping, reserva["FechaIngreso"], reserva["FechaSalida"], reserva.get("retencionId")
+            )
+            if resultado is None:
+                print(f"⚠️ Glamping {id_glamping} no encontrado al reservar fechas.")
+            else:
+                print(f"📅 Fechas reservadas para el glamping {id_glamping}")
+        except FechasNoDisponibles as e:
+            marcar_conflicto_pago(reserva, str(e))
+            return None
+        except ValueError as e:
+            print(f"❌ Error en las fechas proporcionadas: {str(e)}")
+
+    print(f"✅ Reserva {referencia} encontrada, actualizando EstadoPago a 'APPROVED'.")
+    base_datos.reservas.update_one(
+        {"codigoReserva": referencia},
+        {"$set": {"EstadoPago": "Pagado"}}
+    )
+    # Obtener datos del propietario, cliente y glamping directamente de la BD
+    propietario = obtener_usuario(reserva.get("idPropietario"), PROYECCION_USUARIO_NOTIFICACION)
+    cliente = obtener_usuario(reserva.get("idCliente"), PROYECCION_USUARIO_NOTIFICACION)
+    glamping = obtener_glamping(id_glamping, PROYECCION_GLAMPING_NOTIFICACION)
+    if not propietario or not cliente:
+        return None
+    return (reserva, propietario, cliente, glamping or {})
+
+
+# ====================================================================
+# CONCILIACIÓN
+# ====================================================================
+def _filtro_reclamables(ahora: datetime) -> dict:
+    """Eventos por aplicar: pendientes o abandonados por un conciliador que murió."""
+    return {"$or": [
+        {"estado": "pendiente"},
+        {"estado": "aplicando", "bloqueado_hasta": {"$lte": ahora}},
+    ]}
+
+
+def _tomar_evento(referencia: str) -> Optional[dict]:
+    ahora = datetime.now(timezone.utc)
+    return coleccion_eventos_pendientes.find_one_and_update(
+        {"referencia": referencia, **_filtro_reclamables(ahora)},
+        {
+            "$set": {"estado": "aplicando", "bloqueado_hasta": ahora + timedelta(seconds=BLOQUEO_SEG)},
+            "$inc": {"intentos": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _tomar_reserva(referencia: str) -> Optional[dict]:
+    """
+    Bloquea la reserva mientras se le aplica el pago: dos eventos aprobados de la
+    misma referencia (transaction_id distintos) no se aplican a la vez.
+    """
+    ahora = datetime.now(timezone.utc)
+    return base_datos.reservas.find_one_and_update(
+        {
+            "codigoReserva": referencia,
+            "EstadoPago": {"$nin": ESTADOS_PAGO_FINALES},
+            "$or": [{"pagoBloqueadoHasta": None}, {"pagoBloqueadoHasta": {"$lte": ahora}}],
+        },
+        {"$set": {"pagoBloqueadoHasta": ahora + timedelta(seconds=BLOQUEO_SEG)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _cerrar_evento(evento: dict, estado: str, **campos):
+    coleccion_eventos_pendientes.update_one(
+        {"_id": evento["_id"]},
+        {"$set": {"estado": estado, **campos}, "$unset": {"bloqueado_hasta": ""}},
+    )
+
+
+def conciliar_referencia(referencia: str) -> int:
+    """
+    Aplica los eventos pendientes de una referencia si su reserva ya existe.
+    Cada evento se reclama como "aplicando" con un bloqueo temporal y solo queda
+    "procesado" después de aplicarse; si falla vuelve a "pendiente" (o a "error"
+    tras MAX_INTENTOS) para que conciliar_pendientes lo reintente. Si la reserva
+    ya quedó pagada por otro evento, el evento se cierra sin volver a notificar.
+    Retorna cuántos aplicó. Es síncrona a propósito: BackgroundTasks la corre en
+    el threadpool y bucle_conciliacion con asyncio.to_thread.
+    """
+    ahora = datetime.now(timezone.utc)
+    if not coleccion_eventos_pendientes.find_one(
+        {"referencia": referencia, **_filtro_reclamables(ahora)}, {"_id": 1}
+    ):
+        return 0
+    if not base_datos.reservas.find_one({"codigoReserva": referencia}, {"_id": 1}):
+        return 0
+
+    aplicados = 0
+    while True:
+        evento = _tomar_evento(referencia)
+        if not evento:
+            break
+
+        reserva = _tomar_reserva(referencia)
+        if not reserva:
+            actual = base_datos.reservas.find_one({"codigoReserva": referencia}, {"EstadoPago": 1})
+            if actual and actual.get("EstadoPago") in ESTADOS_PAGO_FINALES:
+                print(f"ℹ️ Pago {evento['transaction_id']} ({referencia}): la reserva ya estaba {actual['EstadoPago']}")
+                _cerrar_evento(evento, "procesado", procesado=datetime.now(timezone.utc), omitido=True)
+                continue
+            # Otro conciliador está aplicando un pago de esta reserva: se reintenta luego
+            coleccion_eventos_pendientes.update_one(
+                {"_id": evento["_id"]},
+                {"$set": {"estado": "pendiente"}, "$unset": {"bloqueado_hasta": ""}, "$inc": {"intentos": -1}},
+            )
+            break
+
+        try:
+            notificacion = aplicar_pago_aprobado(reserva)
+            if notificacion:
+                notificar_reserva_confirmada(*notificacion)
+            _cerrar_evento(evento, "procesado", procesado=datetime.now(timezone.utc))
+            aplicados += 1
+        except Exception as e:
+            estado = "error" if evento.get("intentos", 1) >= MAX_INTENTOS else "pendiente"
+            print(f"⚠️ Error conciliando el pago {evento['transaction_id']} ({referencia}), queda {estado}: {e}")
+            _cerrar_evento(evento, estado, ultimo_error=str(e))
+            break  # el reintento queda para la siguiente pasada de conciliar_pendientes
+        finally:
+            base_datos.reservas.update_one({"_id": reserva["_id"]}, {"$unset": {"pagoBloqueadoHasta": ""}})
+    return aplicados
+
+
+def conciliar_pendientes(limite: int = 100) -> int:
+    """Concilia los eventos pendientes cuya reserva ya llegó y descarta los muy viejos."""
+    ahora = datetime.now(timezone.utc)
+    limite_antiguedad = ahora - timedelta(hours=HORAS_MAX_PENDIENTE)
+    coleccion_eventos_pendientes.update_many(
+        {"estado": "pendiente", "creado": {"$lt": limite_antiguedad}},
+        {"$set": {"estado": "sin_reserva"}},
+    )
+    referencias = coleccion_eventos_pendientes.distinct("referencia", _filtro_reclamables(ahora))
+    aplicados = 0
+    for referencia in referencias[:limite]:
+        aplicados += conciliar_referencia(referencia)
+    return aplicados
+
+
+async def bucle_conciliacion():
+    """
+    Sondeo de eventos pendientes (se inicia en el lifespan de la app). La
+    conciliación usa pymongo y encola notificaciones, así que corre en un hilo
+    para no bloquear el event loop.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(conciliar_pendientes)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Error en la conciliación de pagos Wompi: {e}")
+        await asyncio.sleep(INTERVALO_CONCILIACION_SEG)
@@ -0,0 +1,561 @@
+# Funciones/periodos_reservados.py
+
+from pymongo import MongoClient, ASCENDING
+from bson.objectid import ObjectId
+from cachetools import LRUCache
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Iterable, Callable
+import os
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+ConexionMongo = MongoClient(MONGO_URI)
+db = ConexionMongo["glamperos"]
+
+coleccion_glampings = db["glampings"]
+
+# Un periodo es {"inicio": "YYYY-MM-DD", "fin": "YYYY-MM-DD", "fuente": "..."}
+# con `fin` exclusivo (día de salida): la noche de `fin` queda libre.
+FUENTES = ("manual", "airbnb", "booking")
+
+# Arreglos de un string por noche que se usaban antes de los periodos
+CAMPOS_LEGADO = {
+    "manual": "fechasReservadasManual",
+    "airbnb": "fechasReservadasAirbnb",
+    "booking": "fechasReservadasBooking",
+}
+CAMPO_UNION_LEGADO = "fechasReservadas"
+
+PROYECCION_PERIODOS = {
+    "periodosReservados": 1,
+    "fechasVersion": 1,
+    CAMPO_UNION_LEGADO: 1,
+    **{campo: 1 for campo in CAMPOS_LEGADO.values()},
+}
+
+MAX_REINTENTOS = 5
+
+# Retenciones: noches apartadas mientras se paga una reserva, con vencimiento.
+# No son fechas reservadas (no cambian `fechasVersion` ni se exportan).
+CAMPO_RETENCIONES = "retencionesFechas"
+RETENCION_MINUTOS = int(os.getenv("RESERVA_RETENCION_MINUTOS", "30"))
+
+try:
+    coleccion_glampings.create_index(
+        [(f"{CAMPO_RETENCIONES}.expira", ASCENDING)],
+        sparse=True,
+    )
+except Exception:
+    pass
+
+
+class FechasNoDisponibles(Exception):
+    """Las noches pedidas ya están reservadas o retenidas por otra reserva."""
+
+
+# =========================
+# CONVERSIONES
+# =========================
+def _a_fecha(valor) -> Optional[date]:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    try:
+        return datetime.strptime(str(valor).strip()[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def _periodo(inicio: date, fin: date, fuente: str) -> Dict[str, str]:
+    # Siempre el mismo orden de llaves: Mongo compara subdocumentos campo a campo
+    return {"inicio": inicio.isoformat(), "fin": fin.isoformat(), "fuente": fuente}
+
+
+def fechas_a_periodos(fechas: Iterable[str], fuente: str) -> List[Dict[str, str]]:
+    """
+    Comprime una lista de noches "YYYY-MM-DD" en periodos de días consecutivos.
+    Las fechas inválidas se ignoran.
+    """
+    dias = sorted({d for d in (_a_fecha(f) for f in fechas or []) if d})
+    periodos = []
+    inicio = previo = None
+    for dia in dias:
+        if inicio is None:
+            inicio = previo = dia
+        elif dia == previo + timedelta(days=1):
+            previo = dia
+        else:
+            periodos.append(_periodo(inicio, previo + timedelta(days=1), fuente))
+            inicio = previo = dia
+    if inicio is not None:
+        periodos.append(_periodo(inicio, previo + timedelta(days=1), fuente))
+    return periodos
+
+
+def rango_a_periodo(fecha_ingreso, fecha_salida, fuente: str = "manual") -> Optional[Dict[str, str]]:
+    """Periodo [ingreso, salida) a partir de fechas o datetimes; None si el rango es vacío."""
+    inicio, fin = _a_fecha(fecha_ingreso), _a_fecha(fecha_salida)
+    if not inicio or not fin or fin <= inicio:
+        return None
+    return _periodo(inicio, fin, fuente)
+
+
+def periodos_a_fechas(periodos: List[Dict[str, str]], fuente: Optional[str] = None) -> List[str]:
+    """Expande periodos a la lista ordenada de noches (opcionalmente de una sola fuente)."""
+    dias = set()
+    for p in periodos or []:
+        if fuente and p.get("fuente") != fuente:
+            continue
+        dia, fin = _a_fecha(p.get("inicio")), _a_fecha(p.get("fin"))
+        if not dia or not fin:
+            continue
+        while dia < fin:
+            dias.add(dia.isoformat())
+            dia += timedelta(days=1)
+    return sorted(dias)
+
+
+def fusionar_periodos(periodos: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Une los periodos de una misma fuente que se solapan o se tocan.
+    Periodos de fuentes distintas pueden solaparse y se conservan por separado.
+    """
+    por_fuente: Dict[str, List[Dict[str, str]]] = {}
+    for p in periodos or []:
+        por_fuente.setdefault(p.get("fuente") or "manual", []).append(p)
+
+    resultado = []
+    for fuente, lista in por_fuente.items():
+        lista = sorted(lista, key=lambda p: (p["inicio"], p["fin"]))
+        actual = None
+        for p in lista:
+            if p["fin"] <= p["inicio"]:
+                continue
+            if actual and p["inicio"] <= actual["fin"]:
+                if p["fin"] > actual["fin"]:
+                    actual["fin"] = p["fin"]
+            else:
+                actual = {"inicio": p["inicio"], "fin": p["fin"], "fuente": fuente}
+                resultado.append(actual)
+    return sorted(resultado, key=lambda p: (p["inicio"], p["fuente"], p["fin"]))
+
+
+def insertar_periodo(periodos: List[Dict[str, str]], nuevo: Dict[str, str]) -> List[Dict[str, str]]:
+    """Inserta un periodo fusionándolo con los contiguos de su misma fuente."""
+    return fusionar_periodos(list(periodos or []) + [nuevo])
+
+
+def quitar_fechas(periodos: List[Dict[str, str]], fechas: Iterable[str], fuente: str) -> List[Dict[str, str]]:
+    """Libera noches sueltas de una fuente, partiendo los periodos que las contienen."""
+    quitar = {d.isoformat() for d in (_a_fecha(f) for f in fechas or []) if d}
+    restantes = [f for f in periodos_a_fechas(periodos, fuente) if f not in quitar]
+    otros = [p for p in periodos or [] if p.get("fuente") != fuente]
+    return fusionar_periodos(otros + fechas_a_periodos(restantes, fuente))
+
+
+def periodos_de_documento(glamping: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Periodos de un glamping. Si el documento aún no fue migrado se derivan de
+    los arreglos de fechas por noche (las fechas que solo están en la unión se
+    consideran manuales).
+    """
+    if "periodosReservados" in glamping:
+        return [
+            {"inicio": p["inicio"], "fin": p["fin"], "fuente": p.get("fuente", "manual")}
+            for p in glamping.get("periodosReservados") or []
+        ]
+
+    periodos = []
+    en_fuentes = set()
+    for fuente, campo in CAMPOS_LEGADO.items():
+        fechas = glamping.get(campo) or []
+        en_fuentes.update(fechas)
+        periodos.extend(fechas_a_periodos(fechas, fuente))
+    solo_union = [f for f in glamping.get(CAMPO_UNION_LEGADO) or [] if f not in en_fuentes]
+    periodos.extend(fechas_a_periodos(solo_union, "manual"))
+    return fusionar_periodos(periodos)
+
+
+def expandir_fechas(glamping: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rellena en el documento los arreglos por noche (`fechasReservadas`,
+    `fechasReservadasManual`, ...) derivados de los periodos, para que las
+    respuestas de la API conserven su forma.
+    """
+    if "periodosReservados" not in glamping:
+        return glamping
+    periodos = glamping.get("periodosReservados") or []
+    glamping[CAMPO_UNION_LEGADO] = periodos_a_fechas(periodos)
+    for fuente, campo in CAMPOS_LEGADO.items():
+        glamping[campo] = periodos_a_fechas(periodos, fuente)
+    return glamping
+
+
+# =========================
+# ÁRBOL DE INTERVALOS
+# =========================
+class _Nodo:
+    __slots__ = ("periodo", "max_fin", "izq", "der")
+
+    def __init__(self, periodo: Dict[str, str]):
+        self.periodo = periodo
+        self.max_fin = periodo["fin"]
+        self.izq = None
+        self.der = None
+
+
+class ArbolIntervalos:
+    """
+    Árbol de intervalos aumentado (cada nodo guarda el mayor `fin` de su subárbol).
+    Se construye balanceado a partir de los periodos ordenados por inicio y responde
+    consultas de solapamiento en O(log n + k). Es inmutable: ante un cambio de
+    fechas se construye uno nuevo.
+    """
+
+    def __init__(self, periodos: List[Dict[str, str]]):
+        ordenados = sorted(periodos or [], key=lambda p: (p["inicio"], p["fin"]))
+        self.total = len(ordenados)
+        self.raiz = self._construir(ordenados, 0, len(ordenados))
+
+    def _construir(self, periodos, desde: int, hasta: int):
+        if desde >= hasta:
+            return None
+        medio = (desde + hasta) // 2
+        nodo = _Nodo(periodos[medio])
+        nodo.izq = self._construir(periodos, desde, medio)
+        nodo.der = self._construir(periodos, medio + 1, hasta)
+        for hijo in (nodo.izq, nodo.der):
+            if hijo and hijo.max_fin > nodo.max_fin:
+                nodo.max_fin = hijo.max_fin
+        return nodo
+
+    def solapados(self, inicio: str, fin: str) -> List[Dict[str, str]]:
+        """Periodos que comparten al menos una noche con [inicio, fin)."""
+        encontrados: List[Dict[str, str]] = []
+        pila = [self.raiz]
+        while pila:
+            nodo = pila.pop()
+            if nodo is None or nodo.max_fin <= inicio:
+                continue
+            pila.append(nodo.izq)
+            if nodo.periodo["inicio"] < fin:
+                if nodo.periodo["fin"] > inicio:
+                    encontrados.append(nodo.periodo)
+                pila.append(nodo.der)
+        return sorted(encontrados, key=lambda p: (p["inicio"], p["fuente"]))
+
+    def disponible(self, inicio: str, fin: str) -> bool:
+        return not self.solapados(inicio, fin)
+
+
+# Un árbol por glamping, válido mientras no cambie su `fechasVersion`
+_arboles: LRUCache = LRUCache(maxsize=int(os.getenv("ARBOLES_FECHAS_MAX", "2048")))
+
+
+def arbol_de_documento(glamping: Dict[str, Any]) -> ArbolIntervalos:
+    clave = str(glamping["_id"])
+    version = glamping.get("fechasVersion")
+    en_cache = _arboles.get(clave)
+    if en_cache and version is not None and en_cache[0] == version:
+        return en_cache[1]
+    arbol = ArbolIntervalos(periodos_de_documento(glamping))
+    if version is not None:
+        _arboles[clave] = (version, arbol)
+    return arbol
+
+
+def obtener_arbol(glamping_id: str) -> Optional[ArbolIntervalos]:
+    """Árbol de un glamping; solo lee sus periodos si la versión en caché quedó vieja."""
+    oid = ObjectId(glamping_id)
+    cabecera = coleccion_glampings.find_one({"_id": oid}, {"fechasVersion": 1})
+    if not cabecera:
+        return None
+    en_cache = _arboles.get(glamping_id)
+    version = cabecera.get("fechasVersion")
+    if en_cache and version is not None and en_cache[0] == version:
+        return en_cache[1]
+    glamping = coleccion_glampings.find_one({"_id": oid}, PROYECCION_PERIODOS)
+    return arbol_de_documento(glamping) if glamping else None
+
+
+# =========================
+# ESCRITURA
+# =========================
+def modificar_periodos(
+    glamping_id,
+    cambio: Callable[[List[Dict[str, str]]], List[Dict[str, str]]],
+    documento: Optional[Dict[str, Any]] = None,
+    condicion: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Aplica `cambio` sobre los periodos del glamping y guarda solo la diferencia.
+
+    La escritura va condicionada a `fechasVersion` (concurrencia optimista): si otro
+    proceso cambió las fechas entre la lectura y la escritura, se relee y reintenta.
+    `condicion` es un filtro extra que el glamping debe cumplir al escribir; si
+    deja de cumplirse se lanza FechasNoDisponibles en vez de reintentar.
+    Los documentos sin migrar se convierten en la misma operación y pierden los
+    arreglos por noche. Si el resultado es igual al actual no se escribe nada.
+    Retorna None si el glamping no existe.
+    """
+    oid = glamping_id if isinstance(glamping_id, ObjectId) else ObjectId(glamping_id)
+
+    for _ in range(MAX_REINTENTOS):
+        if documento is None:
+            documento = coleccion_glampings.find_one({"_id": oid}, PROYECCION_PERIODOS)
+            if not documento:
+                return None
+
+        actuales = periodos_de_documento(documento)
+        nuevos = fusionar_periodos(cambio([dict(p) for p in actuales]))
+        version = documento.get("fechasVersion")
+
+        agregar = [p for p in nuevos if p not in actuales]
+        quitar = [p for p in actuales if p not in nuevos]
+        dias_antes = set(periodos_a_fechas(actuales))
+        dias_despues = set(periodos_a_fechas(nuevos))
+        sin_migrar = "periodosReservados" not in documento
+        resultado = {
+            "cambio": bool(agregar or quitar),
+            "periodos": nuevos,
+            "version": version,
+            "agregadas": sorted(dias_despues - dias_antes),
+            "eliminadas": sorted(dias_antes - dias_despues),
+        }
+        if not resultado["cambio"] and not sin_migrar:
+            return resultado
+
+        nueva_version = (version or 0) + 1
+        if sin_migrar:
+            actualizacion = {
+                "$set": {"periodosReservados": nuevos, "fechasVersion": nueva_version},
+                "$unset": {campo: "" for campo in [CAMPO_UNION_LEGADO, *CAMPOS_LEGADO.values()]},
+            }
+        else:
+            # Pipeline: quitar y agregar subdocumentos del mismo arreglo en una sola operación
+            actualizacion = [{
+                "$set": {
+                    "periodosReservados": {
+                        "$concatArrays": [
+                            {"$filter": {
+                                "input": {"$ifNull": ["$periodosReservados", []]},
+                                "cond": {"$not": [{"$in": ["$$this", {"$literal": quitar}]}]},
+                            }},
+                            {"$literal": agregar},
+                        ]
+                    },
+                    "fechasVersion": nueva_version,
+                }
+            }]
+
+        res = coleccion_glampings.update_one(
+            {"_id": oid, "fechasVersion": version, **(condicion or {})},
+            actualizacion,
+        )
+        if res.matched_count:
+            resultado["version"] = nueva_version
+            _arboles.pop(str(oid), None)
+            return resultado
+        if condicion and not coleccion_glampings.find_one({"_id": oid, **condicion}, {"_id": 1}):
+            raise FechasNoDisponibles(f"El glamping {glamping_id} ya no cumple la condición para escribir")
+        documento = None  # alguien más cambió las fechas: releer
+
+    raise RuntimeError(f"No se pudieron actualizar las fechas del glamping {glamping_id} por concurrencia")
+
+
+def agregar_fechas(glamping_id, fechas: Iterable[str], fuente: str = "manual") -> Optional[Dict[str, Any]]:
+    nuevos = fechas_a_periodos(fechas, fuente)
+    return modificar_periodos(glamping_id, lambda actuales: actuales + nuevos)
+
+
+def agregar_rango(glamping_id, fecha_ingreso, fecha_salida, fuente: str = "manual") -> Optional[Dict[str, Any]]:
+    periodo = rango_a_periodo(fecha_ingreso, fecha_salida, fuente)
+    if not periodo:
+        raise ValueError(f"Rango de fechas inválido: {fecha_ingreso} - {fecha_salida}")
+    return modificar_periodos(glamping_id, lambda actuales: insertar_periodo(actuales, periodo))
+
+
+def eliminar_fechas(glamping_id, fechas: Iterable[str], fuente: str = "manual") -> Optional[Dict[str, Any]]:
+    fechas = list(fechas or [])
+    return modificar_periodos(glamping_id, lambda actuales: quitar_fechas(actuales, fechas, fuente))
+
+
+def reemplazar_fechas_fuente(
+    glamping_id,
+    fuente: str,
+    fechas: Iterable[str],
+    documento: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Deja los periodos de `fuente` iguales a `fechas` (sincronización de calendarios externos)."""
+    nuevos = fechas_a_periodos(fechas, fuente)
+    return modificar_periodos(
+        glamping_id,
+        lambda actuales: [p for p in actuales if p["fuente"] != fuente] + nuevos,
+        documento=documento,
+    )
+
+
+def filtro_sin_solape(fecha_inicio: str, fecha_fin: str) -> Dict[str, Any]:
+    """
+    Filtro Mongo para glampings libres entre `fecha_inicio` y `fecha_fin` (ambas
+    noches incluidas). Cubre también los documentos que aún no fueron migrados.
+    """
+    fin_exclusivo = (_a_fecha(fecha_fin) + timedelta(days=1)).isoformat()
+    inicio_dt, fin_dt = _a_fecha(fecha_inicio), _a_fecha(fecha_fin)
+    dias = [
+        (inicio_dt + timedelta(days=i)).isoformat()
+        for i in range((fin_dt - inicio_dt).days + 1)
+    ]
+    return {
+        "periodosReservados": {"$not": {"$elemMatch": {
+            "inicio": {"$lt": fin_exclusivo},
+            "fin": {"$gt": inicio_dt.isoformat()},
+        }}},
+        CAMPO_UNION_LEGADO: {"$not": {"$elemMatch": {"$in": dias}}},
+    }
+
+
+
+# =========================
+# RETENCIONES
+# =========================
+def nueva_retencion(
+    periodo: Dict[str, str],
+    codigo_reserva: str,
+    ahora: datetime,
+    minutos: Optional[int] = None,
+) -> Dict[str, Any]:
+    # El id va como string: el documento del glamping se devuelve tal cual en
+    # algunos listados y un ObjectId anidado no se puede serializar a JSON
+    return {
+        "id": str(ObjectId()),
+        "codigoReserva": codigo_reserva,
+        "inicio": periodo["inicio"],
+        "fin": periodo["fin"],
+        "expira": ahora + timedelta(minutes=minutos or RETENCION_MINUTOS),
+    }
+
+
+def retener_fechas(
+    glamping_id,
+    fecha_ingreso,
+    fecha_salida,
+    codigo_reserva: str,
+    minutos: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Aparta las noches [ingreso, salida) del glamping solo si están libres: sin
+    periodos reservados, sin fechas legado y sin retenciones vigentes que se crucen.
+    Es una sola actualización condicionada, así que dos checkouts simultáneos
+    no pueden retener la misma noche. De paso descarta las retenciones vencidas.
+
+    Retorna la retención creada, {} si las fechas no están disponibles o None si
+    el glamping no existe. Lanza ValueError si el rango es inválido.
+    """
+    periodo = rango_a_periodo(fecha_ingreso, fecha_salida)
+    if not periodo:
+        raise ValueError(f"Rango de fechas inválido: {fecha_ingreso} - {fecha_salida}")
+    oid = glamping_id if isinstance(glamping_id, ObjectId) else ObjectId(glamping_id)
+
+    ahora = datetime.now(timezone.utc)
+    ultima_noche = (_a_fecha(periodo["fin"]) - timedelta(days=1)).isoformat()
+    retencion = nueva_retencion(periodo, codigo_reserva, ahora, minutos)
+
+    filtro = {
+        "_id": oid,
+        **filtro_sin_solape(periodo["inicio"], ultima_noche),
+        CAMPO_RETENCIONES: {"$not": {"$elemMatch": {
+            "inicio": {"$lt": periodo["fin"]},
+            "fin": {"$gt": periodo["inicio"]},
+            "expira": {"$gt": ahora},
+        }}},
+    }
+    actualizacion = [{
+        "$set": {
+            CAMPO_RETENCIONES: {
+                "$concatArrays": [
+                    {"$filter": {
+                        "input": {"$ifNull": [f"${CAMPO_RETENCIONES}", []]},
+                        "cond": {"$gt": ["$$this.expira", ahora]},
+                    }},
+                    [{"$literal": retencion}],
+                ]
+            }
+        }
+    }]
+
+    res = coleccion_glampings.update_one(filtro, actualizacion)
+    if res.matched_count:
+        return retencion
+    if not coleccion_glampings.find_one({"_id": oid}, {"_id": 1}):
+        return None
+    return {}
+
+
+def _ids_retencion(retencion_id) -> List[Any]:
+    # Las retenciones anteriores guardaban el id como ObjectId
+    if not retencion_id:
+        return []
+    ids: List[Any] = [str(retencion_id)]
+    if ObjectId.is_valid(str(retencion_id)):
+        ids.append(ObjectId(str(retencion_id)))
+    return ids
+
+
+def liberar_retencion(glamping_id, retencion_id) -> bool:
+    """Quita una retención (reserva pagada, o creación de reserva fallida)."""
+    if not retencion_id:
+        return False
+    oid = glamping_id if isinstance(glamping_id, ObjectId) else ObjectId(glamping_id)
+    res = coleccion_glampings.update_one(
+        {"_id": oid},
+        {"$pull": {CAMPO_RETENCIONES: {"id": {"$in": _ids_retencion(retencion_id)}}}},
+    )
+    return bool(res.modified_count)
+
+
+def confirmar_retencion(glamping_id, retencion_id, fecha_ingreso, fecha_salida) -> Optional[Dict[str, Any]]:
+    """
+    Reserva (como manuales) las noches [ingreso, salida) de una reserva pagada y
+    quita su retención. Solo escribe si siguen libres: ningún periodo las cruza y
+    ninguna retención vigente de otra reserva tampoco (la propia puede haber
+    vencido; basta con que nadie más las haya tomado entretanto).
+
+    Retorna el resultado de modificar_periodos o None si el glamping no existe.
+    Lanza FechasNoDisponibles si las noches ya no están libres y ValueError si
+    el rango es inválido.
+    """
+    periodo = rango_a_periodo(fecha_ingreso, fecha_salida)
+    if not periodo:
+        raise ValueError(f"Rango de fechas inválido: {fecha_ingreso} - {fecha_salida}")
+
+    condicion = {CAMPO_RETENCIONES: {"$not": {"$elemMatch": {
+        "id": {"$nin": _ids_retencion(retencion_id)},
+        "inicio": {"$lt": periodo["fin"]},
+        "fin": {"$gt": periodo["inicio"]},
+        "expira": {"$gt": datetime.now(timezone.utc)},
+    }}}}
+
+    def cambio(actuales: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        solapados = ArbolIntervalos(actuales).solapados(periodo["inicio"], periodo["fin"])
+        if solapados:
+            raise FechasNoDisponibles(
+                f"Las noches {periodo['inicio']} - {periodo['fin']} del glamping {glamping_id} "
+                f"ya están reservadas ({solapados[0]['fuente']})"
+            )
+        return insertar_periodo(actuales, periodo)
+
+    resultado = modificar_periodos(glamping_id, cambio, condicion=condicion)
+    if resultado is not None:
+        liberar_retencion(glamping_id, retencion_id)
+    return resultado
+
+
+def liberar_retenciones_vencidas() -> int:
+    """Quita las retenciones vencidas de todos los glampings. Retorna cuántos se tocaron."""
+    ahora = datetime.now(timezone.utc)
+    res = coleccion_glampings.update_many(
+        {f"{CAMPO_RETENCIONES}.expira": {"$lte": ahora}},
+        {"$pull": {CAMPO_RETENCIONES: {"expira": {"$lte": ahora}}}},
+    )
+    return res.modified_count
@@ -0,0 +1,31 @@
+from dotenv import load_dotenv
+import os
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+# 🔄 Cargar variables desde .env
+load_dotenv()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["glamperos"]
+
+from Funciones.calificaciones import recalcular_calificacion
+
+# Ejecutar desde la raíz: python -m Funciones.recalcular_calificaciones
+# Completa ratingSum, ratingCount y calificacion de los glampings que aún no
+# tienen agregados, calculándolos desde sus evaluaciones. Los ya completos se omiten.
+recalculados = 0
+for glamping in db["glampings"].find({"ratingCount": {"$exists": False}}, {"_id": 1}):
+    if recalcular_calificacion(str(glamping["_id"])):
+        recalculados += 1
+
+# El índice (glamping_id, fecha_agregado, _id) de rutas/evaluacion.py ya cubre
+# las consultas por glamping_id: el índice de un solo campo sobra
+try:
+    db["evaluaciones"].drop_index("glamping_id_1")
+    print("🗑️ Índice glamping_id_1 de evaluaciones eliminado")
+except OperationFailure:
+    pass
+
+print(f"✅ Glampings con calificación recalculada: {recalculados}")
@@ -0,0 +1,58 @@
+from dotenv import load_dotenv
+import os
+from pymongo import MongoClient, ReplaceOne
+
+# 🔄 Cargar variables desde .env
+load_dotenv()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["glamperos"]
+
+# Ejecutar desde la raíz: python -m Funciones.reconstruir_conversaciones
+# Recalcula la colección `conversaciones` (una fila por usuario y contacto con
+# el último mensaje) a partir de todo el historial de `mensajes`. Los no leídos
+# del historial no se conocen, así que quedan en 0.
+pipeline = [
+    {"$sort": {"_id": 1}},
+    {"$project": {
+        "mensaje": 1,
+        "timestamp": 1,
+        "emisor": 1,
+        "pares": [
+            {"usuario": "$emisor", "contacto": "$receptor"},
+            {"usuario": "$receptor", "contacto": "$emisor"},
+        ],
+    }},
+    {"$unwind": "$pares"},
+    {"$group": {
+        "_id": "$pares",
+        "ultimo_mensaje": {"$last": "$mensaje"},
+        "ultima_fecha": {"$last": "$timestamp"},
+        "ultimo_emisor": {"$last": "$emisor"},
+        "ultimo_id": {"$last": "$_id"},
+    }},
+]
+
+operaciones = []
+total = 0
+for fila in db["mensajes"].aggregate(pipeline, allowDiskUse=True):
+    clave = {"usuario": fila["_id"]["usuario"], "contacto": fila["_id"]["contacto"]}
+    operaciones.append(ReplaceOne(clave, {
+        **clave,
+        "ultimo_mensaje": fila["ultimo_mensaje"],
+        "ultima_fecha": fila["ultima_fecha"],
+        "ultimo_emisor": fila["ultimo_emisor"],
+        "actualizado": fila["ultimo_id"].generation_time,
+        "no_leidos": 0,
+    }, upsert=True))
+    if len(operaciones) >= 1000:
+        db["conversaciones"].bulk_write(operaciones, ordered=False)
+        total += len(operaciones)
+        operaciones = []
+
+if operaciones:
+    db["conversaciones"].bulk_write(operaciones, ordered=False)
+    total += len(operaciones)
+
+print(f"✅ Conversaciones reconstruidas: {total}")
@@ -0,0 +1,97 @@
+from dotenv import load_dotenv
+import os
+import sys
+from datetime import datetime, timedelta
+from pymongo import MongoClient, ASCENDING, ReplaceOne
+from pytz import timezone, utc
+
+# 🔄 Cargar variables desde .env
+load_dotenv()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["glamperos"]
+
+leads = db["whatsapp_leads"]
+resumen = db["whatsapp_leads_resumen_diario"]
+ZONA_HORARIA = timezone("America/Bogota")
+CLAVE = ("phone", "property_id", "arrival_date", "departure_date")
+
+# Ejecutar desde la raíz: python -m Funciones.reconstruir_resumen_leads [YYYY-MM-DD]
+#
+# 1. Une los leads repetidos (mismo teléfono, propiedad y fechas) que se guardaron
+#    antes del upsert: queda el más antiguo, con la suma de conversaciones y los
+#    datos del más reciente. Después crea el índice único, que falla mientras
+#    haya repetidos.
+# 2. Llena `whatsapp_leads_resumen_diario` (lo que lee /whatsapp/leads/resumen)
+#    para los días anteriores a la fecha dada; por defecto, el primer día que
+#    ya tiene contadores en vivo. Cada lead cuenta como nuevo el día en que se
+#    creó y sus conversaciones repetidas se atribuyen a ese mismo día.
+
+# ---- 1. Leads repetidos
+unidos = 0
+grupos = leads.aggregate([
+    {"$group": {"_id": {campo: f"${campo}" for campo in CLAVE}, "ids": {"$push": "$_id"}, "total": {"$sum": 1}}},
+    {"$match": {"total": {"$gt": 1}}},
+], allowDiskUse=True)
+for grupo in grupos:
+    docs = list(leads.find({"_id": {"$in": grupo["ids"]}}).sort([("created_at", ASCENDING), ("_id", ASCENDING)]))
+    conservado, repetidos = docs[0], docs[1:]
+    reciente = max(docs, key=lambda d: d.get("updated_at") or d.get("created_at") or datetime.min)
+    estado = next(
+        (d["status"] for d in sorted(docs, key=lambda d: d.get("updated_at") or datetime.min, reverse=True)
+         if d.get("status") and d["status"] != "nuevo"),
+        conservado.get("status", "nuevo"),
+    )
+    leads.update_one({"_id": conservado["_id"]}, {"$set": {
+        "city": reciente.get("city"),
+        "source": reciente.get("source"),
+        "context": reciente.get("context"),
+        "updated_at": reciente.get("updated_at") or reciente.get("created_at"),
+        "status": estado,
+        "conversaciones": sum(d.get("conversaciones") or 1 for d in docs),
+    }})
+    leads.delete_many({"_id": {"$in": [d["_id"] for d in repetidos]}})
+    unidos += len(repetidos)
+
+print(f"🧹 Leads repetidos unidos: {unidos}")
+leads.create_index([(campo, ASCENDING) for campo in CLAVE], unique=True)
+print("🔑 Índice único de whatsapp_leads listo")
+
+# ---- 2. Resumen diario de los días anteriores al conteo en vivo
+if len(sys.argv) > 1:
+    corte = sys.argv[1]
+else:
+    primero = resumen.find_one({"reconstruido": {"$ne": True}}, {"fecha": 1}, sort=[("fecha", ASCENDING)])
+    corte = primero["fecha"] if primero else (datetime.now(ZONA_HORARIA) + timedelta(days=1)).strftime("%Y-%m-%d")
+
+# created_at se guarda en UTC sin zona: medianoche de Bogotá del día de corte
+corte_utc = ZONA_HORARIA.localize(datetime.strptime(corte, "%Y-%m-%d")).astimezone(utc).replace(tzinfo=None)
+
+operaciones = []
+for fila in leads.aggregate([
+    {"$match": {"created_at": {"$lt": corte_utc}}},
+    {"$group": {
+        "_id": {
+            "fecha": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at", "timezone": "America/Bogota"}},
+            "source": {"$ifNull": ["$source", "SIN_FUENTE"]},
+            "city": {"$ifNull": ["$city", "SIN_CIUDAD"]},
+        },
+        "leads_nuevos": {"$sum": 1},
+        "conversaciones": {"$sum": {"$max": [1, {"$ifNull": ["$conversaciones", 1]}]}},
+    }},
+], allowDiskUse=True):
+    clave = fila["_id"]
+    operaciones.append(ReplaceOne(clave, {
+        **clave,
+        "conversaciones": fila["conversaciones"],
+        "leads_nuevos": fila["leads_nuevos"],
+        "leads_repetidos": fila["conversaciones"] - fila["leads_nuevos"],
+        "actualizado": datetime.utcnow(),
+        "reconstruido": True,
+    }, upsert=True))
+
+if operaciones:
+    resumen.bulk_write(operaciones, ordered=False)
+
+print(f"✅ Resumen diario de leads reconstruido antes de {corte}: {len(operaciones)} filas")
@@ -0,0 +1,106 @@
+# Funciones/servicios.py
+#
+# Operaciones que antes se hacían llamando por HTTP a nuestra propia API
+# (usuarios, glampings, fechas reservadas, correos). Los webhooks y las rutas
+# las usan directamente, sin salir a internet.
+
+from pymongo import MongoClient
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from typing import Dict, Any, Optional
+import os
+import json
+import resend
+
+from Funciones.periodos_reservados import confirmar_retencion
+from utils.circuit_breaker import breaker, con_plazo_en_hilo
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+ConexionMongo = MongoClient(MONGO_URI)
+db = ConexionMongo["glamperos"]
+
+coleccion_usuarios = db["usuarios"]
+coleccion_glampings = db["glampings"]
+
+resend.api_key = resend.api_key or os.getenv("RESEND_API_KEY")
+
+
+def _oid(valor) -> Optional[ObjectId]:
+    if isinstance(valor, ObjectId):
+        return valor
+    try:
+        return ObjectId(str(valor))
+    except (InvalidId, TypeError):
+        return None
+
+
+# =========================
+# USUARIOS
+# =========================
+def obtener_usuario(id_usuario, proyeccion: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+    """Usuario por id (con `id` como string) o None si no existe."""
+    oid = _oid(id_usuario)
+    if not oid:
+        return None
+    usuario = coleccion_usuarios.find_one({"_id": oid}, proyeccion)
+    if not usuario:
+        return None
+    usuario["id"] = str(usuario.pop("_id"))
+    return usuario
+
+
+# =========================
+# GLAMPINGS
+# =========================
+def obtener_glamping(id_glamping, proyeccion: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+    """Glamping por id (con `_id` como string y `ubicacion` como dict) o None si no existe."""
+    oid = _oid(id_glamping)
+    if not oid:
+        return None
+    glamping = coleccion_glampings.find_one({"_id": oid}, proyeccion)
+    if not glamping:
+        return None
+    glamping["_id"] = str(glamping["_id"])
+    if isinstance(glamping.get("ubicacion"), str):
+        try:
+            glamping["ubicacion"] = json.loads(glamping["ubicacion"])
+        except json.JSONDecodeError:
+            pass
+    return glamping
+
+
+def reservar_fechas(id_glamping, fecha_ingreso, fecha_salida, retencion_id=None) -> Optional[Dict[str, Any]]:
+    """
+    Marca como reservadas (manuales) las noches [ingreso, salida) si siguen
+    libres, y quita la retención `retencion_id` de la reserva.
+    Retorna el resultado de la escritura o None si el glamping no existe.
+    Lanza FechasNoDisponibles si otra reserva ya tomó esas noches y ValueError
+    si el rango es inválido.
+    """
+    if not _oid(id_glamping):
+        return None
+    return confirmar_retencion(id_glamping, retencion_id, fecha_ingreso, fecha_salida)
+
+
+# =========================
+# CORREOS
+# =========================
+def enviar_correo(
+    email: str,
+    subject: str,
+    html_content: str,
+    from_email: str = "registro@glamperos.com",
+) -> Dict[str, Any]:
+    """Envía un correo con Resend. Nunca lanza: retorna el estado del envío."""
+    try:
+        with breaker("resend").llamada():
+            response = con_plazo_en_hilo(resend.Emails.send, breaker("resend").timeout_seg, {
+                "from": from_email,
+                "to": [email],
+                "subject": subject,
+                "html": html_content,
+            })
+        return {"status": "success", "response": response}
+    except Exception as e:
+        print(f"⚠️ Error enviando correo a {email}: {e}")
+        return {"status": "error", "error": str(e)}
@@ -1,15 +1,45 @@
 # Funciones/whatsapp_leads.py
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from bson.objectid import ObjectId
 from datetime import datetime
+from pytz import timezone
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 ConexionMongo = MongoClient(MONGO_URI)
 db = ConexionMongo["glamperos"]
 
 coleccion_whatsapp_leads = db["whatsapp_leads"]
+# Contadores por día + fuente + ciudad, se incrementan al guardar cada lead.
+# Los días anteriores a estos contadores los llena
+# `python -m Funciones.reconstruir_resumen_leads`.
+coleccion_resumen_diario = db["whatsapp_leads_resumen_diario"]
+
+ZONA_HORARIA = timezone("America/Bogota")
+
+try:
+    coleccion_whatsapp_leads.create_index(
+        [("phone", ASCENDING), ("property_id", ASCENDING), ("arrival_date", ASCENDING), ("departure_date", ASCENDING)],
+        unique=True,
+    )
+except Exception as e:
+    # Falla si ya hay leads repetidos guardados antes del upsert: los une
+    # `python -m Funciones.reconstruir_resumen_leads`
+    print(
+        f"🚨 No se pudo crear el índice único de whatsapp_leads ({e}). "
+        "Ejecuta python -m Funciones.reconstruir_resumen_leads para unir los repetidos."
+    )
+
+try:
+    coleccion_resumen_diario.create_index(
+        [("fecha", ASCENDING), ("source", ASCENDING), ("city", ASCENDING)],
+        unique=True,
+    )
+except Exception as e:
+    print(f"⚠️ No se pudo crear el índice de whatsapp_leads_resumen_diario: {e}")
+
 
 def guardar_lead(
     phone: str,
@@ -18,19 +48,88 @@ def guardar_lead(
 ) -> str:
     """
     Guarda un lead final (cuando el usuario ya respondió ciudad + fechas + fuente).
-    Retorna el id insertado (string).
+    Un mismo teléfono con la misma propiedad y fechas actualiza su lead en vez
+    de crear otro. Retorna el id del lead (string).
     """
-    doc = {
+    ahora = datetime.utcnow()
+    clave = {
         "phone": phone,
         "property_id": property_id or context.get("property_id"),
-        "city": context.get("city"),
         "arrival_date": context.get("arrival_date"),
         "departure_date": context.get("departure_date"),
-        "source": context.get("source"),
-        "created_at": datetime.utcnow(),
-        "status": "nuevo",  # luego puedes manejar: nuevo, contactado, cerrado, perdido
-        "context": context,  # guardamos todo el contexto por si luego crece
     }
+    nuevo_id = ObjectId()
+
+    anterior = coleccion_whatsapp_leads.find_one_and_update(
+        clave,
+        {
+            "$set": {
+                "city": context.get("city"),
+                "source": context.get("source"),
+                "context": context,  # guardamos todo el contexto por si luego crece
+                "updated_at": ahora,
+            },
+            "$setOnInsert": {
+                "_id": nuevo_id,
+                "created_at": ahora,
+                "status": "nuevo",  # luego puedes manejar: nuevo, contactado, cerrado, perdido
+            },
+            "$inc": {"conversaciones": 1},
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+        projection={"_id": 1},
+    )
+    es_nuevo = anterior is None
+
+    _sumar_resumen(context.get("source"), context.get("city"), es_nuevo)
+    return str(nuevo_id if es_nuevo else anterior["_id"])
 
-    res = coleccion_whatsapp_leads.insert_one(doc)
-    return str(res.inserted_id)
+
+def _sumar_resumen(source: Optional[str], city: Optional[str], es_nuevo: bool):
+    fecha = datetime.now(ZONA_HORARIA).strftime("%Y-%m-%d")
+    try:
+        coleccion_resumen_diario.update_one(
+            {"fecha": fecha, "source": source or "SIN_FUENTE", "city": city or "SIN_CIUDAD"},
+            {
+                "$inc": {
+                    "conversaciones": 1,
+                    "leads_nuevos": 1 if es_nuevo else 0,
+                    "leads_repetidos": 0 if es_nuevo else 1,
+                },
+                "$set": {"actualizado": datetime.utcnow()},
+            },
+            upsert=True,
+        )
+    except Exception as e:
+        # El lead ya quedó guardado; el resumen no debe romper el flujo del bot
+        print(f"⚠️ No se pudo actualizar el resumen diario de leads: {e}")
+
+
+def resumen_leads(
+    desde: str,
+    hasta: str,
+    agrupar_por: List[str],
+) -> List[Dict[str, Any]]:
+    """
+    Totales entre `desde` y `hasta` (YYYY-MM-DD, inclusivos) agrupados por
+    `fecha`, `source` y/o `city`. Solo lee la colección de resumen diario:
+    el historial anterior a los contadores en vivo aparece solo después de
+    correr `python -m Funciones.reconstruir_resumen_leads`.
+    """
+    grupo = {campo: f"${campo}" for campo in agrupar_por}
+    pipeline = [
+        {"$match": {"fecha": {"$gte": desde, "$lte": hasta}}},
+        {"$group": {
+            "_id": grupo or None,
+            "conversaciones": {"$sum": "$conversaciones"},
+            "leads_nuevos": {"$sum": "$leads_nuevos"},
+            "leads_repetidos": {"$sum": "$leads_repetidos"},
+        }},
+        {"$sort": {"leads_nuevos": -1}},
+    ]
+    filas = []
+    for fila in coleccion_resumen_diario.aggregate(pipeline):
+        claves = fila.pop("_id") or {}
+        filas.append({**claves, **fila})
+    return filas
@@ -0,0 +1,58 @@
+# Funciones/whatsapp_mensajes_vistos.py
+
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from cachetools import LRUCache
+from datetime import datetime
+import os
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+ConexionMongo = MongoClient(MONGO_URI)
+db = ConexionMongo["glamperos"]
+
+# 📦 Un documento por id de mensaje de Meta (el id es el _id)
+coleccion_mensajes_vistos = db["whatsapp_mensajes_vistos"]
+
+# Meta puede reentregar un mensaje durante días; pasado esto se olvida
+DIAS_RETENCION = int(os.getenv("WHATSAPP_DEDUPE_DIAS", "7"))
+
+# Ids recientes en memoria: la mayoría de reentregas llegan en segundos
+_vistos_recientes: LRUCache = LRUCache(maxsize=int(os.getenv("WHATSAPP_DEDUPE_LRU", "10000")))
+
+try:
+    coleccion_mensajes_vistos.create_index(
+        [("visto", ASCENDING)],
+        expireAfterSeconds=DIAS_RETENCION * 24 * 3600,
+    )
+except Exception as e:
+    print(f"⚠️ No se pudo crear el índice TTL de mensajes vistos: {e}")
+
+
+def es_duplicado(mensaje_id: str) -> bool:
+    """
+    Marca el mensaje como visto y dice si ya se había recibido antes.
+    Primero mira la LRU en memoria; si no está, un solo insert por _id
+    (DuplicateKeyError = ya visto, también por otra instancia de la app).
+    """
+    if not mensaje_id:
+        return False
+    if mensaje_id in _vistos_recientes:
+        return True
+    try:
+        coleccion_mensajes_vistos.insert_one({"_id": mensaje_id, "visto": datetime.utcnow()})
+        duplicado = False
+    except DuplicateKeyError:
+        duplicado = True
+    _vistos_recientes[mensaje_id] = True
+    return duplicado
+
+
+def olvidar_mensaje(mensaje_id: str) -> None:
+    """
+    Deshace `es_duplicado` cuando el mensaje no se pudo encolar ni procesar:
+    así la reentrega de Meta se atiende en vez de descartarse.
+    """
+    if not mensaje_id:
+        return
+    _vistos_recientes.pop(mensaje_id, None)
+    coleccion_mensajes_vistos.delete_one({"_id": mensaje_id})
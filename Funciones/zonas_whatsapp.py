@@ -0,0 +1,222 @@
+# Funciones/zonas_whatsapp.py
+#
+# Zonas del menú del bot de WhatsApp. Cada zona es un círculo (centro + radio)
+# o un polígono; los glampings habilitados que caen dentro se precalculan en
+# memoria ordenados por calificación, así que responder un menú no recorre el
+# catálogo. El listado se recalcula cuando cambia un glamping y cada cierto tiempo.
+
+from pymongo import MongoClient
+from bson.objectid import ObjectId
+from math import radians, cos, sin, asin, sqrt
+from typing import Dict, Any, List, Optional, Tuple
+import os
+import json
+import time
+import asyncio
+from datetime import date, timedelta
+
+from Funciones.periodos_reservados import filtro_sin_solape
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+ConexionMongo = MongoClient(MONGO_URI)
+db = ConexionMongo["glamperos"]
+
+coleccion_glampings = db["glampings"]
+
+URL_PROPIEDAD = "https://glamperos.com/propiedad/{}"
+
+# Orden = número de opción en el menú. Se pueden reemplazar con WHATSAPP_ZONAS_JSON
+# (misma forma; "poligono" es una lista de [lat, lng] y tiene prioridad sobre el radio).
+ZONAS_POR_DEFECTO: List[Dict[str, Any]] = [
+    {"codigo": "ZONA_BOGOTA", "nombre": "Cerca a Bogotá", "centro": [4.7110, -74.0721], "radio_km": 90},
+    {"codigo": "ZONA_GUATAVITA", "nombre": "Guatavita", "centro": [4.9360, -73.8330], "radio_km": 15},
+    {"codigo": "ZONA_MEDELLIN", "nombre": "Cerca a Medellín", "centro": [6.2442, -75.5812], "radio_km": 80},
+    {"codigo": "ZONA_BOYACA", "nombre": "Boyacá", "centro": [5.6000, -73.3500], "radio_km": 85},
+    {"codigo": "ZONA_SANTANDER", "nombre": "Santander", "centro": [6.7000, -73.1000], "radio_km": 110},
+]
+
+
+def _cargar_zonas() -> List[Dict[str, Any]]:
+    crudo = os.getenv("WHATSAPP_ZONAS_JSON")
+    if not crudo:
+        return ZONAS_POR_DEFECTO
+    try:
+        zonas = json.loads(crudo)
+        if isinstance(zonas, list) and zonas:
+            return zonas
+    except json.JSONDecodeError as e:
+        print(f"⚠️ WHATSAPP_ZONAS_JSON inválido, se usan las zonas por defecto: {e}")
+    return ZONAS_POR_DEFECTO
+
+
+ZONAS = _cargar_zonas()
+MAX_LINKS_ZONA = int(os.getenv("WHATSAPP_ZONA_MAX_LINKS", "14"))
+REFRESCO_SEG = float(os.getenv("WHATSAPP_ZONAS_REFRESCO_SEGUNDOS", "600"))
+
+# codigo -> [{"id", "calificacion", "distancia"}] ordenados por calificación
+_listados: Dict[str, List[Dict[str, Any]]] = {}
+_actualizado: Optional[float] = None
+# Despierta al bucle de refresco cuando cambia el catálogo
+_hay_cambios: Optional[asyncio.Event] = None
+
+
+# =========================
+# GEOMETRÍA
+# =========================
+def haversine(lat1, lon1, lat2, lon2):
+    """Distancia en km entre dos puntos GPS."""
+    dlat, dlon = radians(lat2 - lat1), radians(lon2 - lon1)
+    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
+    return 6371 * 2 * asin(sqrt(a))
+
+
+def _en_poligono(lat: float, lng: float, poligono: List[List[float]]) -> bool:
+    """Ray casting sobre los vértices [lat, lng]."""
+    dentro = False
+    j = len(poligono) - 1
+    for i in range(len(poligono)):
+        lat_i, lng_i = poligono[i]
+        lat_j, lng_j = poligono[j]
+        if (lng_i > lng) != (lng_j > lng):
+            corte = (lat_j - lat_i) * (lng - lng_i) / (lng_j - lng_i) + lat_i
+            if lat < corte:
+                dentro = not dentro
+        j = i
+    return dentro
+
+
+def _coordenadas(glamping: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    ubicacion = glamping.get("ubicacion")
+    if isinstance(ubicacion, str):
+        try:
+            ubicacion = json.loads(ubicacion)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(ubicacion, dict):
+        return None
+    try:
+        return float(ubicacion["lat"]), float(ubicacion["lng"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _distancia_en_zona(zona: Dict[str, Any], lat: float, lng: float) -> Optional[float]:
+    """Distancia al centro si el punto está en la zona; None si queda fuera."""
+    centro = zona.get("centro")
+    distancia = haversine(centro[0], centro[1], lat, lng) if centro else 0.0
+    if zona.get("poligono"):
+        return distancia if _en_poligono(lat, lng, zona["poligono"]) else None
+    return distancia if distancia <= float(zona.get("radio_km", 0)) else None
+
+
+def _calificacion(glamping: Dict[str, Any]) -> float:
+    try:
+        return float(glamping.get("calificacion") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# =========================
+# PRECÁLCULO
+# =========================
+def refrescar_zonas() -> Dict[str, int]:
+    """Recorre el catálogo una vez y recalcula el listado de todas las zonas."""
+    global _listados, _actualizado
+    listados: Dict[str, List[Dict[str, Any]]] = {z["codigo"]: [] for z in ZONAS}
+    cursor = coleccion_glampings.find({"habilitado": True}, {"ubicacion": 1, "calificacion": 1})
+    for glamping in cursor:
+        coords = _coordenadas(glamping)
+        if not coords:
+            continue
+        for zona in ZONAS:
+            distancia = _distancia_en_zona(zona, *coords)
+            if distancia is not None:
+                listados[zona["codigo"]].append({
+                    "id": str(glamping["_id"]),
+                    "calificacion": _calificacion(glamping),
+                    "distancia": distancia,
+                })
+    for candidatos in listados.values():
+        candidatos.sort(key=lambda c: (-c["calificacion"], c["distancia"]))
+    # Se reemplaza el diccionario completo: los lectores nunca ven uno a medias
+    _listados = listados
+    _actualizado = time.monotonic()
+    return {codigo: len(c) for codigo, c in listados.items()}
+
+
+def invalidar_zonas():
+    """Pide recalcular las zonas (llamar tras crear, editar o borrar un glamping)."""
+    global _actualizado
+    if _hay_cambios is not None:
+        _hay_cambios.set()
+    else:
+        _actualizado = None
+
+
+async def bucle_zonas():
+    """Mantiene las zonas al día (se inicia en el lifespan de la app)."""
+    global _hay_cambios
+    _hay_cambios = asyncio.Event()
+    while True:
+        try:
+            await asyncio.to_thread(refrescar_zonas)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Error recalculando las zonas de WhatsApp: {e}")
+        _hay_cambios.clear()
+        try:
+            await asyncio.wait_for(_hay_cambios.wait(), timeout=REFRESCO_SEG)
+        except asyncio.TimeoutError:
+            pass
+
+
+# =========================
+# CONSULTA
+# =========================
+def zona_por_opcion(opcion: str) -> Optional[Dict[str, Any]]:
+    """Zona según el número respondido en el menú ("1", "2", ...)."""
+    if not opcion.isdigit():
+        return None
+    indice = int(opcion) - 1
+    return ZONAS[indice] if 0 <= indice < len(ZONAS) else None
+
+
+def zona_por_codigo(codigo: Optional[str]) -> Optional[Dict[str, Any]]:
+    return next((z for z in ZONAS if z["codigo"] == codigo), None)
+
+
+def texto_opciones_zonas() -> str:
+    """Líneas "1️⃣ Zona" del menú numerado."""
+    return "\n".join(
+        (f"{i}\ufe0f\u20e3" if i < 10 else f"{i}.") + f" {z['nombre']}"
+        for i, z in enumerate(ZONAS, start=1)
+    )
+
+
+def links_zona(
+    codigo: str,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    limite: int = MAX_LINKS_ZONA,
+) -> List[str]:
+    """
+    Links de la zona ordenados por calificación. Con fechas ("YYYY-MM-DD", fin
+    exclusivo) solo quedan los disponibles, consultados en una sola lectura por _id.
+    """
+    if _actualizado is None and _hay_cambios is None:
+        # Sin bucle de refresco (p. ej. fuera del lifespan): calcular en línea
+        refrescar_zonas()
+    candidatos = _listados.get(codigo, [])
+    if not candidatos:
+        return []
+
+    if fecha_inicio and fecha_fin:
+        # filtro_sin_solape incluye la noche de su fecha final: la salida no se cuenta
+        ultima_noche = (date.fromisoformat(fecha_fin) - timedelta(days=1)).isoformat()
+        ids = [c["id"] for c in candidatos]
+        filtro = {"_id": {"$in": [ObjectId(i) for i in ids]}, **filtro_sin_solape(fecha_inicio, ultima_noche)}
+        libres = {str(g["_id"]) for g in coleccion_glampings.find(filtro, {"_id": 1})}
+        candidatos = [c for c in candidatos if c["id"] in libres]
+
+    return [URL_PROPIEDAD.format(c["id"]) for c in candidatos[:limite]]
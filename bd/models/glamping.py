@@ -60,6 +60,8 @@ class ModeloGlamping(BaseModel):
     fechasReservadasManual: Optional[List[str]] = None
     fechasReservadasAirbnb: Optional[List[str]] = None
     fechasReservadasBooking: Optional[List[str]] = None
+    periodosReservados: Optional[List[dict]] = None
+    fechasVersion: Optional[int] = None
     urlIcal: Optional[str] = None
     urlIcalBooking: Optional[str] = None
 
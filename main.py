@@ -1,6 +1,9 @@
 from fastapi import FastAPI, Request
 from starlette.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import os
+import socketio
 
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -19,8 +22,8 @@ from rutas.glamping import ruta_glampings
 from rutas.enviarCorreo import ruta_correos
 from rutas.favoritos import ruta_favoritos
 from rutas.evaluacion import ruta_evaluaciones
-from rutas.mensajeria import ruta_mensajes
-from rutas.whatsapp import ruta_whatsapp
+from rutas.mensajeria import ruta_mensajes, sio, iniciar_mensajeria, detener_mensajeria
+from rutas.whatsapp import ruta_whatsapp, iniciar_workers_whatsapp
 from rutas.reserva import ruta_reserva
 from rutas.wompi import ruta_wompi
 from rutas.openai import ruta_openai
@@ -31,7 +34,30 @@ from rutas.bonos import ruta_bonos
 from rutas.keywords import ruta_keywords
 from rutas.aseo import ruta_aseo
 
-app = FastAPI(title="Glamperos", version="1.0")
+from Funciones.pagos_wompi import bucle_conciliacion
+from Funciones.outbox import iniciar_workers
+from Funciones.zonas_whatsapp import bucle_zonas
+from utils.http_clientes import iniciar_clientes, cerrar_clientes
+from utils.circuit_breaker import estados as estados_integraciones
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await iniciar_clientes()
+    await iniciar_mensajeria()
+    # Tareas en segundo plano mientras la app está arriba
+    tareas = [asyncio.create_task(bucle_conciliacion()), asyncio.create_task(bucle_zonas())]
+    tareas += iniciar_workers()
+    tareas += iniciar_workers_whatsapp()
+    yield
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+    await detener_mensajeria()
+    await cerrar_clientes()
+
+
+app = FastAPI(title="Glamperos", version="1.0", lifespan=lifespan)
 
 # Configuración de CORS
 app.add_middleware(
@@ -75,3 +101,13 @@ app.include_router(ruta_aseo)
 @app.get("/", tags=["Home"])
 async def root():
     return {"message": "Hola Glampero"}
+
+
+@app.get("/estado-integraciones", tags=["Home"])
+async def estado_integraciones():
+    """Estado de los cortacircuitos de cada integración externa."""
+    return estados_integraciones()
+
+
+# Socket.IO en /socket.io/ y el resto de peticiones (y el lifespan) van a FastAPI
+app = socketio.ASGIApp(sio, other_asgi_app=app)
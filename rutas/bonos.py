@@ -7,7 +7,9 @@ from typing import Optional, List
 from google.cloud import storage
 import os, random, string, json, base64, uuid
 from Funciones.pdfBonos import generar_pdf_bono_bytes
-from rutas.whatsapp_utils import enviar_whatsapp_compra_bonos
+from rutas.whatsapp_utils import cuerpo_whatsapp_compra_bonos
+from Funciones.outbox import encolar_correo, encolar_whatsapp_template
+from utils.circuit_breaker import breaker, CircuitoAbierto, con_plazo_en_hilo
 from google.oauth2 import service_account  # <-- nuevo import
 
 # ===================== PDF =====================
@@ -70,8 +72,11 @@ def subir_a_google_storage(archivo: UploadFile, carpeta: str, nombre: Optional[s
         ext = archivo.filename.split(".")[-1].lower() if archivo.filename and "." in archivo.filename else "dat"
         nombre_archivo = nombre or f"{carpeta}/{uuid.uuid4().hex}.{ext}"
         blob = bucket.blob(nombre_archivo)
-        blob.upload_from_file(archivo.file, content_type=archivo.content_type)
+        with breaker("gcs").llamada():
+            blob.upload_from_file(archivo.file, content_type=archivo.content_type, timeout=breaker("gcs").timeout_seg)
         return f"https://storage.googleapis.com/{BUCKET_NAME}/{nombre_archivo}"
+    except CircuitoAbierto as e:
+        raise HTTPException(status_code=503, detail=f"Google Storage no disponible: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al subir a Google Storage: {str(e)}")
 
@@ -82,8 +87,11 @@ def subir_bytes_a_google_storage(data: bytes, carpeta: str, filename: str, conte
         bucket = _get_bucket()
         nombre_archivo = f"{carpeta}/{filename}"
         blob = bucket.blob(nombre_archivo)
-        blob.upload_from_string(data, content_type=content_type)
+        with breaker("gcs").llamada():
+            blob.upload_from_string(data, content_type=content_type, timeout=breaker("gcs").timeout_seg)
         return f"https://storage.googleapis.com/{BUCKET_NAME}/{nombre_archivo}"
+    except CircuitoAbierto as e:
+        raise HTTPException(status_code=503, detail=f"Google Storage no disponible: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al subir bytes a Google Storage: {str(e)}")
 
@@ -199,7 +207,12 @@ def enviar_correo(destinatario: str, asunto: str, html: str,
     if adjuntos:
         payload["attachments"] = adjuntos
     try:
-        return resend.Emails.send(payload)
+        with breaker("resend").llamada():
+            return con_plazo_en_hilo(resend.Emails.send, breaker("resend").timeout_seg, payload)
+    except CircuitoAbierto as e:
+        raise HTTPException(status_code=503, detail=f"Servicio de correo no disponible: {str(e)}")
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="El servicio de correo no respondió a tiempo")
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Error enviando correo: {str(e)}")
 
@@ -377,9 +390,9 @@ async def comprar_bonos(
             </ul>
             <p><i>Una vez confirmemos el pago, te llegará un único correo con tus bonos adjuntos/enlaces.</i></p>
         """
-        enviar_correo(destinatario=email_comprador, asunto=asunto_cliente, html=html_cliente)
-    except:
-        pass
+        encolar_correo(destinatario=email_comprador, asunto=asunto_cliente, html=html_cliente, remitente=MAIL_FROM)
+    except Exception as e:
+        print(f"⚠️ No se pudo encolar el correo al cliente de bonos: {e}")
 
     # ---- Correo a CONTABILIDAD: notificación con comprobante adjunto
     try:
@@ -402,24 +415,25 @@ async def comprar_bonos(
             "content": base64.b64encode(soporte_bytes).decode("utf-8"),
             "contentType": soporte_pago.content_type or "application/octet-stream",
         }]
-        enviar_correo(
+        encolar_correo(
             destinatario="contabilidad@glamperos.com",
             asunto=asunto_conta,
             html=html_conta,
+            remitente=MAIL_FROM,
             adjuntos=adjunto_soporte
         )
-    except:
-        pass
+    except Exception as e:
+        print(f"⚠️ No se pudo encolar el correo a contabilidad: {e}")
 
-    # ---- WhatsApp (manteniendo enviar_whatsapp_compra_bonos)
+    # ---- WhatsApp (plantilla notifica_compra_bonos, vía outbox)
     try:
-        await enviar_whatsapp_compra_bonos(
+        encolar_whatsapp_template(cuerpo_whatsapp_compra_bonos(
             numero="573125443396",  # TODO: reemplazar por el teléfono real del cliente si lo tienes
             pdf=soporte_url,
             correo_cliente=str(compra_lote_id) ,
             valor_bono=f"Total redimible ${total_redimible:,} | Total pagado con IVA: ${total_con_iva:,}",
             imagenUrl="https://storage.googleapis.com/glamperos-imagenes/Imagenes/bono.png"
-        )
+        ))
 
         # await enviar_whatsapp_compra_bonos(
         #     numero="573197862921",  # TODO: reemplazar por el teléfono real del cliente si lo tienes
@@ -428,8 +442,8 @@ async def comprar_bonos(
         #     valor_bono=f"Total redimible ${total_redimible:,} | Total pagado con IVA: ${total_con_iva:,}",
         #     imagenUrl="https://storage.googleapis.com/glamperos-imagenes/Imagenes/bono.png"
         # )
-    except:
-        pass
+    except Exception as e:
+        print(f"⚠️ No se pudo encolar el WhatsApp de compra de bonos: {e}")
 
     # ---- Respuesta API
     return {
@@ -592,7 +606,7 @@ async def aprobar_lote(
         """
 
         adjuntos = [factura_adjunto] if factura_adjunto else None
-        enviar_correo(destinatario=email_comprador, asunto=asunto, html=html, adjuntos=adjuntos)
+        encolar_correo(destinatario=email_comprador, asunto=asunto, html=html, remitente=MAIL_FROM, adjuntos=adjuntos)
 
     return {"mensaje": f"{aprobados} bono(s) aprobados y activados. Se envió un único correo al comprador.",
             "aprobados": aprobados,
@@ -816,7 +830,8 @@ async def reenviar_bonos_lote(
             if blob_name:
                 bucket = _get_bucket()
                 blob = bucket.blob(blob_name)
-                factura_bytes = blob.download_as_bytes()
+                with breaker("gcs").llamada():
+                    factura_bytes = blob.download_as_bytes(timeout=breaker("gcs").timeout_seg)
                 ext_fac = "dat"
                 if "." in blob_name:
                     ext_fac = blob_name.rsplit(".", 1)[-1].lower()
@@ -879,7 +894,8 @@ async def reenviar_bonos_lote(
                 if blob_name:
                     bucket = _get_bucket()
                     blob = bucket.blob(blob_name)
-                    bono_bytes = blob.download_as_bytes()
+                    with breaker("gcs").llamada():
+                        bono_bytes = blob.download_as_bytes(timeout=breaker("gcs").timeout_seg)
                     adjuntos_email.append({
                         "filename": f"{b['codigo_unico']}.pdf",
                         "content": base64.b64encode(bono_bytes).decode("utf-8")
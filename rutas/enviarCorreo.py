@@ -1,7 +1,8 @@
 import os
-from fastapi import APIRouter, status, HTTPException
+from fastapi import APIRouter, status
 from pydantic import BaseModel
 import resend
+from Funciones.servicios import enviar_correo
 
 # Cargar la clave de API desde las variables de entorno
 resend.api_key = os.getenv("RESEND_API_KEY")
@@ -27,18 +28,9 @@ class EmailRequest(BaseModel):
 
 @ruta_correos.post("/send-email")
 async def send_email(data: EmailRequest):
-    try:
-        # Agregar correo adicional por defecto
-        destinatarios = [data.email]
-
-        # Enviar el correo
-        response = resend.Emails.send({
-            "from": data.from_email,  # Usar el remitente proporcionado o el valor por defecto
-            "to": destinatarios,
-            "subject": data.subject,
-            "html": data.html_content  # Usar el contenido HTML enviado desde el frontend
-        })
-
-        return {"status": "success", "response": response}
-    except Exception as e:
-        return {"status": "error", "error": str(e)}
+    return enviar_correo(
+        email=data.email,
+        subject=data.subject,
+        html_content=data.html_content,
+        from_email=data.from_email,  # Usar el remitente proporcionado o el valor por defecto
+    )
@@ -1,16 +1,29 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from pymongo import MongoClient
+from fastapi import APIRouter, HTTPException, Depends, status, Body, Query
+from pymongo import MongoClient, ASCENDING, DESCENDING
 from bson import ObjectId
-from typing import List
-from pydantic import BaseModel
+from bson.errors import InvalidId
+from typing import List, Optional
+from pydantic import BaseModel, Field
 from datetime import datetime, timezone
 import os
 
+from Funciones.calificaciones import (
+    sumar_calificacion, resumen_calificacion, resumenes_calificacion, CALIFICACION_INICIAL,
+)
+
 # Configuración de la base de datos
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 ConexionMongo = MongoClient(MONGO_URI)
 db = ConexionMongo["glamperos"]
 
+# Listado paginado de evaluaciones de un glamping, más nuevas primero
+try:
+    db.evaluaciones.create_index(
+        [("glamping_id", ASCENDING), ("fecha_agregado", DESCENDING), ("_id", DESCENDING)]
+    )
+except Exception as e:
+    print(f"⚠️ No se pudo crear el índice de evaluaciones por fecha: {e}")
+
 # Crear el router para evaluaciones
 ruta_evaluaciones = APIRouter(
     prefix="/evaluaciones",
@@ -23,7 +36,7 @@ class Evaluacion(BaseModel):
     usuario_id: str
     glamping_id: str
     nombre_usuario: str
-    fecha_agregado: datetime = datetime.now(timezone.utc)
+    fecha_agregado: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     calificacion: float 
     comentario: str 
     codigoReserva: str 
@@ -48,22 +61,77 @@ async def agregar_evaluacion(evaluacion: Evaluacion):
     nueva_evaluacion = evaluacion.model_dump()
     resultado = db.evaluaciones.insert_one(nueva_evaluacion)
     nueva_evaluacion["_id"] = str(resultado.inserted_id)
+    # Suma/conteo en el glamping y su `calificacion` derivada
+    sumar_calificacion(evaluacion.glamping_id, evaluacion.calificacion)
     return {"mensaje": "Evaluación agregada", "evaluacion": modelo_evaluacion(nueva_evaluacion)}
 
 # Endpoint para listar evaluaciones de un glamping
 @ruta_evaluaciones.get("/glamping/{glamping_id}", response_model=List[dict])
 async def listar_evaluaciones_glamping(glamping_id: str):
-    evaluaciones = list(db.evaluaciones.find({"glamping_id": glamping_id}))
+    evaluaciones = list(
+        db.evaluaciones.find({"glamping_id": glamping_id}).sort([("fecha_agregado", DESCENDING), ("_id", DESCENDING)])
+    )
     if not evaluaciones:
         raise HTTPException(status_code=404, detail="No se encontraron evaluaciones para este glamping")
     return [modelo_evaluacion(evaluacion) for evaluacion in evaluaciones]
 
+def _cursor_evaluacion(evaluacion) -> str:
+    return f"{evaluacion['fecha_agregado'].isoformat()}|{evaluacion['_id']}"
+
+
+def _leer_cursor(cursor: str):
+    try:
+        fecha, id_evaluacion = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(fecha), ObjectId(id_evaluacion)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+# Endpoint para listar evaluaciones de un glamping por páginas (más nuevas primero)
+@ruta_evaluaciones.get("/glamping/{glamping_id}/pagina", response_model=dict)
+async def listar_evaluaciones_paginadas(
+    glamping_id: str,
+    limite: int = Query(10, ge=1, le=50),
+    cursor: Optional[str] = Query(None, description="Valor `siguiente` de la página anterior"),
+):
+    """
+    Cada página es una lectura por el índice (glamping_id, fecha_agregado, _id).
+    La primera página (sin cursor) incluye el resumen de calificación.
+    """
+    filtro = {"glamping_id": glamping_id}
+    if cursor:
+        fecha, id_evaluacion = _leer_cursor(cursor)
+        filtro["$or"] = [
+            {"fecha_agregado": {"$lt": fecha}},
+            {"fecha_agregado": fecha, "_id": {"$lt": id_evaluacion}},
+        ]
+
+    evaluaciones = list(
+        db.evaluaciones.find(filtro)
+        .sort([("fecha_agregado", DESCENDING), ("_id", DESCENDING)])
+        .limit(limite)
+    )
+    respuesta = {
+        "evaluaciones": [modelo_evaluacion(evaluacion) for evaluacion in evaluaciones],
+        "siguiente": _cursor_evaluacion(evaluaciones[-1]) if len(evaluaciones) == limite else None,
+    }
+    if not cursor:
+        resumen = resumen_calificacion(glamping_id)
+        conteo = resumen["conteo"] if resumen else 0
+        respuesta["resumen"] = {
+            "calificacion_promedio": resumen["promedio"] if conteo else CALIFICACION_INICIAL,
+            "calificacionEvaluaciones": conteo,
+        }
+    return respuesta
+
 # Endpoint para eliminar una evaluación
 @ruta_evaluaciones.delete("/", response_model=dict)
 async def eliminar_evaluacion(usuario_id: str, glamping_id: str):
-    resultado = db.evaluaciones.delete_one({"usuario_id": usuario_id, "glamping_id": glamping_id})
-    if resultado.deleted_count == 0:
+    # find_one_and_delete: hace falta la calificación borrada para restarla
+    eliminada = db.evaluaciones.find_one_and_delete({"usuario_id": usuario_id, "glamping_id": glamping_id})
+    if not eliminada:
         raise HTTPException(status_code=404, detail="Evaluación no encontrada")
+    sumar_calificacion(glamping_id, eliminada["calificacion"], signo=-1)
     return {"mensaje": "Evaluación eliminada"}
 
 # Endpoint para buscar una evaluación
@@ -78,33 +146,54 @@ async def buscar_evaluacion(usuario_id: str, glamping_id: str):
 # Evaluacion promedio
 @ruta_evaluaciones.get("/glamping/{glamping_id}/promedio", response_model=dict)
 async def obtener_calificacion_promedio(glamping_id: str):
-    # Usamos la función aggregate para calcular la calificación promedio y la cantidad de evaluaciones
-    pipeline = [
-        {"$match": {"glamping_id": glamping_id}},  # Filtramos las evaluaciones por glamping_id
-        {"$group": {
-            "_id": "$glamping_id", 
-            "promedio_calificacion": {"$avg": "$calificacion"}, 
-            "calificacionEvaluaciones": {"$sum": 1}  # Cuenta el número de evaluaciones
-        }}
-    ]
-    resultado = list(db.evaluaciones.aggregate(pipeline))
-    
-    if resultado:
-        # Si hay resultados, devolvemos el promedio y la cantidad de calificaciones
+    # Lectura de ratingSum/ratingCount del glamping (se mantienen al agregar o eliminar)
+    resumen = resumen_calificacion(glamping_id)
+
+    if resumen and resumen["conteo"]:
+        # Si hay evaluaciones, devolvemos el promedio y la cantidad de calificaciones
         return {
             "glamping_id": glamping_id,
-            "calificacion_promedio": resultado[0]["promedio_calificacion"],
-            "calificacionEvaluaciones": resultado[0]["calificacionEvaluaciones"]
+            "calificacion_promedio": resumen["promedio"],
+            "calificacionEvaluaciones": resumen["conteo"]
         }
     else:
-        # Si no hay evaluaciones, devolvemos un valor predeterminado de 4 y 0 evaluaciones
+        # Si no hay evaluaciones, devolvemos un valor predeterminado de 5 y 1 evaluación
         return {
             "glamping_id": glamping_id,
-            "calificacion_promedio": 5,
+            "calificacion_promedio": CALIFICACION_INICIAL,
             "calificacionEvaluaciones": 1
         }
 
 
+MAX_IDS_PROMEDIOS = int(os.getenv("EVALUACIONES_MAX_IDS_PROMEDIOS", "100"))
+
+
+# Promedios de varios glampings a la vez (páginas de listado)
+@ruta_evaluaciones.post("/promedios", response_model=dict)
+async def obtener_calificaciones_promedio(glamping_ids: List[str] = Body(..., embed=True)):
+    """
+    Mismo resultado que /glamping/{id}/promedio para cada id, en una sola consulta.
+    Cuerpo: {"glamping_ids": ["...", "..."]}
+    """
+    if len(glamping_ids) > MAX_IDS_PROMEDIOS:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_IDS_PROMEDIOS} glampings por consulta")
+
+    resumenes = resumenes_calificacion(list(dict.fromkeys(glamping_ids)))
+    promedios = {}
+    for glamping_id, resumen in resumenes.items():
+        if resumen and resumen["conteo"]:
+            promedios[glamping_id] = {
+                "calificacion_promedio": resumen["promedio"],
+                "calificacionEvaluaciones": resumen["conteo"],
+            }
+        else:
+            promedios[glamping_id] = {
+                "calificacion_promedio": CALIFICACION_INICIAL,
+                "calificacionEvaluaciones": 1,
+            }
+    return {"promedios": promedios}
+
+
 # Endpoint para verificar si un codigoReserva tiene calificación
 @ruta_evaluaciones.get("/codigoReserva/{codigoReserva}/tieneCalificacion", response_model=dict)
 async def verificar_calificacion_codigo_reserva(codigoReserva: str):
@@ -1,6 +1,5 @@
 from fastapi import APIRouter, HTTPException, UploadFile, Form, File, Body, Query, Request
 from geopy.distance import geodesic
-from datetime import timedelta
 from google.cloud import storage
 from pymongo import MongoClient
 from bson.objectid import ObjectId
@@ -15,8 +14,16 @@ import base64
 import uuid
 import json
 from bd.models.glamping import ModeloGlamping
+from Funciones.periodos_reservados import (
+    fechas_a_periodos, periodos_de_documento, periodos_a_fechas, expandir_fechas,
+    agregar_fechas, eliminar_fechas, obtener_arbol, filtro_sin_solape, PROYECCION_PERIODOS,
+    CAMPO_RETENCIONES,
+)
 from PIL import Image, ExifTags
 from utils.deepseek_utils import extraer_intencion, generar_respuesta
+from utils.circuit_breaker import breaker, CircuitoAbierto
+from Funciones.zonas_whatsapp import invalidar_zonas
+from Funciones.calificaciones import tiene_evaluaciones
 from fastapi.responses import StreamingResponse
 from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
@@ -69,18 +76,6 @@ MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 ConexionMongo = MongoClient(MONGO_URI)
 db = ConexionMongo["glamperos"]
 
-def actualizar_union_fechas(glamping_id: str):
-    glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
-    manual = set(glamping.get("fechasReservadasManual", []))
-    airbnb = set(glamping.get("fechasReservadasAirbnb", []))
-    booking = set(glamping.get("fechasReservadasBooking", []))
-    union = list(manual.union(airbnb).union(booking))
-    db["glampings"].update_one(
-        {"_id": ObjectId(glamping_id)},
-        {"$set": {"fechasReservadas": union}}
-    )
-
-
 # Crear el router para glampings
 ruta_glampings = APIRouter(
     prefix="/glampings",
@@ -167,9 +162,12 @@ def subir_a_google_storage(archivo: UploadFile, carpeta: str = "glampings") -> s
 
         nombre_archivo = f"{carpeta}/{uuid.uuid4().hex}.webp"
         blob = bucket.blob(nombre_archivo)
-        blob.upload_from_file(archivo_optimizado, content_type="image/webp")
+        with breaker("gcs").llamada():
+            blob.upload_from_file(archivo_optimizado, content_type="image/webp", timeout=breaker("gcs").timeout_seg)
 
         return f"https://storage.googleapis.com/{BUCKET_NAME}/{nombre_archivo}"
+    except CircuitoAbierto as e:
+        raise HTTPException(status_code=503, detail=f"Google Storage no disponible: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al subir la imagen a Google Storage: {str(e)}")
 
@@ -185,6 +183,8 @@ def convertir_objectid(documento):
                 documento["ubicacion"] = json.loads(documento["ubicacion"])
             except json.JSONDecodeError:
                 pass
+        # Las fechas por noche se derivan de los periodos reservados
+        expandir_fechas(documento)
         return documento
     return documento
 
@@ -228,8 +228,9 @@ async def crear_glamping(
             except HTTPException as e:
                 raise HTTPException(status_code=400, detail=f"Error con la imagen '{imagen.filename}': {e.detail}")
 
-        # Manejo de fechasReservadas
+        # Manejo de fechasReservadas: se guardan como periodos manuales
         fechas_reservadas_lista = fechasReservadas.split(",") if fechasReservadas else []
+        periodos_reservados = fechas_a_periodos(fechas_reservadas_lista, "manual")
 
         # Procesamiento de amenidadesGlobal: convertir de cadena a lista de amenidades
         amenidades_lista = [amenidad.strip() for amenidad in amenidadesGlobal.split(",")]
@@ -258,7 +259,11 @@ async def crear_glamping(
             "imagenes": imagen_urls,
             "video_youtube": video_youtube,
             "calificacion": 5,
-            "fechasReservadas": fechas_reservadas_lista,
+            # Agregados de calificación desde el inicio: sumar_calificacion no tiene que inicializarlos
+            "ratingSum": 0,
+            "ratingCount": 0,
+            "periodosReservados": periodos_reservados,
+            "fechasVersion": 1,
             "creado": fecha_creacion_colombia,
             "propietario_id": propietario_id,
             "urlIcal": urlIcal,
@@ -268,6 +273,7 @@ async def crear_glamping(
         # Intentar insertar en MongoDB
         resultado = db["glampings"].insert_one(nuevo_glamping)
         glamping_id = str(resultado.inserted_id)
+        invalidar_zonas()
 
         # Asociar glamping al usuario propietario
         db["usuarios"].update_one(
@@ -323,13 +329,10 @@ async def glamping_filtrados(
                 precio_filter["$lte"] = precioMax
             filtro["precioEstandar"] = precio_filter
         if fechaInicio and fechaFin:
-            inicio_dt = datetime.strptime(fechaInicio, "%Y-%m-%d")
-            fin_dt = datetime.strptime(fechaFin, "%Y-%m-%d")
-            dias_rango = [
-                (inicio_dt + timedelta(days=i)).strftime("%Y-%m-%d")
-                for i in range((fin_dt - inicio_dt).days + 1)
-            ]
-            filtro["fechasReservadas"] = {"$not": {"$elemMatch": {"$in": dias_rango}}}
+            datetime.strptime(fechaInicio, "%Y-%m-%d")
+            datetime.strptime(fechaFin, "%Y-%m-%d")
+            # Sin periodos que se crucen con el rango (y sin noches sueltas en documentos sin migrar)
+            filtro.update(filtro_sin_solape(fechaInicio, fechaFin))
         if amenidades:
             filtro["amenidadesGlobal"] = {"$all": amenidades}
 
@@ -345,7 +348,8 @@ async def glamping_filtrados(
         sort_criteria.append(("_id", 1))
 
         # Consulta base
-        cursor = db["glampings"].find(filtro).sort(sort_criteria)
+        # Las retenciones de pago en curso son internas: no salen en la respuesta
+        cursor = db["glampings"].find(filtro, {CAMPO_RETENCIONES: 0}).sort(sort_criteria)
         resultados = list(cursor)
 
         # Filtrar por capacidad de huéspedes
@@ -486,6 +490,7 @@ async def eliminar_glamping(glamping_id: str):
         resultado = db["glampings"].delete_one({"_id": ObjectId(glamping_id)})
         if resultado.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Glamping no encontrado")
+        invalidar_zonas()
         return {"mensaje": "Glamping eliminado correctamente"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al eliminar glamping: {str(e)}")
@@ -531,14 +536,24 @@ async def actualizar_calificacion(
         if not glamping:
             raise HTTPException(status_code=404, detail="Glamping no encontrado")
 
+        # Con evaluaciones la calificación se deriva de ellas (ratingSum / ratingCount)
+        if glamping.get("ratingCount") or tiene_evaluaciones(glamping_id):
+            raise HTTPException(
+                status_code=409,
+                detail="El glamping tiene evaluaciones: su calificación se calcula a partir de ellas",
+            )
+
         # Actualizar la calificación
         actualizaciones = {"calificacion": calificacion}
         db["glampings"].update_one({"_id": ObjectId(glamping_id)}, {"$set": actualizaciones})
+        invalidar_zonas()
 
         # Obtener el glamping actualizado
         glamping_actualizado = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
         return ModeloGlamping(**convertir_objectid(glamping_actualizado))
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al actualizar la calificación: {str(e)}")
 
@@ -616,6 +631,7 @@ async def actualizar_glamping(glamping_id: str, request: Request):
             return ModeloGlamping(**convertir_objectid(glamping))
 
         db["glampings"].update_one({"_id": ObjectId(glamping_id)}, {"$set": actualizaciones})
+        invalidar_zonas()
         glamping_actualizado = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
         return ModeloGlamping(**convertir_objectid(glamping_actualizado))
 
@@ -771,21 +787,66 @@ async def agregar_imagenes_glamping(
 @ruta_glampings.get("/{glamping_id}/fechasReservadas", response_model=List[str])
 async def obtener_fechas_reservadas(glamping_id: str):
     try:
-        # Buscar el glamping por su ID
-        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
+        # Buscar solo los periodos del glamping
+        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)}, PROYECCION_PERIODOS)
         if not glamping:
             raise HTTPException(status_code=404, detail="Glamping no encontrado")
-        
-        # Obtener el array de fechasReservadas
-        fechas_reservadas = glamping.get("fechasReservadas", [])
-        
-        # Devolver las fechas reservadas
-        return fechas_reservadas
 
+        # Las noches reservadas se derivan de los periodos
+        return periodos_a_fechas(periodos_de_documento(glamping))
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener fechas reservadas: {str(e)}")
 
 
+# Periodos reservados (inicio, fin exclusivo, fuente) de un glamping
+@ruta_glampings.get("/{glamping_id}/periodosReservados")
+async def obtener_periodos_reservados(glamping_id: str):
+    try:
+        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)}, PROYECCION_PERIODOS)
+        if not glamping:
+            raise HTTPException(status_code=404, detail="Glamping no encontrado")
+        return {
+            "glamping_id": glamping_id,
+            "version": glamping.get("fechasVersion"),
+            "periodos": periodos_de_documento(glamping),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener periodos reservados: {str(e)}")
+
+
+# Disponibilidad de un glamping entre dos fechas (consulta al árbol de intervalos)
+@ruta_glampings.get("/{glamping_id}/disponibilidad")
+async def consultar_disponibilidad(
+    glamping_id: str,
+    fechaInicio: str = Query(..., description="Fecha de llegada YYYY-MM-DD"),
+    fechaFin: str = Query(..., description="Fecha de salida YYYY-MM-DD (no se cuenta como noche)"),
+):
+    try:
+        try:
+            inicio = datetime.strptime(fechaInicio, "%Y-%m-%d").date().isoformat()
+            fin = datetime.strptime(fechaFin, "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Formato de fecha inválido. Usa YYYY-MM-DD")
+        if fin <= inicio:
+            raise HTTPException(status_code=400, detail="La fecha de salida debe ser posterior a la de llegada")
+
+        arbol = obtener_arbol(glamping_id)
+        if arbol is None:
+            raise HTTPException(status_code=404, detail="Glamping no encontrado")
+
+        cruces = arbol.solapados(inicio, fin)
+        return {"glamping_id": glamping_id, "disponible": not cruces, "cruces": cruces}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al consultar disponibilidad: {str(e)}")
+
+
 # Actualizar fechas reservadas de un glamping
 @ruta_glampings.patch("/{glamping_id}/fechasReservadasManual", response_model=ModeloGlamping)
 async def actualizar_fechas_reservadas_manual(
@@ -793,19 +854,14 @@ async def actualizar_fechas_reservadas_manual(
     fechas: List[str] = Body(..., embed=True)
 ):
     try:
-        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
-        if not glamping:
+        # Se insertan como periodos manuales, fusionándose con los contiguos
+        if agregar_fechas(glamping_id, fechas, "manual") is None:
             raise HTTPException(status_code=404, detail="Glamping no encontrado")
 
-        db["glampings"].update_one(
-            {"_id": ObjectId(glamping_id)},
-            {"$addToSet": {"fechasReservadasManual": {"$each": fechas}}}
-        )
-
-        actualizar_union_fechas(glamping_id)
-
         glamping_actualizado = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
         return ModeloGlamping(**convertir_objectid(glamping_actualizado))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al actualizar fechas manuales: {str(e)}")
 
@@ -817,19 +873,13 @@ async def eliminar_fechas_reservadas_manual(
     fechas_a_eliminar: List[str] = Body(..., embed=True)
 ):
     try:
-        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
-        if not glamping:
+        if eliminar_fechas(glamping_id, fechas_a_eliminar, "manual") is None:
             raise HTTPException(status_code=404, detail="Glamping no encontrado")
 
-        db["glampings"].update_one(
-            {"_id": ObjectId(glamping_id)},
-            {"$pullAll": {"fechasReservadasManual": fechas_a_eliminar}}
-        )
-
-        actualizar_union_fechas(glamping_id)
-
         glamping_actualizado = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
         return ModeloGlamping(**convertir_objectid(glamping_actualizado))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"🔥 Error al eliminar fechas manuales: {str(e)}")
 
@@ -861,7 +911,8 @@ async def rotar_imagen(
         cliente = storage.Client()
         bucket = cliente.bucket(BUCKET_NAME)
         blob_anterior = bucket.blob(archivo_nombre_anterior)
-        imagen_bytes = blob_anterior.download_as_bytes()
+        with breaker("gcs").llamada():
+            imagen_bytes = blob_anterior.download_as_bytes(timeout=breaker("gcs").timeout_seg)
 
         # 5. Rotar la imagen en memoria
         imagen_pil = Image.open(BytesIO(imagen_bytes))
@@ -875,7 +926,8 @@ async def rotar_imagen(
         buffer = BytesIO()
         imagen_pil.save(buffer, format="WEBP", optimize=True, quality=75)
         buffer.seek(0)
-        blob_nuevo.upload_from_file(buffer, content_type="image/webp")
+        with breaker("gcs").llamada():
+            blob_nuevo.upload_from_file(buffer, content_type="image/webp", timeout=breaker("gcs").timeout_seg)
 
         nueva_url = f"https://storage.googleapis.com/{BUCKET_NAME}/{nombre_archivo_nuevo}"
 
@@ -938,7 +990,7 @@ def preguntar(json_input: dict):
         ]
 
     # 4) Ejecutar consulta inicial
-    raw = list(db["glampings"].find(query))
+    raw = list(db["glampings"].find(query, {CAMPO_RETENCIONES: 0}))
 
     # 5) Si el parser devolvió coords, filtrar por distancia
     if filtros.get("ubicacion_coords"):
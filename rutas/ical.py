@@ -1,31 +1,127 @@
-from fastapi import APIRouter, HTTPException, Response 
-from pymongo import MongoClient
+from fastapi import APIRouter, HTTPException, Response, Request
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
 from bson.objectid import ObjectId
+from cachetools import LRUCache
 import os
+import hashlib
+import time
 from ics import Calendar, Event
 from datetime import datetime, timedelta
 from pytz import timezone
-import requests
+from utils.http_clientes import cliente
+from Funciones.periodos_reservados import (
+    periodos_de_documento, periodos_a_fechas, reemplazar_fechas_fuente, PROYECCION_PERIODOS,
+)
 
 # Conexión a MongoDB usando variables de entorno
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 ConexionMongo = MongoClient(MONGO_URI)
 db = ConexionMongo["glamperos"]
+coleccion_sync_estado = db["ical_sync_estado"]
+
+# Un registro por glamping + fuente + URL con el resultado de la última descarga
+try:
+    coleccion_sync_estado.create_index(
+        [("glamping_id", ASCENDING), ("fuente", ASCENDING), ("url", ASCENDING)],
+        unique=True,
+    )
+    coleccion_sync_estado.create_index([("latencia_ms", DESCENDING)])
+    coleccion_sync_estado.create_index([("estado", ASCENDING), ("fallos_consecutivos", DESCENDING)])
+except Exception:
+    pass
 
 # Definir la zona horaria de Colombia
 ZONA_HORARIA_COLOMBIA = timezone("America/Bogota")
 
-# Función auxiliar para actualizar la unión de fechas
-def actualizar_union_fechas(glamping_id: str):
-    glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
-    manual = set(glamping.get("fechasReservadasManual", []))
-    airbnb = set(glamping.get("fechasReservadasAirbnb", []))
-    booking = set(glamping.get("fechasReservadasBooking", []))
-    union = list(manual.union(airbnb).union(booking))
-    db["glampings"].update_one(
-        {"_id": ObjectId(glamping_id)},
-        {"$set": {"fechasReservadas": union}}
-    )
+# Calendarios exportados ya renderizados, por ETag (glamping + versión de fechas + nombre)
+_cache_ics: LRUCache = LRUCache(maxsize=int(os.getenv("ICAL_CACHE_MAX", "1024")))
+
+def _etag_exportacion(glamping_id: str, glamping: dict) -> str:
+    nombre = glamping.get("nombreGlamping", "Glamping")
+    firma = f"{glamping_id}|{glamping.get('fechasVersion')}|{nombre}"
+    return '"' + hashlib.sha1(firma.encode("utf-8")).hexdigest()[:24] + '"'
+
+def _renderizar_ics(glamping_id: str, nombre_glamping: str, periodos: list) -> str:
+    """Un evento por periodo manual (noches consecutivas fusionadas)."""
+    calendario = Calendar()
+    for periodo in periodos:
+        if periodo.get("fuente") != "manual":
+            continue
+        try:
+            fecha_inicio = ZONA_HORARIA_COLOMBIA.localize(datetime.strptime(periodo["inicio"], "%Y-%m-%d"))
+            fecha_fin = ZONA_HORARIA_COLOMBIA.localize(datetime.strptime(periodo["fin"], "%Y-%m-%d"))
+            evento = Event()
+            evento.name = "Reservado - " + nombre_glamping
+            evento.begin = fecha_inicio
+            evento.end = fecha_fin
+            evento.uid = f"{glamping_id}-{periodo['inicio']}@glamperos.com"
+            calendario.events.add(evento)
+        except Exception:
+            continue
+    return str(calendario)
+
+async def _descargar_fechas(url: str, headers: dict = None, timeout: float = 10):
+    """
+    Descarga un feed iCal y devuelve (fechas, medicion).
+    medicion trae latencia_ms, bytes, eventos y status; si falla, además error.
+    """
+    medicion = {"url": url}
+    fechas = set()
+    inicio_descarga = time.perf_counter()
+    try:
+        response = await cliente("ical").get(url, headers=headers, timeout=timeout)
+        medicion["latencia_ms"] = round((time.perf_counter() - inicio_descarga) * 1000, 1)
+        medicion["bytes"] = len(response.content)
+        medicion["status"] = response.status_code
+        if response.status_code != 200:
+            medicion["error"] = f"status {response.status_code}"
+            return fechas, medicion
+
+        calendario = Calendar(response.text)
+        medicion["eventos"] = len(calendario.events)
+        for evento in calendario.events:
+            inicio = evento.begin.date()
+            fin = evento.end.date()
+            fecha_actual = inicio
+            while fecha_actual < fin:
+                fechas.add(fecha_actual.isoformat())
+                fecha_actual += timedelta(days=1)
+    except Exception as err:
+        medicion.setdefault("latencia_ms", round((time.perf_counter() - inicio_descarga) * 1000, 1))
+        medicion["error"] = str(err)
+    return fechas, medicion
+
+def _operacion_estado(glamping_id: str, fuente: str, medicion: dict, delta: dict = None) -> UpdateOne:
+    ahora = datetime.utcnow()
+    filtro = {"glamping_id": glamping_id, "fuente": fuente, "url": medicion["url"]}
+    datos = {
+        "ultimo_intento": ahora,
+        "latencia_ms": medicion.get("latencia_ms"),
+        "bytes": medicion.get("bytes"),
+        "status": medicion.get("status"),
+    }
+    if "error" in medicion:
+        datos.update({"estado": "error", "ultimo_error": medicion["error"], "ultimo_error_fecha": ahora})
+        return UpdateOne(filtro, {"$set": datos, "$inc": {"fallos_consecutivos": 1}}, upsert=True)
+
+    datos.update({
+        "estado": "ok",
+        "ultimo_exito": ahora,
+        "eventos": medicion.get("eventos", 0),
+        "fallos_consecutivos": 0,
+    })
+    if delta is not None:
+        datos["fechas_agregadas"] = len(delta["agregadas"])
+        datos["fechas_eliminadas"] = len(delta["eliminadas"])
+    return UpdateOne(filtro, {"$set": datos}, upsert=True)
+
+def _guardar_estados(operaciones: list):
+    if not operaciones:
+        return
+    try:
+        coleccion_sync_estado.bulk_write(operaciones, ordered=False)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el estado de sincronización iCal: {e}")
 
 # Crear el router para la sincronización de iCal
 ruta_ical = APIRouter(
@@ -35,65 +131,65 @@ ruta_ical = APIRouter(
 )
 
 @ruta_ical.get("/exportar/{glamping_id}")
-async def exportar_ical(glamping_id: str):
+async def exportar_ical(glamping_id: str, request: Request):
     """
     Genera un archivo iCal con solo las fechas manuales de un glamping.
+    Las noches consecutivas se exportan como un solo evento. El texto queda en caché
+    por versión de fechas y se responde 304 si el cliente ya tiene esa versión (ETag).
     """
     try:
-        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
+        glamping = db["glampings"].find_one(
+            {"_id": ObjectId(glamping_id)},
+            {"fechasVersion": 1, "nombreGlamping": 1}
+        )
         if not glamping:
             raise HTTPException(status_code=404, detail="Glamping no encontrado")
 
-        nombre_glamping = glamping.get("nombreGlamping", "Glamping")
-        calendario = Calendar()
-
-        for fecha in glamping.get("fechasReservadasManual", []):
-            try:
-                fecha_inicio = datetime.strptime(fecha, "%Y-%m-%d")
-                fecha_inicio = ZONA_HORARIA_COLOMBIA.localize(fecha_inicio)
-                fecha_fin = fecha_inicio + timedelta(days=1)
-                evento = Event()
-                evento.name = "Reservado - " + nombre_glamping
-                evento.begin = fecha_inicio
-                evento.end = fecha_fin
-                evento.uid = f"{glamping_id}-{fecha}@glamperos.com"
-                calendario.events.add(evento)
-            except Exception:
-                continue
-
-        return Response(str(calendario), media_type="text/calendar")
+        etag = _etag_exportacion(glamping_id, glamping)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        texto = _cache_ics.get(etag)
+        if texto is None:
+            periodos = periodos_de_documento(
+                db["glampings"].find_one({"_id": ObjectId(glamping_id)}, PROYECCION_PERIODOS) or {}
+            )
+            texto = _renderizar_ics(glamping_id, glamping.get("nombreGlamping", "Glamping"), periodos)
+            _cache_ics[etag] = texto
+
+        return Response(texto, media_type="text/calendar", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al exportar iCal: {str(e)}")
 
 @ruta_ical.post("/importar")
 async def importar_ical(glamping_id: str, url_ical: str, source: str = "airbnb"):
+    fuente = "airbnb" if source.lower() == "airbnb" else "booking"
     try:
-        response = requests.get(url_ical)
-        if response.status_code != 200:
+        fechas_importadas, medicion = await _descargar_fechas(url_ical)
+        if "error" in medicion:
+            _guardar_estados([_operacion_estado(glamping_id, fuente, medicion)])
             raise HTTPException(status_code=400, detail="No se pudo descargar el calendario iCal")
 
-        calendario = Calendar(response.text)
-        fechas_importadas = set()
-        for evento in calendario.events:
-            inicio = evento.begin.date()
-            fin = evento.end.date()
-            fecha_actual = inicio
-            while fecha_actual < fin:
-                fechas_importadas.add(fecha_actual.isoformat())
-                fecha_actual += timedelta(days=1)
-
-        fechas_importadas = list(fechas_importadas)
-        field = "fechasReservadasAirbnb" if source.lower() == "airbnb" else "fechasReservadasBooking"
-
-        db["glampings"].update_one(
-            {"_id": ObjectId(glamping_id)},
-            {"$set": {field: fechas_importadas}}
-        )
+        # Solo se escribe la diferencia de periodos de esta fuente (nada si no cambió)
+        delta = reemplazar_fechas_fuente(glamping_id, fuente, fechas_importadas)
+        if delta is None:
+            raise HTTPException(status_code=404, detail="Glamping no encontrado")
+        _guardar_estados([_operacion_estado(glamping_id, fuente, medicion, delta)])
 
-        actualizar_union_fechas(glamping_id)
-        glamping = db["glampings"].find_one({"_id": ObjectId(glamping_id)})
-        return {"mensaje": "Fechas sincronizadas correctamente", "fechas": glamping.get("fechasReservadas", [])}
+        mensaje = "Fechas sincronizadas correctamente" if delta["cambio"] else "Sin cambios en el calendario"
+        return {
+            "mensaje": mensaje,
+            "fechas": periodos_a_fechas(delta["periodos"]),
+            "agregadas": len(delta["agregadas"]),
+            "eliminadas": len(delta["eliminadas"]),
+            "latencia_ms": medicion["latencia_ms"],
+        }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al importar iCal: {str(e)}")
 
@@ -111,6 +207,7 @@ async def sincronizar_todos():
 
         for glamping in glampings:
             glamping_id = str(glamping["_id"])
+            documento = {campo: glamping[campo] for campo in PROYECCION_PERIODOS if campo in glamping}
             sources = {
                 "airbnb": glamping.get("urlIcal", ""),
                 "booking": glamping.get("urlIcalBooking", "")
@@ -121,35 +218,34 @@ async def sincronizar_todos():
                     urls = [line.strip() for line in urls_str.splitlines() if line.strip()]
                     fechas_importadas = set()
                     errores = []
+                    mediciones = []
 
                     for url in urls:
-                        try:
-                            headers = {"User-Agent": "Mozilla/5.0"}
-                            response = requests.get(url, headers=headers, timeout=10)
-                            if response.status_code != 200:
-                                errores.append(f"⛔ URL fallida ({url}): status {response.status_code}")
-                                continue
-                            calendario = Calendar(response.text)
-                            for evento in calendario.events:
-                                inicio = evento.begin.date()
-                                fin = evento.end.date()
-                                fecha_actual = inicio
-                                while fecha_actual < fin:
-                                    fechas_importadas.add(fecha_actual.isoformat())
-                                    fecha_actual += timedelta(days=1)
-                        except Exception as err:
-                            errores.append(f"⚠️ Error en URL ({url}): {str(err)}")
+                        fechas_url, medicion = await _descargar_fechas(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
+                        mediciones.append(medicion)
+                        if "error" in medicion:
+                            if "status" in medicion and medicion["status"] != 200:
+                                errores.append(f"⛔ URL fallida ({url}): status {medicion['status']}")
+                            else:
+                                errores.append(f"⚠️ Error en URL ({url}): {medicion['error']}")
+                            continue
+                        fechas_importadas |= fechas_url
 
+                    delta = None
                     if fechas_importadas:
-                        field = "fechasReservadasAirbnb" if src == "airbnb" else "fechasReservadasBooking"
-                        db["glampings"].update_one(
-                            {"_id": glamping["_id"]},
-                            {"$set": {field: list(fechas_importadas)}}
-                        )
+                        delta = reemplazar_fechas_fuente(glamping["_id"], src, fechas_importadas, documento=documento)
+                        # El documento en memoria queda igual al guardado para la siguiente fuente
+                        documento = {
+                            "_id": glamping["_id"],
+                            "periodosReservados": delta["periodos"],
+                            "fechasVersion": delta["version"],
+                        }
                         resultados.append({
                             "glamping_id": glamping_id,
                             "source": src,
-                            "fechas_importadas": list(fechas_importadas)
+                            "fechas_importadas": sorted(fechas_importadas),
+                            "agregadas": len(delta["agregadas"]),
+                            "eliminadas": len(delta["eliminadas"]),
                         })
                     else:
                         resultados.append({
@@ -159,9 +255,35 @@ async def sincronizar_todos():
                             "detalles": errores
                         })
 
-            actualizar_union_fechas(glamping_id)
+                    _guardar_estados([_operacion_estado(glamping_id, src, m, delta) for m in mediciones])
 
         return {"resultado": resultados}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"🔥 Error al sincronizar todos: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"🔥 Error al sincronizar todos: {str(e)}")
+
+@ruta_ical.get("/estado-sincronizacion")
+async def estado_sincronizacion(limite: int = 20):
+    """
+    Feeds iCal más lentos y los que están fallando (según la última descarga de cada uno).
+    """
+    try:
+        limite = max(1, min(limite, 200))
+        proyeccion = {"_id": 0}
+        mas_lentos = list(
+            coleccion_sync_estado.find({"latencia_ms": {"$ne": None}}, proyeccion)
+            .sort("latencia_ms", DESCENDING)
+            .limit(limite)
+        )
+        fallando = list(
+            coleccion_sync_estado.find({"estado": "error"}, proyeccion)
+            .sort("fallos_consecutivos", DESCENDING)
+            .limit(limite)
+        )
+        return {
+            "total_feeds": coleccion_sync_estado.estimated_document_count(),
+            "mas_lentos": mas_lentos,
+            "fallando": fallando,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al consultar estado de sincronización: {str(e)}")
@@ -1,17 +1,118 @@
 import os
 import socketio
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import parse_qs
+
+from utils.bus_mensajes import crear_bus
+from utils.sesion import usuario_del_token
 
-# Crear el servidor de Socket.IO
-sio = socketio.AsyncServer()
+# Crear el servidor de Socket.IO (se monta como app ASGI en main.py)
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
 
 # Configuración de MongoDB
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 client = AsyncIOMotorClient(MONGO_URI)
 db = client["glamperos"]
 messages_collection = db["mensajes"]
+# Una fila por (usuario, contacto) con el último mensaje y los no leídos: la bandeja
+# de entrada se lista de aquí sin recorrer el historial de mensajes.
+# Reconstruir: python -m Funciones.reconstruir_conversaciones
+conversaciones_collection = db["conversaciones"]
+
+# "mongo": cada worker escucha los mensajes nuevos (change stream) y los entrega
+# a sus sockets, así el receptor los recibe esté conectado al worker que esté.
+# "local": entrega en el mismo proceso; solo sirve con un worker y una instancia.
+# Producción con varias instancias debe configurar MENSAJERIA_BACKEND=mongo: con
+# varios workers en la misma instancia (WEB_CONCURRENCY) "local" no arranca, pero
+# otras instancias no se pueden detectar desde aquí.
+MENSAJERIA_BACKEND = os.getenv("MENSAJERIA_BACKEND", "local").lower()
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+if "MENSAJERIA_BACKEND" not in os.environ:
+    print("⚠️ MENSAJERIA_BACKEND sin configurar: se usa 'local' (un solo worker e instancia)")
+
+
+def clave_conversacion(usuario_a: str, usuario_b: str) -> str:
+    """La misma clave sin importar quién envía: los dos ids ordenados."""
+    return "|".join(sorted([str(usuario_a), str(usuario_b)]))
+
+
+def _serializar(message: dict) -> dict:
+    mensaje = dict(message)
+    if "_id" in mensaje:
+        mensaje["_id"] = str(mensaje["_id"])
+    return mensaje
+
+
+async def _entregar(message: dict):
+    """Emite el mensaje a la sala del receptor (todas sus pestañas o dispositivos)."""
+    await sio.emit("receive_message", _serializar(message), room=message["receptor"])
+
+
+bus = crear_bus(MENSAJERIA_BACKEND, messages_collection, _entregar, procesos=WORKERS)
+
+
+async def iniciar_mensajeria():
+    try:
+        await conversaciones_collection.create_index(
+            [("usuario", ASCENDING), ("contacto", ASCENDING)], unique=True
+        )
+        await conversaciones_collection.create_index([("usuario", ASCENDING), ("actualizado", DESCENDING)])
+        # Historial de una conversación paginado por cursor
+        await messages_collection.create_index(
+            [("conversacion", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]
+        )
+    except Exception as e:
+        print(f"⚠️ No se pudieron crear los índices de conversaciones: {e}")
+    await bus.iniciar()
+
+
+async def _actualizar_conversaciones(message: dict):
+    """Último mensaje en las dos filas de la conversación; +1 no leído para el receptor."""
+    resumen = {
+        "ultimo_mensaje": message["mensaje"],
+        "ultima_fecha": message.get("timestamp"),
+        "ultimo_emisor": message["emisor"],
+        "actualizado": datetime.now(timezone.utc),
+    }
+    operaciones = [
+        UpdateOne(
+            {"usuario": message["emisor"], "contacto": message["receptor"]},
+            {"$set": resumen, "$setOnInsert": {"no_leidos": 0}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"usuario": message["receptor"], "contacto": message["emisor"]},
+            {"$set": resumen, "$inc": {"no_leidos": 1}},
+            upsert=True,
+        ),
+    ]
+    try:
+        await conversaciones_collection.bulk_write(operaciones, ordered=False)
+    except BulkWriteError as e:
+        # Dos primeros mensajes a la vez: los dos upserts insertan la misma fila y uno
+        # choca con el índice único. La fila ya existe, así que se reintenta solo ese.
+        errores = e.details.get("writeErrors", [])
+        reintentar = [operaciones[error["index"]] for error in errores if error.get("code") == 11000]
+        if len(reintentar) != len(errores):
+            print(f"⚠️ No se pudo actualizar la conversación {message['emisor']} - {message['receptor']}: {errores}")
+        if reintentar:
+            try:
+                await conversaciones_collection.bulk_write(reintentar, ordered=False)
+            except BulkWriteError as e2:
+                # El mensaje ya está guardado; la fila se corrige con reconstruir_conversaciones
+                print(f"⚠️ No se pudo actualizar la conversación {message['emisor']} - {message['receptor']}: {e2.details}")
+
+
+async def detener_mensajeria():
+    await bus.detener()
 
 # Crear el enrutador de FastAPI para mensajería
 ruta_mensajes = APIRouter(
@@ -28,16 +129,64 @@ async def store_message(message: dict):
         if not message.get("emisor") or not message.get("receptor") or not message.get("mensaje"):
             raise HTTPException(status_code=400, detail="Faltan campos requeridos")
 
+        message["conversacion"] = clave_conversacion(message["emisor"], message["receptor"])
+        message.setdefault("timestamp", datetime.now(timezone.utc).isoformat())
+
         # Guardar el mensaje en la colección de MongoDB
         result = await messages_collection.insert_one(message)
+        await _actualizar_conversaciones(message)
+        await bus.publicar(message)
         return JSONResponse(content={"message": "Mensaje guardado exitosamente", "id": str(result.inserted_id)}, status_code=200)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # Manejar eventos de conexión y recepción de mensajes por Socket.IO
+def _credenciales_de_conexion(environ, auth) -> tuple:
+    """(usuario, token) desde `auth` ({"usuario": id, "token": ...}) o desde ?usuario=&token= en la URL."""
+    if isinstance(auth, dict) and (auth.get("usuario") or auth.get("token")):
+        return str(auth.get("usuario") or ""), auth.get("token")
+    query = parse_qs(environ.get("QUERY_STRING", ""))
+    return (query.get("usuario") or [""])[0], (query.get("token") or [None])[0]
+
+
+def _usuario_verificado(usuario: str, token: Optional[str]) -> Optional[str]:
+    """
+    El usuario del token de sesión (el que entregan /usuarios y /usuarios/google).
+    Si además se manda `usuario`, tiene que ser el mismo.
+    """
+    verificado = usuario_del_token(token)
+    if not verificado or (usuario and usuario != verificado):
+        return None
+    return verificado
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    usuario, token = _credenciales_de_conexion(environ, auth)
+    if usuario or token:
+        verificado = _usuario_verificado(usuario, token)
+        if not verificado:
+            print(f"🚫 Conexión rechazada: token inválido para el usuario {usuario or '?'}")
+            raise socketio.exceptions.ConnectionRefusedError("Token de sesión inválido")
+        # Una sala por usuario: ahí llegan sus mensajes en todos sus sockets
+        await sio.enter_room(sid, verificado)
+        await sio.save_session(sid, {"usuario": verificado})
+        usuario = verificado
+    print(f"Usuario {usuario or sid} conectado")
+
 @sio.event
-async def connect(sid, environ):
-    print(f"Usuario {sid} conectado")
+async def unirse(sid, data):
+    """Para clientes que no mandan el usuario al conectar."""
+    data = data or {}
+    usuario = str(data.get("usuario") or "")
+    if not usuario and not data.get("token"):
+        return {"error": "Falta el usuario"}
+    verificado = _usuario_verificado(usuario, data.get("token"))
+    if not verificado:
+        return {"error": "Token de sesión inválido"}
+    await sio.enter_room(sid, verificado)
+    await sio.save_session(sid, {"usuario": verificado})
+    return {"message": "Unido", "usuario": verificado}
 
 @sio.event
 async def disconnect(sid):
@@ -56,14 +205,16 @@ async def send_message(sid, data):
             "emisor": data["emisor"],
             "receptor": data["receptor"],
             "mensaje": data["mensaje"],
-            "timestamp": data["timestamp"]
+            "timestamp": data.get("timestamp") or datetime.now(timezone.utc).isoformat(),
+            "conversacion": clave_conversacion(data["emisor"], data["receptor"]),
         }
 
         # Guardar el mensaje en MongoDB
         await messages_collection.insert_one(message)
+        await _actualizar_conversaciones(message)
 
-        # Enviar el mensaje de vuelta al receptor por Socket.IO
-        await sio.emit('receive_message', message, room=data["receptor"])
+        # Enviar el mensaje al receptor por Socket.IO (en el worker donde esté conectado)
+        await bus.publicar(message)
         
         return {"message": "Mensaje enviado"}
     except Exception as e:
@@ -73,52 +224,55 @@ async def send_message(sid, data):
 
 
 
-# Obtener los receptores únicos con los que el emisor ha tenido conversaciones
+# Obtener los contactos con los que el emisor ha tenido conversaciones (más reciente primero)
 @ruta_mensajes.get("/conversaciones/{emisor}")
-async def get_conversaciones(emisor: str):
+async def get_conversaciones(
+    emisor: str,
+    limite: int = Query(100, ge=1, le=200),
+    antes: Optional[str] = Query(None, description="Valor `siguiente` de la página anterior"),
+):
     try:
-        # Buscar tanto como emisor como receptor y traer el último mensaje por cada conversación
-        conversation_ids = await messages_collection.aggregate([
-            {
-                "$match": {
-                    "$or": [
-                        {"emisor": emisor},
-                        {"receptor": emisor}
-                    ]
-                }
-            },
-            {
-                "$project": {
-                    "contacto": {
-                        "$cond": [
-                            {"$eq": ["$emisor", emisor]},
-                            "$receptor",  # Si es el emisor, tomar el receptor
-                            "$emisor"    # Si es el receptor, tomar el emisor
-                        ]
-                    },
-                    "timestamp": 1  # Traer el campo timestamp para ordenar
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$contacto",  # Agrupar por el contacto único
-                    "ultima_fecha": {"$max": "$timestamp"}  # Obtener la última fecha (timestamp más reciente)
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,  # No incluir el campo _id
-                    "contacto": "$_id",  # Renombrar _id a contacto
-                    "ultima_fecha": 1  # Incluir la última fecha
-                }
-            }
-        ]).to_list(length=100)
-
-        if not conversation_ids:
+        filtro = {"usuario": emisor}
+        if antes:
+            try:
+                filtro["actualizado"] = {"$lt": datetime.fromisoformat(antes)}
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Cursor `antes` inválido")
+
+        # Índice (usuario, actualizado): lee solo las filas de la página
+        conversaciones = await conversaciones_collection.find(
+            filtro, {"_id": 0, "usuario": 0}
+        ).sort("actualizado", DESCENDING).limit(limite).to_list(length=limite)
+
+        if not conversaciones and not antes:
             return JSONResponse(content={"message": "No hay conversaciones para este emisor."}, status_code=404)
 
-        # Retornar la lista de contactos únicos con la última fecha de conversación
-        return {"conversaciones": conversation_ids}
+        siguiente = None
+        for conversacion in conversaciones:
+            conversacion["actualizado"] = conversacion["actualizado"].isoformat()
+        if len(conversaciones) == limite:
+            siguiente = conversaciones[-1]["actualizado"]
+
+        return {"conversaciones": conversaciones, "siguiente": siguiente}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+# Marcar como leída una conversación (el usuario abrió el chat con el contacto)
+@ruta_mensajes.patch("/conversaciones/{usuario}/{contacto}/leido")
+async def marcar_conversacion_leida(usuario: str, contacto: str):
+    try:
+        resultado = await conversaciones_collection.update_one(
+            {"usuario": usuario, "contacto": contacto},
+            {"$set": {"no_leidos": 0}},
+        )
+        if resultado.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Conversación no encontrada")
+        return {"message": "Conversación marcada como leída"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -127,28 +281,66 @@ async def get_conversaciones(emisor: str):
 
 
 # Ruta para obtener los mensajes entre un emisor y un receptor
-from bson import ObjectId
 @ruta_mensajes.get("/obtener_mensajes/{emisor}/{receptor}")
-async def get_messages(emisor: str, receptor: str):
+async def get_messages(
+    emisor: str,
+    receptor: str,
+    limite: int = Query(50, ge=1, le=200),
+    antes: Optional[str] = Query(None, description="Id de mensaje: trae los anteriores a él"),
+    despues: Optional[str] = Query(None, description="Id de mensaje: trae los posteriores a él"),
+):
+    """
+    Página de mensajes en orden cronológico. Sin cursor trae los más recientes;
+    `anteriores` y `siguientes` de la respuesta son los cursores para seguir.
+    Cada página es una lectura por el índice (conversacion, timestamp, _id).
+    """
     try:
-        # Realizar la consulta utilizando $or para buscar mensajes donde el emisor y receptor sean intercambiables
-        messages = await messages_collection.find(
-            {
-                "$or": [
-                    {"emisor": emisor, "receptor": receptor},
-                    {"emisor": receptor, "receptor": emisor}
-                ]
-            }
-        ).to_list(length=100)
-
-        if not messages:
+        if antes and despues:
+            raise HTTPException(status_code=400, detail="Usa solo uno de `antes` o `despues`")
+
+        filtro = {"conversacion": clave_conversacion(emisor, receptor)}
+        orden = DESCENDING
+        cursor_id = antes or despues
+        if cursor_id:
+            try:
+                oid = ObjectId(cursor_id)
+            except InvalidId:
+                raise HTTPException(status_code=400, detail="Cursor inválido")
+            referencia = await messages_collection.find_one(
+                {"_id": oid, "conversacion": filtro["conversacion"]}, {"timestamp": 1}
+            )
+            if not referencia:
+                raise HTTPException(status_code=400, detail="El cursor no pertenece a esta conversación")
+            op = "$lt" if antes else "$gt"
+            filtro["$or"] = [
+                {"timestamp": {op: referencia.get("timestamp")}},
+                {"timestamp": referencia.get("timestamp"), "_id": {op: oid}},
+            ]
+            if despues:
+                orden = ASCENDING
+
+        messages = await messages_collection.find(filtro).sort(
+            [("timestamp", orden), ("_id", orden)]
+        ).limit(limite).to_list(length=limite)
+
+        if not messages and not cursor_id:
             return JSONResponse(content={"message": "No hay mensajes entre estos usuarios."}, status_code=404)
 
+        if orden == DESCENDING:
+            messages.reverse()
+
         # Convertir el campo '_id' de cada mensaje a string antes de devolverlo
         for message in messages:
             message['_id'] = str(message['_id'])  # Convertir ObjectId a string
 
-        # Retornar los mensajes encontrados
-        return {"mensajes": messages}
+        pagina_llena = len(messages) == limite
+        return {
+            "mensajes": messages,
+            # Hay más hacia atrás si la página se llenó (o si se vino avanzando con `despues`)
+            "anteriores": messages[0]["_id"] if messages and (pagina_llena or despues) else None,
+            "siguientes": messages[-1]["_id"] if messages and (pagina_llena or antes) else None,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, HTTPException, status, Body
-from pymongo import MongoClient
+from fastapi import APIRouter, HTTPException, status, Body, BackgroundTasks
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
+from bson.errors import InvalidId
 from pydantic import BaseModel
 from datetime import datetime, timezone  # ✅ Importa datetime también # Para UTC
 import pytz  # Para manejar zonas horarias específicas
 import os
 from typing import Optional
+from Funciones.periodos_reservados import (
+    retener_fechas, liberar_retencion, liberar_retenciones_vencidas,
+)
+from Funciones.pagos_wompi import conciliar_referencia
 
 # ============================================================================
 # CONFIGURACIÓN DE LA BASE DE DATOS
@@ -14,6 +20,12 @@ MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 ConexionMongo = MongoClient(MONGO_URI)
 base_datos = ConexionMongo["glamperos"]
 
+try:
+    # El código de reserva es único: evita duplicados sin consultar antes de insertar
+    base_datos.reservas.create_index([("codigoReserva", ASCENDING)], unique=True)
+except Exception as e:
+    print(f"⚠️ No se pudo crear el índice único de codigoReserva: {e}")
+
 # ============================================================================
 # CONFIGURACIÓN DE FASTAPI
 # ============================================================================
@@ -112,13 +124,22 @@ ZONA_HORARIA_COLOMBIA = pytz.timezone("America/Bogota")  # ✅ Esto funciona cor
 # CREAR RESERVA
 # ============================================================================
 @ruta_reserva.post("/", response_model=dict)
-async def crear_reserva(reserva: Reserva):
+async def crear_reserva(reserva: Reserva, background_tasks: BackgroundTasks):
     try:
-        # 🔹 Verificar si el codigoReserva ya existe
-        if base_datos.reservas.find_one({"codigoReserva": reserva.codigoReserva}):
+        # 🔹 Apartar las noches solo si siguen libres (una sola operación atómica)
+        try:
+            retencion = retener_fechas(
+                reserva.idGlamping, reserva.FechaIngreso, reserva.FechaSalida, reserva.codigoReserva
+            )
+        except (ValueError, InvalidId) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if retencion is None:
+            raise HTTPException(status_code=404, detail="Glamping no encontrado")
+        if not retencion:
             raise HTTPException(
-                status_code=400, detail="El código de reserva ya existe. Intenta nuevamente."
+                status_code=409, detail="Las fechas seleccionadas ya no están disponibles."
             )
+
         fecha_creacion_utc = datetime.now(timezone.utc)  # ✅ Ahora sí funcionará correctamente
         nueva_reserva = {
             "idCliente": reserva.idCliente,
@@ -144,15 +165,31 @@ async def crear_reserva(reserva: Reserva):
             "MetodoPago": reserva.MetodoPago,
             "FechaPagoPropietario": reserva.FechaPagoPropietario,
             "ReferenciaPago": reserva.ReferenciaPago,
+            "retencionId": retencion["id"],
+            "retencionExpira": retencion["expira"],
         }
 
-        result = base_datos.reservas.insert_one(nueva_reserva)
+        try:
+            result = base_datos.reservas.insert_one(nueva_reserva)
+        except DuplicateKeyError:
+            liberar_retencion(reserva.idGlamping, retencion["id"])
+            raise HTTPException(
+                status_code=400, detail="El código de reserva ya existe. Intenta nuevamente."
+            )
+        except Exception:
+            liberar_retencion(reserva.idGlamping, retencion["id"])
+            raise
         nueva_reserva["_id"] = result.inserted_id
 
+        # 🔹 Si el pago de Wompi llegó antes que la reserva, se aplica ahora
+        background_tasks.add_task(conciliar_referencia, reserva.codigoReserva)
+
         return {
             "mensaje": "Reserva creada exitosamente",
             "reserva": modelo_reserva(nueva_reserva),
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear la reserva: {str(e)}")
 
@@ -738,7 +775,13 @@ async def actualizar_reservas():
         # 🔹 Actualizar esas reservas a "Completada"
         resultado = base_datos.reservas.update_many(filtro, {"$set": {"EstadoReserva": "Completada"}})
 
-        return {"message": f"✅ {resultado.modified_count} reservas han sido marcadas como 'Completada'."}
+        # 🔹 Liberar las noches apartadas por checkouts que no se pagaron a tiempo
+        glampings_liberados = liberar_retenciones_vencidas()
+
+        return {
+            "message": f"✅ {resultado.modified_count} reservas han sido marcadas como 'Completada'.",
+            "retenciones_liberadas": glampings_liberados,
+        }
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"❌ Error al actualizar reservas: {str(e)}")
\ No newline at end of file
@@ -11,6 +11,8 @@ from typing import List, Optional
 from pydantic import BaseModel
 from bson.errors import InvalidId
 import os
+from utils.circuit_breaker import breaker, CircuitoAbierto
+from utils.sesion import emitir_token
 
 # Configuración de la base de datos
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
@@ -99,8 +101,11 @@ def subir_a_google_storage(archivo: UploadFile, carpeta: str = "glampings") -> s
         archivo_optimizado = optimizar_imagen(archivo)
         nombre_archivo = f"{carpeta}/{uuid.uuid4().hex}.webp"
         blob = bucket.blob(nombre_archivo)
-        blob.upload_from_file(archivo_optimizado, content_type="image/webp")
+        with breaker("gcs").llamada():
+            blob.upload_from_file(archivo_optimizado, content_type="image/webp", timeout=breaker("gcs").timeout_seg)
         return f"https://storage.googleapis.com/{BUCKET_NAME}/{nombre_archivo}"
+    except CircuitoAbierto as e:
+        raise HTTPException(status_code=503, detail=f"Google Storage no disponible: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al subir la imagen a Google Storage: {str(e)}")
 
@@ -126,7 +131,8 @@ async def crear_usuario(usuario: Usuario):
                 "email": usuario_existente["email"],
                 "telefono": usuario_existente["telefono"],
                 "rol": "usuario",  # Valor por defecto
-            }
+            },
+            "token": emitir_token(usuario_existente["_id"]),
         }
 
     # Crear un nuevo usuario si no existe
@@ -157,7 +163,7 @@ async def crear_usuario(usuario: Usuario):
     nuevo_usuario["_id"] = str(result.inserted_id)
     
     # Respuesta con el ID del usuario recién creado
-    return {"mensaje": "Usuario creado exitosamente", "usuario": nuevo_usuario}
+    return {"mensaje": "Usuario creado exitosamente", "usuario": nuevo_usuario, "token": emitir_token(result.inserted_id)}
 
 
 # Registro de usuario a través de Google (sin necesidad de clave)
@@ -171,7 +177,8 @@ async def registro_google(usuario: UsuarioGoogle):
         if usuario_existente.get("aceptaTratamientoDatos", False):
             return {
                 "mensaje": "Correo ya registrado",
-                "usuario": modelo_usuario(usuario_existente)
+                "usuario": modelo_usuario(usuario_existente),
+                "token": emitir_token(usuario_existente["_id"]),
             }
 
         # Si no había aceptado en la BD, obligamos el check
@@ -189,7 +196,8 @@ async def registro_google(usuario: UsuarioGoogle):
         actualizado = base_datos.usuarios.find_one({"email": usuario.email})
         return {
             "mensaje": "Consentimiento registrado",
-            "usuario": modelo_usuario(actualizado)
+            "usuario": modelo_usuario(actualizado),
+            "token": emitir_token(actualizado["_id"]),
         }
 
     # 2) Si NO existe, AHORA sí exigimos su consentimiento
@@ -214,7 +222,8 @@ async def registro_google(usuario: UsuarioGoogle):
 
     return {
         "mensaje": "Usuario creado exitosamente",
-        "usuario": modelo_usuario(usuario_insertado)
+        "usuario": modelo_usuario(usuario_insertado),
+        "token": emitir_token(usuario_insertado["_id"]),
     }
 
 # ------------Endpoint para obtener Usuarios con glamping--------------------
@@ -1,15 +1,29 @@
 # rutas/whatsapp.py
 
-from fastapi import Request, APIRouter
+from fastapi import Request, APIRouter, HTTPException, Query
 from fastapi.responses import PlainTextResponse, JSONResponse
+from pydantic import BaseModel, ConfigDict
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
 import os
-import httpx
+from utils.http_clientes import cliente
+from utils.circuit_breaker import breaker, CircuitoAbierto
+from utils.limitador import limitador_whatsapp
 import re
+import zlib
+import time
+import asyncio
+from collections import deque
 from datetime import datetime, date
 from typing import Optional, Dict, Any, List
 
-from Funciones.whatsapp_leads import guardar_lead
-from Funciones.chat_state import get_state, set_state, reset_state
+from Funciones.whatsapp_leads import guardar_lead, resumen_leads
+from Funciones.chat_state import get_state, set_state, escritura_agrupada
+from Funciones.whatsapp_mensajes_vistos import es_duplicado, olvidar_mensaje
+from Funciones.difusion_whatsapp import (
+    crear_difusion, obtener_difusion, pausar_difusion, lanzar_difusion, filtro_audiencia,
+)
+from Funciones.zonas_whatsapp import zona_por_opcion, zona_por_codigo, texto_opciones_zonas, links_zona
 
 import urllib.parse
 
@@ -25,75 +39,10 @@ GRAPH_URL = f"https://graph.facebook.com/v21.0/{PHONE_NUMBER_ID}/messages"
 # ✅ Número del asesor humano (WhatsApp normal) - SOLO dígitos con indicativo (ej: 573001112233)
 WHATSAPP_HUMAN_PHONE = (os.getenv("WHATSAPP_HUMAN_PHONE") or "").strip()
 
-# =========================
-# LISTADOS (links)
-# (Se envían uno a uno - sin esperas)
-# =========================
-GLAMPINGS_BOGOTA: List[str] = [
-    "https://glamperos.com/propiedad/6897773f34f85956b85eab4a",
-    "https://glamperos.com/propiedad/6897772434f85956b85eab49",
-    "https://glamperos.com/propiedad/6827602386c9f5be06c6039d",
-    "https://glamperos.com/propiedad/68a52a23d83e9028812edf7f",
-    "https://glamperos.com/propiedad/682765b486c9f5be06c6039e",
-    "https://glamperos.com/propiedad/682768c586c9f5be06c6039f",
-    "https://glamperos.com/propiedad/68914d9634f85956b85eaa26",
-    "https://glamperos.com/propiedad/68a11b84a0a1c9a8c809b5b5",
-    "https://glamperos.com/propiedad/68a11b72a0a1c9a8c809b5b4",
-    "https://glamperos.com/propiedad/67e629b7ed46c5cd5fcee9ad",
-    "https://glamperos.com/propiedad/688902bb34f85956b85ea78f",
-    "https://glamperos.com/propiedad/6822ac0a86c9f5be06c60394",
-    "https://glamperos.com/propiedad/67c61158bf722ccb3a8e0b0b",
-    "https://glamperos.com/propiedad/67d9bc8cb7356ca665a6eba0",
-]
-
-GLAMPINGS_MEDELLIN: List[str] = [
-    "https://glamperos.com/propiedad/68f29613d60cc8baef6ad155",
-    "https://glamperos.com/propiedad/6886794dbec77fc6ebf64ea0",
-    "https://glamperos.com/propiedad/68154a82aadd248f50833fdd",
-    "https://glamperos.com/propiedad/681c2a103193d38b54b152ed",
-    "https://glamperos.com/propiedad/68978bcd34f85956b85eab59",
-    "https://glamperos.com/propiedad/68113e4e0389b5eca382d8fb",
-    "https://glamperos.com/propiedad/689fcc4634f85956b85ead6a",
-    "https://glamperos.com/propiedad/681be9d51095b0469c0e3600",
-]
-
-GLAMPINGS_GUATAVITA: List[str] = [
-    "https://glamperos.com/propiedad/68192171659173a779d344db",
-    "https://glamperos.com/propiedad/67d6e09cbef08b81f7592b81",
-    "https://glamperos.com/propiedad/6812cbd2ab954364e923a027",
-    "https://glamperos.com/propiedad/67d996f6b7356ca665a6eb98",
-    "https://glamperos.com/propiedad/67d9910bb7356ca665a6eb93",
-    "https://glamperos.com/propiedad/6874622906ea14d27344d8bb",
-    "https://glamperos.com/propiedad/67acfc3a4d16ab7cc77c4d5f",
-    "https://glamperos.com/propiedad/68153b3eaadd248f50833fd9",
-    "https://glamperos.com/propiedad/68153dfaaadd248f50833fda",
-]
-
-GLAMPINGS_BOYACA: List[str] = [
-    "https://glamperos.com/propiedad/681a830f824e61ba124dbb6b",
-    "https://glamperos.com/propiedad/6890e6e934f85956b85ea9fa",
-    "https://glamperos.com/propiedad/6890df8134f85956b85ea9f7",
-    "https://glamperos.com/propiedad/680160d8d90de3e7d2ddae49",
-    "https://glamperos.com/propiedad/688926f934f85956b85ea7a1",
-    "https://glamperos.com/propiedad/688910fb34f85956b85ea797",
-    "https://glamperos.com/propiedad/685093c40695e3a851c2b1a4",
-    "https://glamperos.com/propiedad/68153dfaaadd248f50833fda",
-]
-
-GLAMPINGS_SANTANDER: List[str] = [
-    "https://glamperos.com/propiedad/681d2e645dc068dd1fdf4dc2",
-    "https://glamperos.com/propiedad/681525b5aadd248f50833fd5",
-    "https://glamperos.com/propiedad/681d2e3d5dc068dd1fdf4dc1",
-    "https://glamperos.com/propiedad/681525a1aadd248f50833fd4",
-    "https://glamperos.com/propiedad/6815257caadd248f50833fd2",
-    "https://glamperos.com/propiedad/6806d872d90de3e7d2ddae51",
-    "https://glamperos.com/propiedad/68080acf0389b5eca382d8eb",
-    "https://glamperos.com/propiedad/68081af90389b5eca382d8ef",
-    "https://glamperos.com/propiedad/68081af10389b5eca382d8ee",
-    "https://glamperos.com/propiedad/680810930389b5eca382d8ec",
-    "https://glamperos.com/propiedad/680813440389b5eca382d8ed",
-    "https://glamperos.com/propiedad/67d4c397e6e0814d14ecd7d7"
-]
+# Los links de una zona se mandan agrupados en pocos mensajes de texto
+LINKS_POR_MENSAJE = int(os.getenv("WHATSAPP_LINKS_POR_MENSAJE", "5"))
+# Tiempo total (ms) de las últimas entregas de links, para /whatsapp/metricas
+_tiempos_entrega: deque = deque(maxlen=500)
 
 MAPA_FUENTES = {
     "FUENTE_GOOGLE_ADS": "Google Ads",
@@ -203,38 +152,48 @@ def extraer_mensaje(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 # =========================
 # ENVIAR MENSAJES
 # =========================
-async def _post_graph(payload: Dict[str, Any]):
+async def _post_graph(payload: Dict[str, Any]) -> bool:
+    """Envía un mensaje a Graph. Retorna True si WhatsApp lo aceptó."""
     if not WHATSAPP_API_TOKEN:
         print("⚠️ WHATSAPP_API_TOKEN no está definido.")
-        return
+        return False
 
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.post(
+    # Misma cubeta que el outbox y las difusiones (Meta limita por número)
+    await limitador_whatsapp(PHONE_NUMBER_ID).adquirir()
+    try:
+        with breaker("graph").llamada() as llamada:
+            resp = await cliente("graph").post(
                 GRAPH_URL,
                 headers={
                     "Authorization": f"Bearer {WHATSAPP_API_TOKEN}",
                     "Content-Type": "application/json",
                 },
                 json=payload,
-                timeout=20,
+                timeout=breaker("graph").timeout_seg,
             )
-        except Exception as e:
-            print(f"❌ Error HTTPX WhatsApp: {e}")
-            return
+            if resp.status_code >= 500 or resp.status_code == 429:
+                llamada.marcar_fallo()
+    except CircuitoAbierto as e:
+        print(f"🔌 WhatsApp no disponible: {e}")
+        return False
+    except Exception as e:
+        print(f"❌ Error HTTPX WhatsApp: {e}")
+        return False
 
     if resp.status_code != 200:
         print(f"❌ Error WhatsApp: {resp.status_code} - {resp.text}")
+        return False
+    return True
 
 
-async def enviar_texto(to: str, texto: str):
+async def enviar_texto(to: str, texto: str) -> bool:
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "text",
         "text": {"preview_url": True, "body": texto},
     }
-    await _post_graph(payload)
+    return await _post_graph(payload)
 
 
 async def enviar_boton_ok(
@@ -259,16 +218,12 @@ async def enviar_boton_ok(
 async def enviar_menu_zonas_numerado(to: str):
     """
     Menú por texto (sin listas interactivas, sin límite de 3).
-    El usuario responde 1,2,3,4,5.
+    El usuario responde con el número de la zona (ver Funciones/zonas_whatsapp.py).
     """
     texto = (
         "¿En qué zona buscas glamping? 👇\n\n"
         "Responde con un número:\n"
-        "1️⃣ Cerca a Bogotá\n"
-        "2️⃣ Guatavita\n"
-        "3️⃣ Cerca a Medellín\n"
-        "4️⃣ Boyacá\n"
-        "5️⃣ Santander\n\n"
+        f"{texto_opciones_zonas()}\n\n"
         "Si quieres volver al inicio escribe *menu*."
     )
     await enviar_texto(to, texto)
@@ -332,13 +287,38 @@ def pedir_fecha_salida() -> str:
     )
 
 
-async def enviar_links_uno_a_uno(to: str, titulo: str, links: List[str]):
-    await enviar_texto(to, f"✨ *{titulo}* ✨")
+def _mensajes_links(titulo: str, links: List[str], por_mensaje: int = LINKS_POR_MENSAJE) -> List[str]:
+    """Agrupa los links numerados en pocos textos; el título va en el primero."""
+    por_mensaje = max(1, por_mensaje)
+    mensajes = []
+    for desde in range(0, len(links), por_mensaje):
+        lineas = [f"{i}. {link}" for i, link in enumerate(links[desde:desde + por_mensaje], start=desde + 1)]
+        if desde == 0:
+            lineas.insert(0, f"✨ *{titulo}* ✨\n")
+        mensajes.append("\n".join(lineas))
+    return mensajes
+
+
+async def enviar_links(to: str, titulo: str, links: List[str]) -> Dict[str, Any]:
+    """
+    Envía los links en grupos de LINKS_POR_MENSAJE (14 links = 3 mensajes en vez
+    de 15). Van en orden, uno tras otro, para que el usuario los lea en secuencia.
+    Retorna cuántos mensajes salieron y cuánto tardó la entrega completa.
+    """
     if not links:
-        await enviar_texto(to, "Por ahora no tengo alojamientos cargados en esta zona. Puedes escribir *menu* para volver.")
-        return
-    for link in links:
-        await enviar_texto(to, link)
+        await enviar_texto(to, f"✨ *{titulo}* ✨\n\nPor ahora no tengo alojamientos cargados en esta zona. Puedes escribir *menu* para volver.")
+        return {"mensajes": 1, "enviados": 0, "links": 0, "ms": 0.0}
+
+    inicio = time.monotonic()
+    mensajes = _mensajes_links(titulo, links)
+    enviados = 0
+    for texto in mensajes:
+        if await enviar_texto(to, texto):
+            enviados += 1
+    ms = (time.monotonic() - inicio) * 1000
+    _tiempos_entrega.append(ms)
+    print(f"📨 Links a {to}: {len(links)} links en {enviados}/{len(mensajes)} mensajes, {ms:.0f} ms")
+    return {"mensajes": len(mensajes), "enviados": enviados, "links": len(links), "ms": round(ms, 1)}
 
 
 # =========================
@@ -413,11 +393,47 @@ def _es_menu(texto_lower: str) -> bool:
     return texto_lower in ["menu", "menú", "inicio", "volver", "empezar", "reiniciar", "cancelar", "reset"]
 
 
+# =========================
+# COLA DE MENSAJES (orden por teléfono)
+# =========================
+# Cada teléfono cae siempre en la misma partición, y cada partición la atiende
+# un solo worker: los mensajes de un mismo número se procesan en orden y los
+# de números distintos en paralelo. Se pierde lo encolado si el proceso se reinicia.
+NUM_PARTICIONES = int(os.getenv("WHATSAPP_WORKERS", "8"))
+MAX_COLA_PARTICION = int(os.getenv("WHATSAPP_COLA_MAX", "1000"))
+
+_particiones: List[asyncio.Queue] = []
+
+
+def _particion(numero: str) -> asyncio.Queue:
+    return _particiones[zlib.crc32((numero or "").encode()) % len(_particiones)]
+
+
+async def _worker_particion(cola: asyncio.Queue):
+    while True:
+        msg = await cola.get()
+        try:
+            with escritura_agrupada():
+                await procesar_mensaje(msg)
+        except Exception as e:
+            print(f"❌ Error procesando mensaje de {msg.get('from')}: {e}")
+        finally:
+            cola.task_done()
+
+
+def iniciar_workers_whatsapp(cantidad: int = NUM_PARTICIONES) -> List[asyncio.Task]:
+    """Crea las particiones y sus workers (desde el lifespan de la app)."""
+    _particiones.clear()
+    _particiones.extend(asyncio.Queue(maxsize=MAX_COLA_PARTICION) for _ in range(cantidad))
+    return [asyncio.create_task(_worker_particion(cola)) for cola in _particiones]
+
+
 # =========================
 # WEBHOOK MENSAJES (POST)
 # =========================
 @ruta_whatsapp.post("/")
 async def webhook(request: Request):
+    """Solo encola el mensaje y responde a Meta; el flujo corre en los workers."""
     try:
         data = await request.json()
     except Exception as e:
@@ -428,6 +444,36 @@ async def webhook(request: Request):
     if not msg:
         return JSONResponse({"status": "ok"})
 
+    # 🔁 Reentrega de Meta: ya se procesó (o está en cola)
+    if es_duplicado(msg.get("id")):
+        return JSONResponse({"status": "ok"})
+
+    if not _particiones:
+        # Sin workers (p. ej. fuera del lifespan): se procesa en línea
+        try:
+            with escritura_agrupada():
+                await procesar_mensaje(msg)
+        except Exception:
+            olvidar_mensaje(msg.get("id"))
+            raise
+        return JSONResponse({"status": "ok"})
+
+    try:
+        _particion(msg.get("from")).put_nowait(msg)
+    except asyncio.QueueFull:
+        # Meta reintenta la entrega si no respondemos 200: la reentrega no
+        # debe tomarse por duplicada
+        olvidar_mensaje(msg.get("id"))
+        print(f"⚠️ Cola de WhatsApp llena, se rechaza el mensaje de {msg.get('from')}")
+        return JSONResponse({"status": "busy"}, status_code=503)
+    return JSONResponse({"status": "ok"})
+
+
+# =========================
+# FLUJO DE CONVERSACIÓN
+# =========================
+async def procesar_mensaje(msg: Dict[str, Any]):
+    """Avanza la máquina de estados del chat con un mensaje entrante."""
     numero = msg.get("from")
     texto = (msg.get("text") or "").strip()
     texto_lower = texto.lower().strip()
@@ -436,10 +482,9 @@ async def webhook(request: Request):
     # ATAJOS GLOBALES
     # -------------------------
     if _es_menu(texto_lower):
-        reset_state(numero)
         set_state(numero, "WAIT_OK", {})
         await enviar_boton_ok(numero, texto_inicio_glamperos(), button_id="OK_INICIO", button_title="OK")
-        return JSONResponse({"status": "ok"})
+        return
 
     # -------------------------
     # ESTADO ACTUAL
@@ -459,7 +504,7 @@ async def webhook(request: Request):
                 "En este momento no tenemos un número de asesor configurado.\n"
                 "Por favor intenta más tarde o escribe *menu*.",
             )
-            return JSONResponse({"status": "ok"})
+            return
 
         await enviar_texto(
             numero,
@@ -473,7 +518,7 @@ async def webhook(request: Request):
             "REDIRECTED_TO_HUMAN",
             _merge_context(context, {"redirected_at": datetime.utcnow().isoformat()}),
         )
-        return JSONResponse({"status": "ok"})
+        return
 
     # -------------------------
     # Detectar link de propiedad en cualquier momento
@@ -483,11 +528,11 @@ async def webhook(request: Request):
         set_state(numero, "ASK_ARRIVAL_DATE", {"property_id": property_id, "via": "link"})
         await enviar_texto(numero, "¡Perfecto! 🌿 Ya vi el link del glamping.")
         await enviar_texto(numero, pedir_fecha_llegada())
-        return JSONResponse({"status": "ok"})
+        return
 
     # Si ya fue redirigido a humano, no seguimos molestando (solo permitir menu)
     if state == "REDIRECTED_TO_HUMAN":
-        return JSONResponse({"status": "ok"})
+        return
 
     # -------------------------
     # FLUJO
@@ -496,43 +541,34 @@ async def webhook(request: Request):
         if texto_lower in ["ok_inicio", "ok", "okay", "okey", "ok."]:
             set_state(numero, "ASK_CITY", {})
             await enviar_menu_zonas_numerado(numero)
-            return JSONResponse({"status": "ok"})
+            return
 
         await enviar_boton_ok(numero, texto_inicio_glamperos(), button_id="OK_INICIO", button_title="OK")
         set_state(numero, "WAIT_OK", {})
-        return JSONResponse({"status": "ok"})
+        return
 
     if state == "ASK_CITY":
         if not texto:
             await enviar_menu_zonas_numerado(numero)
-            return JSONResponse({"status": "ok"})
+            return
 
         # ✅ Selección numerada
         seleccion = texto_lower.strip()
 
-        mapa_numero_zona = {
-            "1": ("Cerca a Bogotá", GLAMPINGS_BOGOTA, "ZONA_BOGOTA"),
-            "2": ("Guatavita", GLAMPINGS_GUATAVITA, "ZONA_GUATAVITA"),
-            "3": ("Cerca a Medellín", GLAMPINGS_MEDELLIN, "ZONA_MEDELLIN"),
-            "4": ("Boyacá", GLAMPINGS_BOYACA, "ZONA_BOYACA"),
-            "5": ("Santander", GLAMPINGS_SANTANDER, "ZONA_SANTANDER"),
-        }
-
-        if seleccion not in mapa_numero_zona:
+        zona = zona_por_opcion(seleccion)
+        if not zona:
             await enviar_texto(
                 numero,
                 "No entendí la opción 😅\n\n"
                 "Responde con un número:\n"
-                "1️⃣ Cerca a Bogotá\n"
-                "2️⃣ Guatavita\n"
-                "3️⃣ Cerca a Medellín\n"
-                "4️⃣ Boyacá\n"
-                "5️⃣ Santander\n\n"
+                f"{texto_opciones_zonas()}\n\n"
                 "O escribe *menu* para volver al inicio."
             )
-            return JSONResponse({"status": "ok"})
+            return
 
-        zona_nombre, links, zona_code = mapa_numero_zona[seleccion]
+        zona_nombre, zona_code = zona["nombre"], zona["codigo"]
+        # Precalculado en memoria, ordenado por calificación
+        links = links_zona(zona_code)
 
         nuevo_contexto = _merge_context(
             context,
@@ -540,26 +576,25 @@ async def webhook(request: Request):
         )
         set_state(numero, "ASK_ARRIVAL_DATE", nuevo_contexto)
 
-        # ✅ Enviar links uno a uno (sin espera)
         if links:
-            await enviar_links_uno_a_uno(numero, f"Glampings {zona_nombre}", links)
+            await enviar_links(numero, f"Glampings {zona_nombre}", links)
         else:
             await enviar_texto(
                 numero,
                 f"Perfecto ✅ Elegiste: *{zona_nombre}*.\n\n"
-                "Aún no tengo un listado fijo para esta zona.\n"
+                "Aún no tengo alojamientos cargados en esta zona.\n"
                 "Si quieres, escribe *humano* y te atiende un asesor.\n"
                 "O escribe *menu* para volver."
             )
 
         await enviar_texto(numero, pedir_fecha_llegada())
-        return JSONResponse({"status": "ok"})
+        return
 
     if state == "ASK_ARRIVAL_DATE":
         llegada = parsear_fecha_ddmmaaaa(texto)
         if not llegada:
             await enviar_texto(numero, "No pude leer la fecha 😅\n\n" + pedir_fecha_llegada())
-            return JSONResponse({"status": "ok"})
+            return
 
         if not es_hoy_o_futura(llegada):
             await enviar_texto(
@@ -568,18 +603,18 @@ async def webhook(request: Request):
                 "Por favor escribe una fecha *de hoy en adelante*.\n\n"
                 + pedir_fecha_llegada(),
             )
-            return JSONResponse({"status": "ok"})
+            return
 
         nuevo_contexto = _merge_context(context, {"arrival_date": llegada.strftime("%d/%m/%Y")})
         set_state(numero, "ASK_DEPARTURE_DATE", nuevo_contexto)
         await enviar_texto(numero, pedir_fecha_salida())
-        return JSONResponse({"status": "ok"})
+        return
 
     if state == "ASK_DEPARTURE_DATE":
         salida = parsear_fecha_ddmmaaaa(texto)
         if not salida:
             await enviar_texto(numero, "No pude leer la fecha 😅\n\n" + pedir_fecha_salida())
-            return JSONResponse({"status": "ok"})
+            return
 
         if not es_hoy_o_futura(salida):
             await enviar_texto(
@@ -588,7 +623,7 @@ async def webhook(request: Request):
                 "Por favor escribe una fecha *de hoy en adelante*.\n\n"
                 + pedir_fecha_salida(),
             )
-            return JSONResponse({"status": "ok"})
+            return
 
         llegada_txt = context.get("arrival_date")
         llegada_dt = parsear_fecha_ddmmaaaa(llegada_txt) if llegada_txt else None
@@ -599,12 +634,24 @@ async def webhook(request: Request):
                 "La fecha de salida debe ser *posterior* a la fecha de llegada 🙂\n\n"
                 + pedir_fecha_salida(),
             )
-            return JSONResponse({"status": "ok"})
+            return
 
         nuevo_contexto = _merge_context(context, {"departure_date": salida.strftime("%d/%m/%Y")})
         set_state(numero, "ASK_SOURCE", nuevo_contexto)
+
+        # Búsqueda por zona: ahora que hay fechas, solo los disponibles
+        zona = zona_por_codigo(context.get("city_code")) if not context.get("property_id") else None
+        if zona and llegada_dt:
+            disponibles = links_zona(
+                zona["codigo"],
+                llegada_dt.strftime("%Y-%m-%d"),
+                salida.strftime("%Y-%m-%d"),
+            )
+            if disponibles:
+                await enviar_links(numero, f"Disponibles en {zona['nombre']} para tus fechas", disponibles)
+
         await enviar_lista_fuente(numero)
-        return JSONResponse({"status": "ok"})
+        return
 
     if state == "ASK_SOURCE":
         # Fuente viene del ID de la lista (FUENTE_...)
@@ -643,10 +690,139 @@ async def webhook(request: Request):
                 "Si quieres reiniciar, escribe *menu*.",
             )
 
-        return JSONResponse({"status": "ok"})
+        return
 
     # Fallback
-    reset_state(numero)
     set_state(numero, "WAIT_OK", {})
     await enviar_boton_ok(numero, texto_inicio_glamperos(), button_id="OK_INICIO", button_title="OK")
-    return JSONResponse({"status": "ok"})
+
+
+# =========================
+# MÉTRICAS
+# =========================
+def _percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+
+@ruta_whatsapp.get("/metricas")
+async def metricas_whatsapp():
+    """Tiempo total (ms) de las últimas entregas de links de zona y estado de las colas."""
+    entregas = list(_tiempos_entrega)
+    resumen = {"muestras": len(entregas)}
+    if entregas:
+        resumen.update({
+            "p50_ms": round(_percentil(entregas, 0.50), 1),
+            "p95_ms": round(_percentil(entregas, 0.95), 1),
+            "max_ms": round(max(entregas), 1),
+        })
+    return {
+        "entrega_links": resumen,
+        "mensajes_en_cola": sum(cola.qsize() for cola in _particiones),
+    }
+
+
+
+# =========================
+# DIFUSIONES (plantillas a leads)
+# =========================
+class AudienciaDifusion(BaseModel):
+    """Segmento de whatsapp_leads. Solo estos campos; vacío = todos los leads."""
+    model_config = ConfigDict(extra="forbid")
+
+    fuentes: List[str] = []   # source
+    ciudades: List[str] = []  # city
+    estados: List[str] = []   # status: nuevo, contactado, cerrado, perdido
+    desde: Optional[date] = None  # created_at, inclusive
+    hasta: Optional[date] = None  # created_at, inclusive
+
+
+class NuevaDifusion(BaseModel):
+    nombre: str
+    plantilla: str  # nombre de la plantilla aprobada en Meta
+    idioma: str = "es"
+    parametros: List[str] = []  # "$campo" toma el valor del lead (p. ej. "$city")
+    audiencia: AudienciaDifusion = AudienciaDifusion()
+
+
+def _validar_id_difusion(difusion_id: str):
+    try:
+        ObjectId(difusion_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="ID de difusión inválido")
+
+
+@ruta_whatsapp.post("/difusiones", status_code=202)
+async def crear_y_lanzar_difusion(datos: NuevaDifusion):
+    audiencia = datos.audiencia
+    if audiencia.desde and audiencia.hasta and audiencia.desde > audiencia.hasta:
+        raise HTTPException(status_code=400, detail="`desde` no puede ser posterior a `hasta`")
+    filtro = filtro_audiencia(**audiencia.model_dump())
+    difusion_id = crear_difusion(datos.nombre, datos.plantilla, datos.idioma, datos.parametros, filtro)
+    lanzar_difusion(difusion_id)
+    return {"mensaje": "Difusión en curso", "difusion_id": difusion_id}
+
+
+@ruta_whatsapp.get("/difusiones/{difusion_id}")
+async def estado_difusion(difusion_id: str):
+    _validar_id_difusion(difusion_id)
+    difusion = obtener_difusion(difusion_id)
+    if not difusion:
+        raise HTTPException(status_code=404, detail="Difusión no encontrada")
+    return difusion
+
+
+@ruta_whatsapp.post("/difusiones/{difusion_id}/pausar")
+async def pausar(difusion_id: str):
+    _validar_id_difusion(difusion_id)
+    if not pausar_difusion(difusion_id):
+        raise HTTPException(status_code=409, detail="La difusión no está en curso")
+    return {"mensaje": "La difusión se detendrá al terminar el lote actual"}
+
+
+@ruta_whatsapp.post("/difusiones/{difusion_id}/reanudar", status_code=202)
+async def reanudar(difusion_id: str):
+    """Retoma desde el último punto de control (también tras una caída de la app)."""
+    _validar_id_difusion(difusion_id)
+    difusion = obtener_difusion(difusion_id)
+    if not difusion:
+        raise HTTPException(status_code=404, detail="Difusión no encontrada")
+    if difusion["estado"] == "completada":
+        raise HTTPException(status_code=409, detail="La difusión ya terminó")
+    if not lanzar_difusion(difusion_id):
+        raise HTTPException(status_code=409, detail="La difusión ya se está ejecutando")
+    return {"mensaje": "Difusión reanudada", "difusion_id": difusion_id}
+
+
+
+# =========================
+# REPORTE DE LEADS
+# =========================
+CAMPOS_RESUMEN = ("fecha", "source", "city")
+
+
+@ruta_whatsapp.get("/leads/resumen")
+async def reporte_leads(
+    desde: str = Query(..., description="YYYY-MM-DD"),
+    hasta: str = Query(..., description="YYYY-MM-DD"),
+    agrupar: str = Query("source,city", description="Campos separados por coma: fecha, source, city"),
+):
+    """
+    Leads por fuente, ciudad y/o día. Lee solo los contadores diarios, nunca los
+    leads; los días anteriores al conteo en vivo requieren haber corrido
+    `python -m Funciones.reconstruir_resumen_leads`.
+    """
+    try:
+        datetime.strptime(desde, "%Y-%m-%d")
+        datetime.strptime(hasta, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Las fechas deben tener formato YYYY-MM-DD")
+    campos = [c.strip() for c in agrupar.split(",") if c.strip()]
+    if any(c not in CAMPOS_RESUMEN for c in campos):
+        raise HTTPException(status_code=400, detail=f"Solo se puede agrupar por: {', '.join(CAMPOS_RESUMEN)}")
+
+    filas = resumen_leads(desde, hasta, campos)
+    for fila in filas:
+        if "source" in fila:
+            fila["source_nombre"] = MAPA_FUENTES.get(fila["source"], fila["source"])
+    return {"desde": desde, "hasta": hasta, "filas": filas}
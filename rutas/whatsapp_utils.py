@@ -2,6 +2,10 @@
 
 import os
 import httpx
+from typing import Optional
+from utils.http_clientes import cliente
+from utils.circuit_breaker import breaker, CircuitoAbierto
+from utils.limitador import limitador_whatsapp
 
 PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "531912696676146")
 GRAPH_URL = f"https://graph.facebook.com/v21.0/{PHONE_NUMBER_ID}/messages"
@@ -13,26 +17,182 @@ def _get_token():
         return None
     return token
 
-async def _post_whatsapp(body: dict, error_prefix: str):
+async def enviar_graph(body: dict, error_prefix: str) -> Optional[int]:
+    """
+    Envía el mensaje a Graph y retorna el código HTTP de la respuesta, o None
+    si no hubo respuesta (sin token, circuito abierto o error de red).
+    """
     token = _get_token()
     if not token:
-        return
-
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            GRAPH_URL,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json=body,
-            timeout=10
-        )
+        return None
+
+    await limitador_whatsapp(PHONE_NUMBER_ID).adquirir()
+    try:
+        with breaker("graph").llamada() as llamada:
+            resp = await cliente("graph").post(
+                GRAPH_URL,
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "Content-Type": "application/json",
+                },
+                json=body,
+                timeout=breaker("graph").timeout_seg,
+            )
+            if resp.status_code >= 500 or resp.status_code == 429:
+                llamada.marcar_fallo()
+    except CircuitoAbierto as e:
+        print(f"🔌 {error_prefix}: {e}")
+        return None
+    except httpx.HTTPError as e:
+        print(f"❌ {error_prefix}: {e}")
+        return None
 
     if resp.status_code != 200:
         print(f"❌ {error_prefix}: {resp.text}")
     else:
         print(f"✅ {error_prefix}: enviado correctamente.")
+    return resp.status_code
+
+
+async def _post_whatsapp(body: dict, error_prefix: str) -> bool:
+    """Envía el mensaje a Graph. Retorna True si WhatsApp lo aceptó."""
+    return await enviar_graph(body, error_prefix) == 200
+
+
+# =========================
+# CUERPOS DE MENSAJES
+# =========================
+def cuerpo_whatsapp_texto(numero: str, texto: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": numero,
+        "type": "text",
+        "text": {"body": texto},
+    }
+
+
+def cuerpo_whatsapp_cliente(
+    numero: str,
+    codigoReserva: str,
+    whatsapp: str,
+    nombreGlampingReservado: str,
+    direccionGlamping: str,
+    latitud: float,
+    longitud: float,
+    nombreCliente: str,
+) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": numero,
+        "type": "template",
+        "template": {
+            "name": "mensajeclientereserva",
+            "language": {"code": "es_CO"},
+            "components": [
+                {
+                    "type": "header",
+                    "parameters": [
+                        {
+                            "type": "location",
+                            "location": {
+                                "longitude": longitud,
+                                "latitude": latitud,
+                                "name": nombreGlampingReservado,
+                                "address": direccionGlamping,
+                            },
+                        },
+                    ],
+                },
+                {
+                    "type": "body",
+                    "parameters": [
+                        {"type": "text", "text": nombreCliente},
+                        {"type": "text", "text": codigoReserva},
+                        {"type": "text", "text": whatsapp},
+                    ],
+                },
+            ],
+        },
+    }
+
+
+def cuerpo_whatsapp_propietario(
+    numero: str,
+    nombrePropietario: str,
+    nombreGlamping: str,
+    fechaInicio: str,
+    fechaFin: str,
+    imagenUrl: str = "https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg",
+) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": numero,
+        "type": "template",
+        "template": {
+            "name": "confirmacionreserva",
+            "language": {"code": "es_CO"},
+            "components": [
+                {
+                    "type": "header",
+                    "parameters": [
+                        {"type": "image", "image": {"link": imagenUrl}},
+                    ],
+                },
+                {
+                    "type": "body",
+                    "parameters": [
+                        {"type": "text", "text": nombrePropietario},
+                        {"type": "text", "text": nombreGlamping},
+                        {"type": "text", "text": fechaInicio},
+                        {"type": "text", "text": fechaFin},
+                    ],
+                },
+            ],
+        },
+    }
+
+
+def cuerpo_whatsapp_compra_bonos(
+    numero: str,
+    pdf: str,
+    correo_cliente: str,
+    valor_bono: str,
+    imagenUrl: str = "https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg",
+) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": numero,
+        "type": "template",
+        "template": {
+            "name": "notifica_compra_bonos",
+            "language": {"code": "es"},
+            "components": [
+                {
+                    "type": "header",
+                    "parameters": [
+                        {"type": "image", "image": {"link": imagenUrl}},
+                    ],
+                },
+                {
+                    "type": "body",
+                    "parameters": [
+                        {"type": "text", "text": pdf},
+                        {"type": "text", "text": valor_bono},
+                        {"type": "text", "text": correo_cliente},
+                    ],
+                },
+            ],
+        },
+    }
+
+
+# =========================
+# ENVÍOS DIRECTOS
+# =========================
 
 
 async def enviar_whatsapp_cliente(
@@ -46,40 +206,10 @@ async def enviar_whatsapp_cliente(
     nombreCliente: str,
 ):
     try:
-        body = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": numero,
-            "type": "template",
-            "template": {
-                "name": "mensajeclientereserva",
-                "language": {"code": "es_CO"},
-                "components": [
-                    {
-                        "type": "header",
-                        "parameters": [
-                            {
-                                "type": "location",
-                                "location": {
-                                    "longitude": longitud,
-                                    "latitude": latitud,
-                                    "name": nombreGlampingReservado,
-                                    "address": direccionGlamping,
-                                },
-                            },
-                        ],
-                    },
-                    {
-                        "type": "body",
-                        "parameters": [
-                            {"type": "text", "text": nombreCliente},
-                            {"type": "text", "text": codigoReserva},
-                            {"type": "text", "text": whatsapp},
-                        ],
-                    },
-                ],
-            },
-        }
+        body = cuerpo_whatsapp_cliente(
+            numero, codigoReserva, whatsapp, nombreGlampingReservado,
+            direccionGlamping, latitud, longitud, nombreCliente,
+        )
 
         await _post_whatsapp(body, "WhatsApp al cliente (reserva)")
 
@@ -100,33 +230,9 @@ async def enviar_whatsapp_propietario(
     imagenUrl: str = "https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg",
 ):
     try:
-        body = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": numero,
-            "type": "template",
-            "template": {
-                "name": "confirmacionreserva",
-                "language": {"code": "es_CO"},
-                "components": [
-                    {
-                        "type": "header",
-                        "parameters": [
-                            {"type": "image", "image": {"link": imagenUrl}},
-                        ],
-                    },
-                    {
-                        "type": "body",
-                        "parameters": [
-                            {"type": "text", "text": nombrePropietario},
-                            {"type": "text", "text": nombreGlamping},
-                            {"type": "text", "text": fechaInicio},
-                            {"type": "text", "text": fechaFin},
-                        ],
-                    },
-                ],
-            },
-        }
+        body = cuerpo_whatsapp_propietario(
+            numero, nombrePropietario, nombreGlamping, fechaInicio, fechaFin, imagenUrl,
+        )
 
         await _post_whatsapp(body, "WhatsApp al propietario (confirmación reserva)")
 
@@ -142,32 +248,7 @@ async def enviar_whatsapp_compra_bonos(
     imagenUrl: str = "https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg",
 ):
     try:
-        body = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": numero,
-            "type": "template",
-            "template": {
-                "name": "notifica_compra_bonos",
-                "language": {"code": "es"},
-                "components": [
-                    {
-                        "type": "header",
-                        "parameters": [
-                            {"type": "image", "image": {"link": imagenUrl}},
-                        ],
-                    },
-                    {
-                        "type": "body",
-                        "parameters": [
-                            {"type": "text", "text": pdf},
-                            {"type": "text", "text": valor_bono},
-                            {"type": "text", "text": correo_cliente},
-                        ],
-                    },
-                ],
-            },
-        }
+        body = cuerpo_whatsapp_compra_bonos(numero, pdf, correo_cliente, valor_bono, imagenUrl)
 
         await _post_whatsapp(body, "WhatsApp compra bonos (notificación)")
 
@@ -1,17 +1,18 @@
-from fastapi import APIRouter, HTTPException, status, Request, Query
+from fastapi import APIRouter, HTTPException, status, Request, Query, BackgroundTasks
 from pymongo import MongoClient
-from datetime import datetime, timedelta
+from datetime import datetime
 from pydantic import BaseModel
 import os
-import requests
 import hashlib
-import time
-import httpx
-import asyncio
 from enum import Enum
 
-# Importar funciones de WhatsApp desde el módulo whatsapp_utils
-from rutas.whatsapp_utils import enviar_whatsapp_cliente, enviar_whatsapp_propietario
+from utils import wompi_cliente
+from utils.circuit_breaker import CircuitoAbierto
+
+# Conciliación de pagos con reservas (incluye correos y WhatsApp de confirmación)
+from Funciones.pagos_wompi import (
+    registrar_evento, conciliar_referencia, marcar_evento_recibido, desmarcar_evento,
+)
 
 # ====================================================================
 # CONFIGURACIÓN DE LA BASE DE DATOS
@@ -31,79 +32,6 @@ ruta_wompi = APIRouter(
     responses={status.HTTP_404_NOT_FOUND: {"message": "No encontrado"}},
 )
 
-# URL de la API de usuarios
-GLAMPEROS_API_URL = "https://glamperosapi.onrender.com/usuarios"
-
-async def obtener_usuario(id_usuario, intentos_maximos=3):
-    """Consulta la API de usuarios con reintentos en caso de error."""
-    url = f"{GLAMPEROS_API_URL}/{id_usuario}"
-    
-    async with httpx.AsyncClient() as client:
-        for intento in range(intentos_maximos):
-            try:
-                print(f"🔍 Intento {intento + 1}/{intentos_maximos} - Consultando usuario {id_usuario} en {url}...")
-                response = await client.get(url, timeout=10)
-                if response.status_code == 200:
-                    return response.json()
-                print(f"⚠️ Error al obtener usuario {id_usuario}: {response.status_code} - {response.text}")
-            except httpx.TimeoutException:
-                print(f"⏳ Tiempo de espera agotado en intento {intento + 1}.")
-            except httpx.RequestError as e:
-                print(f"❌ Error en la solicitud a la API de usuarios: {e}")
-            await asyncio.sleep(1)
-    print(f"🚨 No se pudo obtener información del usuario {id_usuario} después de {intentos_maximos} intentos.")
-    return None
-
-ACTUALIZAR_FECHAS_API_URL = "https://glamperosapi.onrender.com/glampings"
-
-async def reservar_fechas_glamping(id_glamping, fecha_ingreso, fecha_salida):
-    """Genera las fechas de la reserva y las actualiza en la API (excluyendo la fecha de salida)."""
-    try:
-        # Si las fechas son datetime, convertirlas a string ISO
-        if isinstance(fecha_ingreso, datetime):
-            fecha_ingreso = fecha_ingreso.isoformat()
-        if isinstance(fecha_salida, datetime):
-            fecha_salida = fecha_salida.isoformat()
-        if not isinstance(fecha_ingreso, str) or not isinstance(fecha_salida, str):
-            raise ValueError(f"Las fechas no son cadenas de texto válidas: {fecha_ingreso}, {fecha_salida}")
-        fecha_actual = datetime.fromisoformat(fecha_ingreso)
-        fecha_fin = datetime.fromisoformat(fecha_salida)
-        if fecha_actual >= fecha_fin:
-            raise ValueError(f"Fecha de ingreso {fecha_ingreso} no puede ser mayor o igual a fecha de salida {fecha_salida}")
-        fechas_a_reservar = []
-        # Generar fechas hasta (pero sin incluir) la fecha de salida
-        while fecha_actual < fecha_fin:
-            fechas_a_reservar.append(fecha_actual.strftime("%Y-%m-%d"))
-            fecha_actual += timedelta(days=1)
-        print(f"📅 Fechas reservadas para el glamping {id_glamping}: {fechas_a_reservar}")
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(
-                f"{ACTUALIZAR_FECHAS_API_URL}/{id_glamping}/fechasReservadasManual",
-                json={"fechas": fechas_a_reservar},
-            )
-            if response.status_code == 200:
-                print("✅ Fechas reservadas correctamente en la API.")
-            else:
-                print(f"⚠️ Error al reservar fechas: {response.status_code} - {response.text}")
-    except ValueError as e:
-        print(f"❌ Error en las fechas proporcionadas: {str(e)}")
-    except Exception as e:
-        print(f"❌ Error general al generar las fechas de reserva: {str(e)}")
-
-GLAMPEROS_GLAMPINGS_API_URL = "https://glamperosapi.onrender.com/glampings"
-
-async def obtener_glamping(id_glamping):
-    """Consulta la API de glampings para obtener la ubicación del glamping."""
-    url = f"{GLAMPEROS_GLAMPINGS_API_URL}/{id_glamping}"
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=10)
-            if response.status_code == 200:
-                return response.json()
-        except httpx.HTTPError:
-            print(f"⚠️ Error al obtener datos del glamping {id_glamping}")
-    return None
-
 # ====================================================================
 # MODELOS DE DATOS
 # ====================================================================
@@ -156,10 +84,7 @@ SECRETS_INTEGRIDAD = {
     "produccion": os.getenv("WOMPI_INTEGRITY_SECRET", ""),
     "pruebas":    os.getenv("WOMPI_INTEGRITY_SECRET_SANDBOX", "")
 }
-API_URLS = {
-    "produccion": "https://api.wompi.co/v1/transactions",
-    "pruebas":    "https://sandbox.wompi.co/v1/transactions"
-}
+# URLs de transacciones: ver utils/wompi_cliente.py (configurables por entorno)
 
 
 # ====================================================================
@@ -216,22 +141,22 @@ async def crear_transaccion(
             "redirect_url":        f"https://glamperos.com/gracias?referencia={payload.referenciaInterna}"
         }
 
-        # 3) Elegir clave y URL según el modo
+        # 3) Elegir clave según el modo
         private_key = PRIVATE_KEYS[modo.value]
-        api_url     = API_URLS[modo.value]
-
-        headers = {
-            "Authorization": f"Bearer {private_key}",
-            "Content-Type":  "application/json"
-        }
 
-        # 4) Llamar a Wompi
-        response = requests.post(api_url, json=data_wompi, headers=headers)
-        respuesta_wompi = response.json()
+        # 4) Llamar a Wompi (cliente asíncrono con conexión reutilizada)
+        try:
+            status_code, respuesta_wompi = await wompi_cliente.crear_transaccion(
+                data_wompi, private_key, modo.value
+            )
+        except wompi_cliente.ErrorWompi as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except CircuitoAbierto as e:
+            raise HTTPException(status_code=503, detail=f"Wompi no disponible: {str(e)}")
 
-        if response.status_code not in (200, 201):
+        if status_code not in (200, 201):
             raise HTTPException(
-                status_code=response.status_code,
+                status_code=status_code,
                 detail=f"Error Wompi: {respuesta_wompi}"
             )
 
@@ -266,11 +191,13 @@ async def crear_transaccion(
 # ====================================================================
 # ENDPOINT PARA WEBHOOK DE WOMPI CON ENVÍO DE CORREO Y WHATSAPP
 # ====================================================================
-# URL de la API de correos (ajústala según tu configuración)
-CORREO_API_URL = "https://glamperosapi.onrender.com/correos/send-email"
-
 @ruta_wompi.post("/webhook", response_model=dict)
-async def webhook_wompi(request: Request):
+async def webhook_wompi(request: Request, background_tasks: BackgroundTasks):
+    """
+    Guarda el evento y responde de inmediato. La reserva se marca como pagada,
+    se reservan sus fechas y se notifica en la conciliación: ya mismo si la
+    reserva existe, o apenas se cree.
+    """
     try:
         evento = await request.json()
         # print("📩 Webhook recibido:", evento)
@@ -281,166 +208,38 @@ async def webhook_wompi(request: Request):
         metodo_pago = transaction.get("payment_method_type", "Desconocido")
         if not transaction_id or not status or not referencia_interna:
             raise HTTPException(status_code=400, detail="Faltan datos en el webhook de Wompi")
-        
+
+        # 🔁 Reintento de Wompi de un evento ya recibido: no se repite nada
+        if not marcar_evento_recibido(transaction_id, status, referencia_interna):
+            print(f"🔁 Evento {transaction_id} ({status}) repetido, se ignora.")
+            return {"mensaje": "Evento ya procesado", "estado": status, "duplicado": True}
+
         # ❌ Si la transacción no fue aprobada, registramos el error y terminamos
         if status != "APPROVED":
             print(f"❌ Transacción {transaction_id} fallida con estado: {status}. No se actualizará la reserva.")
             return {"mensaje": f"Transacción {transaction_id} fallida con estado {status}"}
 
-        reserva = None
-        for _ in range(5):
-            reserva = base_datos.reservas.find_one({"codigoReserva": referencia_interna})
-            if reserva:
-                break
-            print("🔄 Esperando a que la reserva aparezca en la BD")
-            time.sleep(2)
-        if reserva:
-            print(f"✅ Reserva {referencia_interna} encontrada, actualizando EstadoPago a '{status}'.")
-            base_datos.reservas.update_one(
-                {"codigoReserva": referencia_interna},
-                {
-                    "$set": {
-                        "EstadoPago": "Pagado",
-                    }
-                }
-            )
-            # Obtener datos del propietario, cliente y glamping desde la API
-            id_propietario = reserva.get("idPropietario")
-            id_cliente = reserva.get("idCliente")
-            id_glamping = reserva.get("idGlamping")
-            propietario = await obtener_usuario(id_propietario)
-            cliente = await obtener_usuario(id_cliente)
-            glamping = await obtener_glamping(id_glamping)
-            # ✅ Reservar las fechas en la API (excluyendo la fecha de salida)
-            if "FechaIngreso" in reserva and "FechaSalida" in reserva:
-                await reservar_fechas_glamping(id_glamping, reserva["FechaIngreso"], reserva["FechaSalida"])
-            if propietario and cliente:
-                print("📧 Enviando correos de confirmación")
-                def limpiar_numero(numero: str) -> str:
-                    return numero[2:] if numero and numero.startswith("57") else numero
-                telefono_propietario_correo = limpiar_numero(propietario.get("telefono", "No disponible"))
-                telefono_cliente_correo = limpiar_numero(cliente.get("telefono", "No disponible"))
-                telefono_propietario_whatsapp = propietario.get("telefono", "No disponible")
-                telefono_cliente_whatsapp = cliente.get("telefono", "No disponible")
-                if glamping and "ubicacion" in glamping:
-                    latitud = glamping["ubicacion"].get("lat")
-                    longitud = glamping["ubicacion"].get("lng")
-                    print(f"📍 Latitud obtenida: {latitud}")
-                    print(f"📍 Longitud obtenida: {longitud}")
-                    if latitud and longitud:
-                        ubicacion_link = f"https://www.google.com/maps?q={latitud},{longitud}"
-                    else:
-                        ubicacion_link = "Ubicación no disponible"
-                else:
-                    ubicacion_link = "Ubicación no disponible"
-                    print("⚠️ No se encontró la ubicación del glamping en la API.")
-                def convertir_fecha(fecha_raw):
-                    if fecha_raw:
-                        try:
-                            return datetime.fromisoformat(str(fecha_raw)).strftime("%d %b %Y")
-                        except ValueError:
-                            return "Fecha no disponible"
-                    return "Fecha no disponible"
-                fecha_inicio = convertir_fecha(reserva.get("FechaIngreso"))
-                fecha_fin = convertir_fecha(reserva.get("FechaSalida"))
-                # Calcular la fecha límite para cancelar según los días permitidos antes de la reserva
-                dias_cancelacion = glamping.get("diasCancelacion", 0)  # Si no existe, asumimos 0 días
-                try:
-                    fecha_cancelacion_permitida = (datetime.fromisoformat(str(reserva.get("FechaIngreso"))) - timedelta(days=int(dias_cancelacion))).strftime("%d %b %Y")
-                except (ValueError, TypeError):
-                    fecha_cancelacion_permitida = "Fecha no disponible"
-
-                ocupacion = []
-                if reserva.get("adultos", 0) > 0:
-                    ocupacion.append(f"{reserva.get('adultos', 0)} Adultos")
-                if reserva.get("ninos", 0) > 0:
-                    ocupacion.append(f"{reserva.get('ninos', 0)} Niños")
-                if reserva.get("bebes", 0) > 0:
-                    ocupacion.append(f"{reserva.get('bebes', 0)} Bebés")
-                if reserva.get("mascotas", 0) > 0:
-                    ocupacion.append(f"{reserva.get('mascotas', 0)} Mascotas")
-                ocupacion_texto = ", ".join(ocupacion) if ocupacion else "Sin información"
-                mensaje_contacto = "<p>Si tienes preguntas, contacta a nuestro equipo en Glamperos al <strong>3218695196</strong>.</p>"
-                correo_propietario = {
-                    "from_email": "reservaciones@glamperos.com",
-                    "email": propietario.get("email", ""),
-                    "name": propietario.get("nombre", "Propietario"),
-                    "subject": f"🎫 Reserva Confirmada - {glamping.get('nombreGlamping', 'Tu Glamping')}",
-                    "html_content": f"""
-                        <h2 style="color: #2F6B3E;">🎉 ¡Tienes una nueva reserva!</h2>
-                        <p>Hola {propietario.get('nombre', 'Propietario').split(' ')[0]},</p>
-                        <p>¡Han reservado <strong>{glamping.get('nombreGlamping', 'Tu Glamping')}</strong> a través de Glamperos!</p>
-                        <p><strong>Código de Reserva:</strong> {reserva.get('codigoReserva')}</p>
-                        <p><strong>Check-In:</strong> {fecha_inicio}</p>
-                        <p><strong>Check-Out:</strong> {fecha_fin}</p>
-                        <p><strong>Ocupación:</strong> {ocupacion_texto}</p>
-                        <p><strong>Huésped:</strong> {cliente.get('nombre', 'Cliente')}</p>
-                        <p><strong>Teléfono:</strong> {telefono_cliente_correo}</p>
-                        <p><strong>Correo:</strong> {cliente.get('email', 'No disponible')}</p>
-                       
-                        <hr>
-                        {mensaje_contacto}
-                    """
-                }
-                correo_cliente = {
-                    "from_email": "reservas@glamperos.com",
-                    "email": cliente.get("email", ""),
-                    "name": cliente.get("nombre", "Cliente"),
-                    "subject": f"🧳 Confirmación Reserva Glamping - {glamping.get('nombreGlamping', 'Tu Glamping')}",
-                    "html_content": f"""
-                        <h2 style="color: #2F6B3E;">🎉 ¡Hora de relajarse!</h2>
-                        <p>Hola {cliente.get('nombre', 'Cliente').split(' ')[0]},</p>
-                        <p>¡Gracias por reservar con Glamperos! 🎉 Aquí están los detalles de tu reserva:</p>
-                        <p><strong>Código de Reserva:</strong> {reserva.get('codigoReserva', 'No disponible')}</p>
-                        <p><strong>Check-In:</strong> {fecha_inicio}</p>
-                        <p><strong>Check-Out:</strong> {fecha_fin}</p>
-                        <p><strong>Ocupación:</strong> {ocupacion_texto}</p>
-                        <p><strong>Teléfono de tu anfitrión:</strong> {telefono_propietario_correo}</p>
-                        <p><strong>Ubicación:</strong> <a href="{ubicacion_link}" target="_blank">Ver en Google Maps</a></p>
-                        <p><strong>Fecha límite para cancelar con 95% de reembolso:</strong> {fecha_cancelacion_permitida}</p>
-                        <hr>
-                        {mensaje_contacto}
-                    """
-                }
-                async with httpx.AsyncClient() as client:
-                    await client.post(CORREO_API_URL, json=correo_propietario)
-                    await client.post(CORREO_API_URL, json=correo_cliente)
-                    
-                # Enviar mensajes de WhatsApp utilizando las funciones importadas
-                await enviar_whatsapp_cliente(
-                    numero=telefono_cliente_whatsapp,
-                    codigoReserva=reserva.get("codigoReserva", "No disponible"),
-                    whatsapp=telefono_cliente_whatsapp,
-                    nombreGlampingReservado=glamping.get("nombreGlamping", "Tu Glamping"),
-                    direccionGlamping=glamping.get("direccion", "Dirección no disponible"),
-                    latitud=latitud or 0,
-                    longitud=longitud or 0,
-                    nombreCliente=cliente.get("nombre", "Cliente")
-                )
-
-                await enviar_whatsapp_propietario(
-                    numero=telefono_propietario_whatsapp,
-                    nombrePropietario=propietario.get("nombre", "Propietario"),
-                    nombreGlamping=glamping.get("nombreGlamping", "Tu Glamping"),
-                    fechaInicio=fecha_inicio,
-                    fechaFin=f"{fecha_fin} - el whatsapp de tu huésped es {telefono_cliente_correo}",
-                    imagenUrl="https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg"
-                )
-                
-                await enviar_whatsapp_propietario(
-                    numero="573125443396",
-                    nombrePropietario="Edwin",
-                    nombreGlamping=glamping.get("nombreGlamping", "Tu Glamping"),
-                    fechaInicio=fecha_inicio,
-                    fechaFin=f"{fecha_fin} - el whatsapp del huésped es {telefono_cliente_correo} y el dueño es {telefono_propietario_whatsapp}",
-                    imagenUrl="https://storage.googleapis.com/glamperos-imagenes/Imagenes/animal1.jpeg"
-                )
-                
-            return {"mensaje": "Webhook recibido correctamente", "estado": status}
+        try:
+            registrar_evento(transaction_id, referencia_interna, status, metodo_pago)
+        except Exception:
+            desmarcar_evento(transaction_id, status)
+            raise
+        background_tasks.add_task(conciliar_referencia, referencia_interna)
+        return {"mensaje": "Webhook recibido correctamente", "estado": status}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"⚠️ Error en el webhook: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error en webhook: {str(e)}")
 
+# ====================================================================
+# MÉTRICAS DE LLAMADAS A WOMPI
+# ====================================================================
+@ruta_wompi.get("/metricas", response_model=dict)
+async def metricas_wompi():
+    """Latencia de las últimas llamadas a la API de Wompi (p50, p95, máximo) y sus resultados."""
+    return {"llamadas": wompi_cliente.metricas()}
+
 # ====================================================================
 # ENDPOINT PARA CONSULTAR TRANSACCIÓN (opcional)
 # ====================================================================
@@ -0,0 +1,25 @@
+import os
+
+import mongomock
+import pymongo
+import pytest
+
+# Valores mínimos para poder importar la app sin servicios reales
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("OPENAI_API_KEY", "prueba")
+os.environ.setdefault("DEEPSEEK_API_KEY", "prueba")
+os.environ.setdefault("RESEND_API_KEY", "prueba")
+os.environ.setdefault("SESION_SECRETO", "secreto-de-pruebas-con-32-bytes-o-mas")
+
+# Cada módulo hace `from pymongo import MongoClient` al importarse: con esto todos
+# comparten una misma base en memoria (mongomock) en vez de un servidor real.
+_cliente_mongo = mongomock.MongoClient()
+pymongo.MongoClient = lambda *args, **kwargs: _cliente_mongo
+
+
+@pytest.fixture
+def db():
+    """Base `glamperos` vacía para cada prueba."""
+    for nombre in _cliente_mongo["glamperos"].list_collection_names():
+        _cliente_mongo["glamperos"][nombre].delete_many({})
+    return _cliente_mongo["glamperos"]
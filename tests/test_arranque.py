@@ -0,0 +1,7 @@
+import importlib
+
+
+def test_la_app_importa():
+    """Un NameError (o cualquier error al importar un router) tumba toda la API."""
+    main = importlib.import_module("main")
+    assert main.app is not None
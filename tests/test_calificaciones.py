@@ -0,0 +1,47 @@
+from Funciones import calificaciones
+from Funciones.calificaciones import resumenes_calificacion
+
+
+def test_resumen_de_glamping_sin_agregados_no_escribe(db):
+    glamping_id = db["glampings"].insert_one({"nombreGlamping": "Domo", "calificacion": 5}).inserted_id
+    db["evaluaciones"].insert_many([
+        {"glamping_id": str(glamping_id), "calificacion": 4},
+        {"glamping_id": str(glamping_id), "calificacion": 5},
+    ])
+
+    resumen = resumenes_calificacion([str(glamping_id)])[str(glamping_id)]
+
+    assert resumen == {"promedio": 4.5, "conteo": 2}
+    assert db["glampings"].find_one({"_id": glamping_id}) == {
+        "_id": glamping_id, "nombreGlamping": "Domo", "calificacion": 5,
+    }
+
+
+def test_inicializacion_perdida_vuelve_a_la_suma_atomica(db, monkeypatch):
+    glamping_id = db["glampings"].insert_one({"nombreGlamping": "Domo", "calificacion": 5}).inserted_id
+    db["evaluaciones"].insert_many([
+        {"glamping_id": str(glamping_id), "calificacion": 4},
+        {"glamping_id": str(glamping_id), "calificacion": 2},
+    ])
+    original = calificaciones.recalcular_calificacion
+
+    def adelantado(*args, **kwargs):
+        # Otra solicitud inicializó los agregados con solo su evaluación (4)
+        # entre nuestra suma fallida y nuestra inicialización
+        db["glampings"].update_one({"_id": glamping_id}, {"$set": {"ratingSum": 4.0, "ratingCount": 1}})
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(calificaciones, "recalcular_calificacion", adelantado)
+
+    calificaciones.sumar_calificacion(str(glamping_id), 2)
+
+    glamping = db["glampings"].find_one({"_id": glamping_id})
+    assert (glamping["ratingSum"], glamping["ratingCount"]) == (6, 2)
+
+
+def test_recalcular_solo_si_faltan_no_sobrescribe(db):
+    glamping_id = db["glampings"].insert_one({"ratingSum": 9.0, "ratingCount": 2, "calificacion": 4.5}).inserted_id
+    db["evaluaciones"].insert_one({"glamping_id": str(glamping_id), "calificacion": 1})
+
+    assert calificaciones.recalcular_calificacion(str(glamping_id), solo_si_faltan=True) is None
+    assert db["glampings"].find_one({"_id": glamping_id})["ratingCount"] == 2
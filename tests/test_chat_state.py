@@ -0,0 +1,24 @@
+from Funciones.chat_state import escritura_agrupada, get_state, set_state
+
+
+def test_estado_avanzado_por_otro_proceso_no_se_lee_de_la_cache(db):
+    set_state("573001112233", "ASK_CITY", {})
+    assert get_state("573001112233")["state"] == "ASK_CITY"
+
+    # Otro worker atiende el siguiente mensaje del mismo número
+    db["chat_states"].update_one(
+        {"phone": "573001112233"},
+        {"$set": {"state": "ASK_ARRIVAL_DATE", "context": {"city": "Guatavita"}}, "$inc": {"version": 1}},
+    )
+
+    assert get_state("573001112233") == {"state": "ASK_ARRIVAL_DATE", "context": {"city": "Guatavita"}}
+
+
+def test_escritura_agrupada_se_ve_dentro_del_mensaje_y_se_guarda_al_final(db):
+    with escritura_agrupada():
+        set_state("573001112234", "ASK_SOURCE", {"city": "Boyacá"})
+        assert get_state("573001112234")["state"] == "ASK_SOURCE"
+        assert db["chat_states"].find_one({"phone": "573001112234"}) is None
+
+    assert db["chat_states"].find_one({"phone": "573001112234"})["state"] == "ASK_SOURCE"
+    assert get_state("573001112234")["context"] == {"city": "Boyacá"}
@@ -0,0 +1,17 @@
+import time
+
+import resend
+
+from Funciones import servicios
+from utils.circuit_breaker import breaker
+
+
+def test_correo_lento_se_corta_en_el_plazo(monkeypatch):
+    monkeypatch.setattr(breaker("resend"), "timeout_seg", 0.05)
+    monkeypatch.setattr(resend.Emails, "send", lambda payload: time.sleep(1))
+
+    inicio = time.monotonic()
+    resultado = servicios.enviar_correo("huesped@x.co", "Hola", "<p>Hola</p>")
+
+    assert resultado["status"] == "error"
+    assert time.monotonic() - inicio < 0.5
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rutas import whatsapp
+
+
+def _cliente(monkeypatch):
+    monkeypatch.setattr(whatsapp, "lanzar_difusion", lambda difusion_id: True)
+    app = FastAPI()
+    app.include_router(whatsapp.ruta_whatsapp)
+    return TestClient(app)
+
+
+def test_audiencia_con_operadores_se_rechaza(db, monkeypatch):
+    respuesta = _cliente(monkeypatch).post("/whatsapp/difusiones", json={
+        "nombre": "Promo",
+        "plantilla": "promo_junio",
+        "audiencia": {"$or": [{"$where": "sleep(1000)"}], "city": {"$ne": None}},
+    })
+
+    assert respuesta.status_code == 422
+    assert db["whatsapp_difusiones"].count_documents({}) == 0
+
+
+def test_audiencia_se_arma_desde_campos_conocidos(db, monkeypatch):
+    respuesta = _cliente(monkeypatch).post("/whatsapp/difusiones", json={
+        "nombre": "Promo",
+        "plantilla": "promo_junio",
+        "audiencia": {"fuentes": ["instagram"], "ciudades": ["ZONA_BOGOTA"], "desde": "2030-01-01", "hasta": "2030-01-31"},
+    })
+
+    assert respuesta.status_code == 202
+    difusion = db["whatsapp_difusiones"].find_one()
+    assert difusion["audiencia"] == {
+        "source": {"$in": ["instagram"]},
+        "city": {"$in": ["ZONA_BOGOTA"]},
+        "created_at": {"$gte": datetime(2030, 1, 1), "$lt": datetime(2030, 2, 1)},
+    }
@@ -0,0 +1,37 @@
+import asyncio
+
+import httpx
+
+from rutas import whatsapp, whatsapp_utils
+from utils import limitador
+
+
+class _GraphFalso:
+    async def post(self, url, **kwargs):
+        return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+
+
+def test_bot_outbox_y_difusiones_comparten_la_cubeta_del_numero(monkeypatch):
+    usados = []
+
+    class _Cubeta:
+        async def adquirir(self, tokens=1.0):
+            usados.append(self)
+
+    cubeta = _Cubeta()
+    monkeypatch.setattr(limitador, "_limitadores_whatsapp", {whatsapp.PHONE_NUMBER_ID: cubeta})
+    monkeypatch.setenv("WHATSAPP_API_TOKEN", "prueba")
+    monkeypatch.setattr(whatsapp, "WHATSAPP_API_TOKEN", "prueba")
+    monkeypatch.setattr(whatsapp, "cliente", lambda nombre: _GraphFalso())
+    monkeypatch.setattr(whatsapp_utils, "cliente", lambda nombre: _GraphFalso())
+
+    async def enviar():
+        # Bot (respuestas del chat) y outbox/difusiones (_post_whatsapp)
+        assert await whatsapp.enviar_texto("573001112233", "hola")
+        assert await whatsapp_utils._post_whatsapp(
+            whatsapp_utils.cuerpo_whatsapp_texto("573001112233", "hola"), "Prueba"
+        )
+
+    asyncio.run(enviar())
+
+    assert usados == [cubeta, cubeta]
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+import socketio
+
+from rutas import mensajeria
+from utils.bus_mensajes import crear_bus
+from utils.sesion import emitir_token
+
+
+@pytest.fixture
+def salas(monkeypatch):
+    salas = {}
+
+    async def enter_room(sid, sala, namespace=None):
+        salas[sid] = sala
+
+    async def save_session(sid, sesion, namespace=None):
+        pass
+
+    monkeypatch.setattr(mensajeria.sio, "enter_room", enter_room)
+    monkeypatch.setattr(mensajeria.sio, "save_session", save_session)
+    return salas
+
+
+def test_conectar_con_token_entra_a_la_sala_del_usuario(salas):
+    asyncio.run(mensajeria.connect("s1", {}, {"usuario": "u1", "token": emitir_token("u1")}))
+    assert salas == {"s1": "u1"}
+
+
+def test_conectar_con_usuario_sin_token_o_ajeno_se_rechaza(salas):
+    with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+        asyncio.run(mensajeria.connect("s1", {}, {"usuario": "u1"}))
+    with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+        asyncio.run(mensajeria.connect("s2", {"QUERY_STRING": f"usuario=u1&token={emitir_token('u2')}"}))
+    respuesta = asyncio.run(mensajeria.unirse("s3", {"usuario": "u1", "token": "falso"}))
+    assert "error" in respuesta
+    assert salas == {}
+
+
+def test_bus_local_no_arranca_con_varios_workers():
+    async def entregar(mensaje):
+        pass
+
+    with pytest.raises(RuntimeError):
+        crear_bus("local", None, entregar, procesos=2)
+    assert crear_bus("local", None, entregar, procesos=1) is not None
@@ -0,0 +1,72 @@
+import asyncio
+
+import resend
+from resend.exceptions import ResendError
+
+from Funciones import outbox
+
+
+class _ColeccionAsync:
+    """Envuelve la colección de mongomock con la interfaz async de motor."""
+
+    def __init__(self, coleccion):
+        self._coleccion = coleccion
+
+    async def update_one(self, *args, **kwargs):
+        return self._coleccion.update_one(*args, **kwargs)
+
+
+def _trabajo(db, monkeypatch, tipo, payload):
+    monkeypatch.setattr(outbox, "_coleccion_async", _ColeccionAsync(db["notificaciones_outbox"]))
+    outbox.encolar(tipo, payload)
+    trabajo = db["notificaciones_outbox"].find_one({"payload": payload})
+    trabajo["intentos"] = 1
+    return trabajo
+
+
+def test_correo_rechazado_por_resend_no_se_reintenta(db, monkeypatch):
+    opciones_recibidas = []
+
+    def enviar(payload, opciones=None):
+        opciones_recibidas.append(opciones)
+        raise ResendError(422, "validation_error", "Correo inválido", "")
+
+    monkeypatch.setattr(resend.Emails, "send", enviar)
+    trabajo = _trabajo(db, monkeypatch, "email", {"to": ["x"], "subject": "Hola", "html": "<p>Hola</p>"})
+
+    asyncio.run(outbox._procesar(trabajo))
+
+    guardado = db["notificaciones_outbox"].find_one()
+    assert guardado["estado"] == "fallido"
+    assert opciones_recibidas == [{"idempotency_key": f"outbox-{trabajo['_id']}"}]
+
+
+def test_correo_con_error_del_servidor_se_reintenta(db, monkeypatch):
+    def enviar(payload, opciones=None):
+        raise ResendError(500, "application_error", "Error interno", "")
+
+    monkeypatch.setattr(resend.Emails, "send", enviar)
+    trabajo = _trabajo(db, monkeypatch, "email", {"to": ["x"], "subject": "Hola", "html": "<p>Hola</p>"})
+
+    asyncio.run(outbox._procesar(trabajo))
+
+    assert db["notificaciones_outbox"].find_one()["estado"] == "pendiente"
+
+
+def test_whatsapp_4xx_es_definitivo_salvo_429(db, monkeypatch):
+    respuestas = {}
+
+    async def enviar_graph(body, error_prefix):
+        return respuestas["codigo"]
+
+    monkeypatch.setattr(outbox, "enviar_graph", enviar_graph)
+
+    respuestas["codigo"] = 400
+    trabajo = _trabajo(db, monkeypatch, "whatsapp_texto", {"numero": "573001112233", "texto": "Hola"})
+    asyncio.run(outbox._procesar(trabajo))
+    assert db["notificaciones_outbox"].find_one({"_id": trabajo["_id"]})["estado"] == "fallido"
+
+    respuestas["codigo"] = 429
+    trabajo = _trabajo(db, monkeypatch, "whatsapp_texto", {"numero": "573001112234", "texto": "Hola"})
+    asyncio.run(outbox._procesar(trabajo))
+    assert db["notificaciones_outbox"].find_one({"_id": trabajo["_id"]})["estado"] == "pendiente"
@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from Funciones import pagos_wompi
+from Funciones.pagos_wompi import aplicar_pago_aprobado
+from Funciones.periodos_reservados import CAMPO_RETENCIONES, nueva_retencion, rango_a_periodo
+
+
+def _reserva(db, glamping_id, retencion=None, codigo="RES-1"):
+    reserva = {
+        "codigoReserva": codigo,
+        "idGlamping": str(glamping_id),
+        "FechaIngreso": "2030-01-10",
+        "FechaSalida": "2030-01-12",
+        "EstadoPago": "Pendiente",
+        "retencionId": retencion["id"] if retencion else None,
+    }
+    db["reservas"].insert_one(dict(reserva))
+    return reserva
+
+
+def _retencion(codigo):
+    return nueva_retencion(rango_a_periodo("2030-01-10", "2030-01-12"), codigo, datetime.now(timezone.utc))
+
+
+def test_pago_reserva_las_noches_y_quita_la_retencion(db):
+    propia = _retencion("RES-1")
+    glamping_id = db["glampings"].insert_one({CAMPO_RETENCIONES: [propia]}).inserted_id
+
+    aplicar_pago_aprobado(_reserva(db, glamping_id, propia))
+
+    glamping = db["glampings"].find_one({"_id": glamping_id})
+    assert glamping["periodosReservados"] == [{"inicio": "2030-01-10", "fin": "2030-01-12", "fuente": "manual"}]
+    assert glamping[CAMPO_RETENCIONES] == []
+    assert db["reservas"].find_one({"codigoReserva": "RES-1"})["EstadoPago"] == "Pagado"
+
+
+def test_pago_con_noches_ya_reservadas_queda_en_conflicto(db):
+    glamping_id = db["glampings"].insert_one({"fechasReservadas": ["2030-01-11"]}).inserted_id
+
+    assert aplicar_pago_aprobado(_reserva(db, glamping_id)) is None
+
+    reserva = db["reservas"].find_one({"codigoReserva": "RES-1"})
+    assert reserva["EstadoPago"] == "Conflicto"
+    assert reserva["requiereReembolso"] is True
+    assert db["glampings"].find_one({"_id": glamping_id})["fechasReservadas"] == ["2030-01-11"]
+
+
+def test_pago_con_retencion_vencida_y_noches_retenidas_por_otra(db):
+    ajena = _retencion("RES-2")
+    glamping_id = db["glampings"].insert_one({CAMPO_RETENCIONES: [ajena]}).inserted_id
+
+    assert aplicar_pago_aprobado(_reserva(db, glamping_id, {"id": str(ObjectId())})) is None
+
+    glamping = db["glampings"].find_one({"_id": glamping_id})
+    assert "periodosReservados" not in glamping
+    assert glamping[CAMPO_RETENCIONES][0]["id"] == ajena["id"]
+    assert db["reservas"].find_one({"codigoReserva": "RES-1"})["EstadoPago"] == "Conflicto"
+
+
+def _reserva_con_usuarios(db):
+    propietario = db["usuarios"].insert_one({"nombre": "Ana", "email": "ana@x.co", "telefono": "573000000001"})
+    cliente = db["usuarios"].insert_one({"nombre": "Luis", "email": "luis@x.co", "telefono": "573000000002"})
+    glamping_id = db["glampings"].insert_one({"nombreGlamping": "Domo"}).inserted_id
+    db["reservas"].insert_one({
+        "codigoReserva": "RES-1",
+        "idGlamping": str(glamping_id),
+        "idPropietario": str(propietario.inserted_id),
+        "idCliente": str(cliente.inserted_id),
+        "FechaIngreso": "2030-01-10",
+        "FechaSalida": "2030-01-12",
+        "EstadoPago": "Pendiente",
+    })
+
+
+def test_dos_pagos_aprobados_de_la_misma_reserva_notifican_una_vez(db, monkeypatch):
+    notificadas = []
+    monkeypatch.setattr(pagos_wompi, "notificar_reserva_confirmada", lambda *args: notificadas.append(args))
+    _reserva_con_usuarios(db)
+    pagos_wompi.registrar_evento("TX-1", "RES-1", "APPROVED", "CARD")
+    pagos_wompi.registrar_evento("TX-2", "RES-1", "APPROVED", "PSE")
+
+    assert pagos_wompi.conciliar_referencia("RES-1") == 1
+
+    assert len(notificadas) == 1
+    eventos = {e["transaction_id"]: e for e in db["wompi_eventos_pendientes"].find()}
+    assert {e["estado"] for e in eventos.values()} == {"procesado"}
+    assert sum(1 for e in eventos.values() if e.get("omitido")) == 1
+    assert "pagoBloqueadoHasta" not in db["reservas"].find_one({"codigoReserva": "RES-1"})
+
+
+def test_pago_que_falla_vuelve_a_pendiente(db, monkeypatch):
+    def fallar(*args):
+        raise RuntimeError("outbox caído")
+
+    monkeypatch.setattr(pagos_wompi, "notificar_reserva_confirmada", fallar)
+    _reserva_con_usuarios(db)
+    pagos_wompi.registrar_evento("TX-1", "RES-1", "APPROVED", "CARD")
+
+    assert pagos_wompi.conciliar_referencia("RES-1") == 0
+
+    evento = db["wompi_eventos_pendientes"].find_one({"transaction_id": "TX-1"})
+    assert evento["estado"] == "pendiente"
+    assert evento["intentos"] == 1
+    assert "bloqueado_hasta" not in evento
@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from Funciones.periodos_reservados import CAMPO_RETENCIONES, nueva_retencion, rango_a_periodo
+from rutas.glamping import ruta_glampings
+
+
+def test_busqueda_con_retencion_vigente(db):
+    """Un glamping con un pago en curso sigue apareciendo en la búsqueda (y sin la retención)."""
+    retencion = nueva_retencion(
+        rango_a_periodo("2030-01-10", "2030-01-12"), "RES-1", datetime.now(timezone.utc)
+    )
+    db["glampings"].insert_one({
+        "nombreGlamping": "Domo del bosque",
+        "habilitado": True,
+        "calificacion": 5,
+        "precioEstandar": 200000,
+        CAMPO_RETENCIONES: [retencion],
+    })
+
+    app = FastAPI()
+    app.include_router(ruta_glampings)
+    respuesta = TestClient(app).get("/glampings/glampingfiltrados")
+
+    assert respuesta.status_code == 200
+    glampings = respuesta.json()["glampings"]
+    assert [g["nombreGlamping"] for g in glampings] == ["Domo del bosque"]
+    assert CAMPO_RETENCIONES not in glampings[0]
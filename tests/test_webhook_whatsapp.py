@@ -0,0 +1,30 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rutas import whatsapp
+
+
+def _entrega(mensaje_id, numero="573001112233", texto="hola"):
+    return {"entry": [{"changes": [{"value": {"messages": [{
+        "id": mensaje_id, "from": numero, "type": "text", "text": {"body": texto},
+    }]}}]}]}
+
+
+def test_reentrega_tras_cola_llena_se_procesa(db, monkeypatch):
+    cola = asyncio.Queue(maxsize=1)
+    cola.put_nowait({"id": "wamid.OCUPADO"})
+    monkeypatch.setattr(whatsapp, "_particiones", [cola])
+    app = FastAPI()
+    app.include_router(whatsapp.ruta_whatsapp)
+    cliente = TestClient(app)
+
+    assert cliente.post("/whatsapp/", json=_entrega("wamid.1")).status_code == 503
+
+    cola.get_nowait()  # el worker alcanzó a vaciar la partición
+    assert cliente.post("/whatsapp/", json=_entrega("wamid.1")).status_code == 200
+    assert cola.get_nowait()["id"] == "wamid.1"
+    # Una tercera entrega del mismo id sí es duplicada
+    assert cliente.post("/whatsapp/", json=_entrega("wamid.1")).status_code == 200
+    assert cola.empty()
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rutas.wompi import ruta_wompi
+from utils import circuit_breaker, wompi_cliente
+
+
+@pytest.fixture
+def wompi(monkeypatch):
+    """Cliente de Wompi con un transporte falso: `respuestas` dice qué pasa en cada intento."""
+    respuestas = []
+    peticiones = []
+
+    def manejar(peticion):
+        peticiones.append(peticion)
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    transporte = httpx.MockTransport(manejar)
+    monkeypatch.setattr(wompi_cliente, "cliente", lambda nombre: httpx.AsyncClient(transport=transporte))
+    monkeypatch.setitem(circuit_breaker.BREAKERS, "wompi", circuit_breaker.CircuitBreaker("wompi"))
+    monkeypatch.setattr(wompi_cliente, "_latencias", {})
+    monkeypatch.setattr(wompi_cliente, "_contadores", {})
+    monkeypatch.setattr(wompi_cliente.asyncio, "sleep", _sin_espera)
+    return respuestas, peticiones
+
+
+async def _sin_espera(segundos):
+    pass
+
+
+def _crear():
+    return asyncio.run(wompi_cliente.crear_transaccion({"reference": "R1"}, "prv_test"))
+
+
+def test_error_de_conexion_se_reintenta(wompi):
+    respuestas, peticiones = wompi
+    respuestas += [httpx.ConnectError("sin red"), httpx.Response(201, json={"data": {"id": "T1"}})]
+
+    assert _crear() == (201, {"data": {"id": "T1"}})
+    assert len(peticiones) == 2
+
+
+def test_timeout_de_lectura_no_se_reintenta(wompi):
+    respuestas, peticiones = wompi
+    respuestas += [httpx.ReadTimeout("lento"), httpx.Response(201, json={})]
+
+    with pytest.raises(wompi_cliente.ErrorWompi):
+        _crear()
+    assert len(peticiones) == 1
+
+
+def test_4xx_se_devuelve_sin_cambios(wompi):
+    respuestas, peticiones = wompi
+    error = {"error": {"type": "INPUT_VALIDATION_ERROR", "messages": {"amount_in_cents": ["Inválido"]}}}
+    respuestas.append(httpx.Response(422, json=error))
+
+    assert _crear() == (422, error)
+    assert len(peticiones) == 1
+
+
+def test_metricas_por_operacion(wompi):
+    respuestas, _ = wompi
+    respuestas += [
+        httpx.ConnectError("sin red"),
+        httpx.Response(201, json={}),
+        httpx.Response(422, json={}),
+    ]
+    _crear()
+    _crear()
+
+    app = FastAPI()
+    app.include_router(ruta_wompi)
+    llamadas = TestClient(app).get("/wompi/metricas").json()["llamadas"]
+
+    resumen = llamadas["crear_transaccion"]
+    assert resumen["muestras"] == 3
+    assert resumen["resultados"] == {"error_conexion": 1, "201": 1, "422": 1}
+    assert set(resumen) == {"muestras", "p50_ms", "p95_ms", "max_ms", "resultados"}
+    assert resumen["p50_ms"] <= resumen["p95_ms"] <= resumen["max_ms"]
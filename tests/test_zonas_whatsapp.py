@@ -0,0 +1,21 @@
+from Funciones.zonas_whatsapp import URL_PROPIEDAD, links_zona, refrescar_zonas
+
+
+def _glamping(db, periodo):
+    return db["glampings"].insert_one({
+        "habilitado": True,
+        "calificacion": 5,
+        "ubicacion": {"lat": 4.7110, "lng": -74.0721},
+        "periodosReservados": [{**periodo, "fuente": "manual"}],
+    }).inserted_id
+
+
+def test_reserva_que_empieza_el_dia_de_salida_no_oculta_el_glamping(db):
+    libre = _glamping(db, {"inicio": "2030-01-12", "fin": "2030-01-14"})
+    ocupado = _glamping(db, {"inicio": "2030-01-11", "fin": "2030-01-13"})
+    refrescar_zonas()
+
+    links = links_zona("ZONA_BOGOTA", "2030-01-10", "2030-01-12")
+
+    assert URL_PROPIEDAD.format(libre) in links
+    assert URL_PROPIEDAD.format(ocupado) not in links
@@ -0,0 +1,90 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Recibe un mensaje ya guardado y lo emite a los sockets conectados a este worker
+Entregar = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class BusLocal:
+    """
+    Entrega en el mismo proceso. Sirve con un solo worker (o en desarrollo):
+    un receptor conectado a otro worker no recibe nada.
+    """
+
+    def __init__(self, entregar: Entregar):
+        self._entregar = entregar
+
+    async def publicar(self, mensaje: Dict[str, Any]):
+        await self._entregar(mensaje)
+
+    async def iniciar(self):
+        pass
+
+    async def detener(self):
+        pass
+
+
+class BusMongo:
+    """
+    Cada worker escucha con un change stream los inserts de la colección de
+    mensajes y los entrega a sus propios sockets. Guardar el mensaje ya es
+    publicarlo, así que `publicar` no hace nada. Requiere que Mongo sea un
+    replica set (Atlas lo es).
+    """
+
+    def __init__(self, coleccion, entregar: Entregar, espera_reintento: float = 5.0):
+        self._coleccion = coleccion
+        self._entregar = entregar
+        self._espera = espera_reintento
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def publicar(self, mensaje: Dict[str, Any]):
+        pass
+
+    async def iniciar(self):
+        self._tarea = asyncio.create_task(self._escuchar())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def _escuchar(self):
+        token = None
+        while True:
+            try:
+                async with self._coleccion.watch(
+                    [{"$match": {"operationType": "insert"}}],
+                    resume_after=token,
+                ) as stream:
+                    async for cambio in stream:
+                        token = cambio["_id"]
+                        try:
+                            await self._entregar(cambio["fullDocument"])
+                        except Exception as e:
+                            print(f"⚠️ Bus de mensajes: no se pudo entregar {cambio['documentKey']}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Se retoma desde el último cambio visto para no perder mensajes
+                print(f"⚠️ Bus de mensajes: change stream caído, reintento en {self._espera:.0f}s: {e}")
+                await asyncio.sleep(self._espera)
+
+
+def crear_bus(backend: str, coleccion, entregar: Entregar, procesos: int = 1):
+    """
+    `backend` es "mongo" (varios workers o instancias) o "local" (uno solo).
+    `procesos` es la cantidad de workers de este servidor: "local" con más de
+    uno perdería los mensajes entre workers, así que no arranca.
+    """
+    if backend == "mongo":
+        return BusMongo(coleccion, entregar)
+    if backend != "local":
+        raise RuntimeError(f"MENSAJERIA_BACKEND desconocido ({backend}): usa 'mongo' o 'local'")
+    if procesos > 1:
+        raise RuntimeError(
+            f"MENSAJERIA_BACKEND=local con {procesos} workers: los mensajes no llegarían "
+            "a los usuarios conectados a otro worker. Configura MENSAJERIA_BACKEND=mongo."
+        )
+    return BusLocal(entregar)
@@ -0,0 +1,232 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+
+class CircuitoAbierto(Exception):
+    """La integración está fallando o muy lenta: se rechaza la llamada sin intentarla."""
+
+    def __init__(self, nombre: str, reintentar_en: float):
+        self.nombre = nombre
+        self.reintentar_en = reintentar_en
+        super().__init__(f"Circuito '{nombre}' abierto; se reintenta en {reintentar_en:.0f}s")
+
+
+class CircuitBreaker:
+    """
+    Cortacircuitos por integración externa.
+
+    Mira las últimas `ventana` llamadas: si la proporción de errores o de llamadas
+    lentas supera su umbral (con al menos `min_llamadas`), se abre y rechaza todo
+    durante `segundos_abierto`. Después deja pasar una llamada de prueba
+    (semiabierto): si sale bien se cierra, si no vuelve a abrirse.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        ventana: int = 20,
+        min_llamadas: int = 5,
+        umbral_errores: float = 0.5,
+        umbral_lentas: float = 0.5,
+        latencia_lenta_ms: float = 5000,
+        segundos_abierto: float = 30,
+        timeout_seg: float = 10,
+    ):
+        self.nombre = nombre
+        self.min_llamadas = min_llamadas
+        self.umbral_errores = umbral_errores
+        self.umbral_lentas = umbral_lentas
+        self.latencia_lenta_ms = latencia_lenta_ms
+        self.segundos_abierto = segundos_abierto
+        # Plazo sugerido para cada llamada a esta integración
+        self.timeout_seg = timeout_seg
+
+        self._llamadas: deque = deque(maxlen=ventana)  # (exito, latencia_ms)
+        self._estado = "cerrado"
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._aperturas = 0
+        self._rechazadas = 0
+        self._lock = threading.Lock()
+
+    # -------- estado --------
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            return self._estado_actual()
+
+    def _estado_actual(self) -> str:
+        if self._estado == "abierto" and time.monotonic() - self._abierto_desde >= self.segundos_abierto:
+            self._estado = "semiabierto"
+            self._prueba_en_curso = False
+        return self._estado
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si la llamada no debe intentarse."""
+        with self._lock:
+            estado = self._estado_actual()
+            if estado == "cerrado":
+                return
+            if estado == "semiabierto" and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return
+            self._rechazadas += 1
+            restante = max(0.0, self.segundos_abierto - (time.monotonic() - self._abierto_desde))
+            raise CircuitoAbierto(self.nombre, restante)
+
+    def registrar(self, exito: bool, latencia_ms: float):
+        with self._lock:
+            if self._estado == "semiabierto":
+                self._prueba_en_curso = False
+                if exito and latencia_ms < self.latencia_lenta_ms:
+                    self._estado = "cerrado"
+                    self._llamadas.clear()
+                else:
+                    self._abrir()
+                return
+
+            self._llamadas.append((exito, latencia_ms))
+            total = len(self._llamadas)
+            if self._estado != "cerrado" or total < self.min_llamadas:
+                return
+            errores = sum(1 for ok, _ in self._llamadas if not ok)
+            lentas = sum(1 for _, ms in self._llamadas if ms >= self.latencia_lenta_ms)
+            if errores / total >= self.umbral_errores or lentas / total >= self.umbral_lentas:
+                self._abrir()
+
+    def _abrir(self):
+        self._estado = "abierto"
+        self._abierto_desde = time.monotonic()
+        self._aperturas += 1
+        print(f"🔌 Circuito '{self.nombre}' abierto por {self.segundos_abierto:.0f}s")
+
+    def resumen(self) -> Dict[str, Any]:
+        with self._lock:
+            estado = self._estado_actual()
+            total = len(self._llamadas)
+            latencias = sorted(ms for _, ms in self._llamadas)
+            return {
+                "estado": estado,
+                "llamadas_recientes": total,
+                "errores_recientes": sum(1 for ok, _ in self._llamadas if not ok),
+                "latencia_p50_ms": round(latencias[total // 2], 1) if total else None,
+                "latencia_max_ms": round(latencias[-1], 1) if total else None,
+                "aperturas": self._aperturas,
+                "rechazadas": self._rechazadas,
+                "timeout_seg": self.timeout_seg,
+            }
+
+    # -------- uso --------
+    def llamada(self) -> "_Llamada":
+        """
+        Contexto que protege una llamada (sirve con `with` y `async with`):
+        rechaza si el circuito está abierto y registra éxito/latencia al salir.
+        Una excepción cuenta como fallo; `marcar_fallo()` sirve para respuestas
+        de error que no lanzan (p. ej. HTTP 5xx).
+        """
+        return _Llamada(self)
+
+
+class _Llamada:
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+        self.fallo = False
+        self._inicio = 0.0
+
+    def marcar_fallo(self):
+        self.fallo = True
+
+    def __enter__(self):
+        self.breaker.permitir()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, *_):
+        latencia_ms = (time.perf_counter() - self._inicio) * 1000
+        self.breaker.registrar(tipo is None and not self.fallo, latencia_ms)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, tipo, *exc):
+        return self.__exit__(tipo, *exc)
+
+
+# =========================
+# PLAZOS
+# =========================
+class Plazo:
+    """Tiempo total disponible para una operación que hace varias llamadas."""
+
+    def __init__(self, segundos: float):
+        self.limite = time.monotonic() + segundos
+
+    def restante(self) -> float:
+        return max(0.0, self.limite - time.monotonic())
+
+    @property
+    def vencido(self) -> bool:
+        return self.restante() <= 0
+
+    def timeout(self, maximo: Optional[float] = None) -> float:
+        """Timeout para la siguiente llamada: lo que queda del plazo, sin pasar de `maximo`."""
+        restante = self.restante()
+        return min(restante, maximo) if maximo is not None else restante
+
+
+async def con_plazo(coro, segundos: float):
+    """Espera `coro` como máximo `segundos` (asyncio.TimeoutError si se pasa)."""
+    return await asyncio.wait_for(coro, timeout=segundos)
+
+
+# Hilos para llamadas síncronas a SDKs sin timeout propio (p. ej. Resend)
+_hilos_plazo = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CB_HILOS_PLAZO", "8")),
+    thread_name_prefix="plazo",
+)
+
+
+def con_plazo_en_hilo(funcion, segundos: float, *args, **kwargs):
+    """
+    Versión síncrona de `con_plazo`: corre `funcion` en un hilo y espera como
+    máximo `segundos` (TimeoutError si se pasa). La llamada sigue en su hilo
+    hasta terminar, pero quien la hizo ya no queda esperándola.
+    """
+    return _hilos_plazo.submit(funcion, *args, **kwargs).result(timeout=segundos)
+
+
+# =========================
+# REGISTRO DE INTEGRACIONES
+# =========================
+def _config(nombre: str, latencia_lenta_ms: float, timeout_seg: float) -> Dict[str, Any]:
+    prefijo = f"CB_{nombre.upper()}_"
+    return {
+        "latencia_lenta_ms": float(os.getenv(prefijo + "LENTA_MS", latencia_lenta_ms)),
+        "timeout_seg": float(os.getenv(prefijo + "TIMEOUT_SEG", timeout_seg)),
+        "umbral_errores": float(os.getenv("CB_UMBRAL_ERRORES", "0.5")),
+        "umbral_lentas": float(os.getenv("CB_UMBRAL_LENTAS", "0.5")),
+        "segundos_abierto": float(os.getenv("CB_SEGUNDOS_ABIERTO", "30")),
+    }
+
+
+BREAKERS: Dict[str, CircuitBreaker] = {
+    "graph": CircuitBreaker("graph", **_config("graph", 4000, 10)),
+    "resend": CircuitBreaker("resend", **_config("resend", 4000, 10)),
+    "wompi": CircuitBreaker("wompi", **_config("wompi", 8000, 20)),
+    "deepseek": CircuitBreaker("deepseek", **_config("deepseek", 20000, 45)),
+    "gcs": CircuitBreaker("gcs", **_config("gcs", 8000, 30)),
+}
+
+
+def breaker(nombre: str) -> CircuitBreaker:
+    return BREAKERS[nombre]
+
+
+def estados() -> Dict[str, Dict[str, Any]]:
+    return {nombre: b.resumen() for nombre, b in BREAKERS.items()}
@@ -1,6 +1,7 @@
 import os
 import json
-import requests
+from utils.http_clientes import cliente_sync
+from utils.circuit_breaker import breaker
 
 # Asegúrate de exportar: export DEEPSEEK_API_KEY="tu_key"
 DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY")
@@ -38,8 +39,11 @@ def extraer_intencion(pregunta: str) -> dict:
         "Content-Type": "application/json"
     }
 
-    response = requests.post(BASE_URL, headers=headers, json=payload)
-    response.raise_for_status()
+    with breaker("deepseek").llamada():
+        response = cliente_sync("deepseek").post(
+            BASE_URL, headers=headers, json=payload, timeout=breaker("deepseek").timeout_seg
+        )
+        response.raise_for_status()
     content = response.json()["choices"][0]["message"]["content"]
 
     # Intenta forzar que el contenido sea JSON puro
@@ -76,6 +80,9 @@ def generar_respuesta(pregunta: str, lista_glampings: str) -> str:
         "Content-Type": "application/json"
     }
 
-    response = requests.post(BASE_URL, headers=headers, json=payload)
-    response.raise_for_status()
+    with breaker("deepseek").llamada():
+        response = cliente_sync("deepseek").post(
+            BASE_URL, headers=headers, json=payload, timeout=breaker("deepseek").timeout_seg
+        )
+        response.raise_for_status()
     return response.json()["choices"][0]["message"]["content"]
@@ -0,0 +1,84 @@
+import os
+import httpx
+from typing import Dict
+
+# HTTP/2 solo si el paquete h2 está instalado (httpx lo requiere para http2=True)
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+# Configuración por integración: conexiones abiertas (keep-alive) y tiempos máximos.
+# "connect" es el tiempo para abrir la conexión; "read" el de espera de la respuesta.
+PERFILES = {
+    "graph": {
+        "base_url": "https://graph.facebook.com",
+        "timeout": httpx.Timeout(connect=5.0, read=20.0, write=10.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+    },
+    "deepseek": {
+        "base_url": "https://api.deepseek.com",
+        "timeout": httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60),
+    },
+    "ical": {
+        "timeout": httpx.Timeout(connect=5.0, read=10.0, write=10.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+        "headers": {"User-Agent": "Mozilla/5.0"},
+        "follow_redirects": True,
+    },
+    "wompi": {
+        "timeout": httpx.Timeout(connect=3.0, read=15.0, write=5.0, pool=3.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+    },
+    "general": {
+        "timeout": httpx.Timeout(connect=5.0, read=15.0, write=10.0, pool=5.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+    },
+}
+
+USAR_HTTP2 = HTTP2_DISPONIBLE and os.getenv("HTTP2_HABILITADO", "1") == "1"
+
+_clientes: Dict[str, httpx.AsyncClient] = {}
+_clientes_sync: Dict[str, httpx.Client] = {}
+
+
+def _opciones(nombre: str) -> dict:
+    if nombre not in PERFILES:
+        raise KeyError(f"Perfil HTTP desconocido: {nombre}")
+    return {"http2": USAR_HTTP2, **PERFILES[nombre]}
+
+
+def cliente(nombre: str = "general") -> httpx.AsyncClient:
+    """
+    Cliente asíncrono compartido de una integración. Se crea en el lifespan;
+    si se pide antes (scripts, pruebas) se crea en ese momento.
+    """
+    actual = _clientes.get(nombre)
+    if actual is None or actual.is_closed:
+        actual = _clientes[nombre] = httpx.AsyncClient(**_opciones(nombre))
+    return actual
+
+
+def cliente_sync(nombre: str = "general") -> httpx.Client:
+    """Cliente síncrono compartido, para código que corre en hilos (rutas `def`)."""
+    actual = _clientes_sync.get(nombre)
+    if actual is None or actual.is_closed:
+        actual = _clientes_sync[nombre] = httpx.Client(**_opciones(nombre))
+    return actual
+
+
+async def iniciar_clientes():
+    for nombre in PERFILES:
+        cliente(nombre)
+    print(f"🌐 Clientes HTTP listos ({', '.join(PERFILES)}; http2={'sí' if USAR_HTTP2 else 'no'})")
+
+
+async def cerrar_clientes():
+    for actual in list(_clientes.values()):
+        await actual.aclose()
+    for actual in list(_clientes_sync.values()):
+        actual.close()
+    _clientes.clear()
+    _clientes_sync.clear()
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import time
+from typing import Dict
+
+
+class LimitadorTasa:
+    """
+    Cubeta de tokens para asyncio: permite ráfagas de hasta `capacidad` envíos
+    y en promedio `tasa` envíos por segundo. Compartida por todas las tareas
+    que hablan con el mismo proveedor.
+    """
+
+    def __init__(self, tasa: float, capacidad: float = None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa))
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    async def adquirir(self, tokens: float = 1.0):
+        """Espera hasta que haya `tokens` disponibles y los consume."""
+        async with self._lock:
+            while True:
+                self._recargar()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.tasa)
+
+    async def __aenter__(self):
+        await self.adquirir()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+# Meta limita el throughput por número de WhatsApp: el bot, el outbox y las
+# difusiones envían desde el mismo número y comparten su cubeta
+TASA_WHATSAPP = float(os.getenv("WHATSAPP_TASA_ENVIO", "60"))
+_limitadores_whatsapp: Dict[str, LimitadorTasa] = {}
+
+
+def limitador_whatsapp(phone_number_id: str) -> LimitadorTasa:
+    """La cubeta de envíos del número `phone_number_id` en esta instancia."""
+    limitador = _limitadores_whatsapp.get(phone_number_id)
+    if limitador is None:
+        limitador = _limitadores_whatsapp[phone_number_id] = LimitadorTasa(TASA_WHATSAPP)
+    return limitador
@@ -0,0 +1,36 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import jwt
+
+# Token firmado que se entrega al iniciar sesión (/usuarios y /usuarios/google).
+# Lo usan los clientes del chat para demostrar qué usuario son al conectar el socket.
+SESION_SECRETO = os.getenv("SESION_SECRETO")
+SESION_DIAS = int(os.getenv("SESION_DIAS", "30"))
+ALGORITMO = "HS256"
+
+if not SESION_SECRETO:
+    print("⚠️ SESION_SECRETO no está configurado: no se emiten tokens y el chat rechaza las conexiones con usuario")
+
+
+def emitir_token(usuario_id: str) -> Optional[str]:
+    if not SESION_SECRETO:
+        return None
+    ahora = datetime.now(timezone.utc)
+    return jwt.encode(
+        {"sub": str(usuario_id), "iat": ahora, "exp": ahora + timedelta(days=SESION_DIAS)},
+        SESION_SECRETO,
+        algorithm=ALGORITMO,
+    )
+
+
+def usuario_del_token(token: Optional[str]) -> Optional[str]:
+    """Id del usuario si el token es válido y no ha vencido; None en otro caso."""
+    if not token or not SESION_SECRETO:
+        return None
+    try:
+        datos = jwt.decode(token, SESION_SECRETO, algorithms=[ALGORITMO])
+    except jwt.PyJWTError:
+        return None
+    return datos.get("sub")
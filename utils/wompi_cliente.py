@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+import httpx
+from collections import deque
+from typing import Dict, Any, Tuple
+
+from utils.http_clientes import cliente
+from utils.circuit_breaker import breaker
+
+# URLs de la API de transacciones. Se pueden cambiar por variables de entorno
+# (por ejemplo para apuntar a un servidor Wompi falso en local).
+API_URLS = {
+    "produccion": os.getenv("WOMPI_API_URL", "https://api.wompi.co/v1/transactions"),
+    "pruebas": os.getenv("WOMPI_API_URL_SANDBOX", "https://sandbox.wompi.co/v1/transactions"),
+}
+
+# Tiempo máximo total de una llamada, contando reintentos
+PRESUPUESTO_SEG = float(os.getenv("WOMPI_PRESUPUESTO_SEGUNDOS", "20"))
+MAX_INTENTOS = int(os.getenv("WOMPI_MAX_INTENTOS", "3"))
+
+# Solo se reintenta cuando la petición no alcanzó a llegar a Wompi: crear una
+# transacción no es idempotente, así que un timeout de lectura o un 5xx no se repiten.
+ERRORES_REINTENTABLES = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class ErrorWompi(Exception):
+    """La llamada a Wompi no obtuvo respuesta (conexión o tiempo agotado)."""
+
+
+# =========================
+# MÉTRICAS
+# =========================
+_latencias: Dict[str, deque] = {}
+_contadores: Dict[str, Dict[str, int]] = {}
+
+
+def _registrar(operacion: str, latencia_ms: float, resultado: str):
+    _latencias.setdefault(operacion, deque(maxlen=500)).append(latencia_ms)
+    contador = _contadores.setdefault(operacion, {})
+    contador[resultado] = contador.get(resultado, 0) + 1
+
+
+def _percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+
+def metricas() -> Dict[str, Any]:
+    """Latencia (ms) de las últimas llamadas por operación y conteo de resultados."""
+    resumen = {}
+    for operacion, valores in _latencias.items():
+        resumen[operacion] = {
+            "muestras": len(valores),
+            "p50_ms": round(_percentil(valores, 0.50), 1),
+            "p95_ms": round(_percentil(valores, 0.95), 1),
+            "max_ms": round(max(valores), 1),
+            "resultados": dict(_contadores.get(operacion, {})),
+        }
+    return resumen
+
+
+# =========================
+# LLAMADAS
+# =========================
+async def _post(operacion: str, url: str, json: Dict[str, Any], headers: Dict[str, str]) -> httpx.Response:
+    limite = time.monotonic() + PRESUPUESTO_SEG
+    ultimo_error = None
+    for intento in range(1, MAX_INTENTOS + 1):
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        inicio = time.perf_counter()
+        try:
+            # CircuitoAbierto se propaga: no tiene sentido reintentar
+            with breaker("wompi").llamada() as llamada:
+                respuesta = await cliente("wompi").post(
+                    url, json=json, headers=headers,
+                    timeout=httpx.Timeout(restante, connect=min(3.0, restante)),
+                )
+                if respuesta.status_code >= 500:
+                    llamada.marcar_fallo()
+        except ERRORES_REINTENTABLES as e:
+            _registrar(operacion, (time.perf_counter() - inicio) * 1000, "error_conexion")
+            ultimo_error = e
+            print(f"⚠️ Wompi {operacion}: sin conexión (intento {intento}/{MAX_INTENTOS}): {e}")
+            await asyncio.sleep(min(0.2 * 2 ** (intento - 1), max(0.0, limite - time.monotonic())))
+            continue
+        except httpx.HTTPError as e:
+            _registrar(operacion, (time.perf_counter() - inicio) * 1000, "error")
+            raise ErrorWompi(f"Error llamando a Wompi: {e}") from e
+        _registrar(operacion, (time.perf_counter() - inicio) * 1000, str(respuesta.status_code))
+        return respuesta
+    raise ErrorWompi(f"No se pudo conectar con Wompi: {ultimo_error or 'tiempo agotado'}")
+
+
+async def crear_transaccion(datos: Dict[str, Any], private_key: str, modo: str = "pruebas") -> Tuple[int, Dict[str, Any]]:
+    """Crea una transacción en Wompi. Retorna (status HTTP, cuerpo JSON)."""
+    respuesta = await _post(
+        "crear_transaccion",
+        API_URLS[modo],
+        json=datos,
+        headers={
+            "Authorization": f"Bearer {private_key}",
+            "Content-Type": "application/json",
+        },
+    )
+    try:
+        cuerpo = respuesta.json()
+    except ValueError:
+        cuerpo = {"error": respuesta.text}
+    return respuesta.status_code, cuerpo